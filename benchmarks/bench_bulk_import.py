@@ -0,0 +1,69 @@
+"""
+Bulk Import Benchmark - Warm start from saved conversation files
+
+Compares loading files one by one with load_conversation against the
+parallel bulk loader on threads and on processes.
+
+Run with: python benchmarks/bench_bulk_import.py --files 5000 --messages 40
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.bulk_loader import bulk_load, find_conversation_files, orjson
+from src.core.memory_manager import ConversationMemory
+
+
+def make_files(directory: str, files: int, messages: int):
+    memory = ConversationMemory(max_history=messages, data_dir=directory)
+    for i in range(files):
+        user_id = f"user_{i}"
+        for m in range(messages):
+            memory.add_message(user_id, "user" if m % 2 == 0 else "assistant",
+                               f"Message {m} in a conversation about topic {i}, with some typical length text.")
+        memory.save_conversation(user_id, f"conversation_{user_id}.json")
+        memory.clear_conversation(user_id)
+
+
+def serial_load(directory: str, messages: int) -> float:
+    memory = ConversationMemory(max_history=messages, data_dir=directory)
+    start = time.perf_counter()
+    for path in find_conversation_files(directory):
+        user_id = os.path.basename(path)[len("conversation_"):-len(".json")]
+        memory.load_conversation(user_id, path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark warm start from saved conversations")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        make_files(directory, args.files, args.messages)
+        size = sum(os.path.getsize(p) for p in find_conversation_files(directory)) / 1e6
+        print(f"{args.files} files, {size:.1f} MB, parser: {'orjson' if orjson is not None else 'json'}, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'loader':<26} {'seconds':>8} {'files/s':>9} {'MB/s':>7}")
+
+        elapsed = serial_load(directory, args.messages)
+        print(f"{'load_conversation loop':<26} {elapsed:>8.2f} {args.files / elapsed:>9,.0f} {size / elapsed:>7.1f}")
+        for processes in (False, True):
+            memory = ConversationMemory(max_history=args.messages, data_dir=directory)
+            stats = bulk_load(memory, workers=args.workers, processes=processes)
+            print(f"{'bulk_load ' + stats['pool']:<26} {stats['seconds']:>8.2f} "
+                  f"{stats['files_per_s']:>9,.0f} {stats['mb_per_s']:>7.1f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Intent Engine Benchmark - Lookup throughput vs. number of intents
+
+Run with: python benchmarks/bench_intent_engine.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.intent_engine import IntentEngine, tokenize
+
+MESSAGE_WORDS = 24
+LOOKUPS = 20000
+
+
+def make_intents(n: int):
+    """Synthetic intents with one and two word patterns"""
+    intents = []
+    for i in range(n):
+        patterns = [f"topic{i}"] if i % 2 else [f"about topic{i}", f"tell me{i}"]
+        intents.append({
+            "name": f"intent{i}",
+            "priority": i % 7,
+            "patterns": patterns,
+            "responses": [f"response {i}"]
+        })
+    return intents
+
+
+def make_messages(n_intents: int, count: int = 1000):
+    """Messages of fixed length, about half of them hitting an intent"""
+    rng = random.Random(42)
+    filler = ["please", "can", "you", "explain", "the", "idea", "of", "this", "thing"]
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(filler) for _ in range(MESSAGE_WORDS)]
+        if rng.random() < 0.5:
+            words[rng.randrange(MESSAGE_WORDS)] = f"topic{rng.randrange(n_intents)}"
+        messages.append(" ".join(words))
+    return messages
+
+
+# Short chat messages for the intents shipped in src/core/data/intents.json
+SHIPPED_MESSAGES = [
+    "hi there", "Hello! How are you doing today?", "what is your name?",
+    "Can you help me fix my Python script?", "thanks, that worked",
+    "tell me about artificial intelligence", "what's the weather like",
+    "I need to refactor this function before the release",
+    "does the order of these arguments matter", "ok see you later",
+]
+
+
+def naive_match(intents, text):
+    """The old approach: check every pattern against the message"""
+    lowered = text.lower()
+    for intent in intents:
+        for pattern in intent["patterns"]:
+            if pattern in lowered:
+                return intent
+    return None
+
+
+def bench(label, fn, messages):
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        fn(messages[i % len(messages)])
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<22} {LOOKUPS / elapsed:>12,.0f} lookups/s  ({elapsed / LOOKUPS * 1e6:.2f} us/lookup)")
+
+
+def main():
+    for n in (10, 10_000):
+        intents = make_intents(n)
+        messages = make_messages(n)
+
+        start = time.perf_counter()
+        engine = IntentEngine(intents)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{n:,} intents (build {build_ms:.1f} ms, {MESSAGE_WORDS}-word messages)")
+        bench("compiled automaton", engine.match, messages)
+        bench("tokenize only", tokenize, messages)
+        bench("naive substring scan", lambda m: naive_match(intents, m), messages)
+
+    engine = IntentEngine.from_file()
+    print(f"shipped intents ({len(engine)}, short chat messages)")
+    bench("compiled automaton", engine.match, SHIPPED_MESSAGES)
+    bench("naive substring scan", lambda m: naive_match(engine.intents, m), SHIPPED_MESSAGES)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Journal Recovery Benchmark - Startup time of the JSONL journal store
+
+Writes the same history twice: once left entirely in the journals and once
+compacted into snapshots with a short journal tail, then times how long a
+fresh store takes to rebuild its state from each.
+
+Run with: python benchmarks/bench_journal_recovery.py --users 10000 --messages 20
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.journal_store import JournalConversationStore
+from src.core.message import Message
+
+
+def write_history(directory: str, users: int, messages: int, snapshot: bool, tail: int, retain: int):
+    store = JournalConversationStore(directory, retain=retain, fsync_interval=3600)
+    content = "How do I read a file line by line in Python without loading it all?"
+    start = time.perf_counter()
+    for m in range(messages):
+        if snapshot and m == messages - tail:
+            for shard in store._shards:
+                store.compact(shard)
+        for u in range(users):
+            store.append(f"user_{u}", Message("user" if m % 2 == 0 else "assistant", content, float(m), m + 1, 16))
+    elapsed = time.perf_counter() - start
+    store.close()
+    return users * messages / elapsed
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark journal store recovery")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=20, help="messages written per user")
+    parser.add_argument("--tail", type=int, default=2, help="messages per user written after the snapshot")
+    parser.add_argument("--retain", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{args.users} users x {args.messages} messages")
+    print(f"{'layout':<22} {'appends/s':>10} {'on disk MB':>11} {'replayed':>10} {'recovery s':>11}")
+    for name, snapshot in (("journal only", False), ("snapshot + tail", True)):
+        directory = tempfile.mkdtemp()
+        try:
+            rate = write_history(directory, args.users, args.messages, snapshot, args.tail, args.retain)
+            size = directory_size(directory)
+            store = JournalConversationStore(directory, retain=args.retain, fsync_interval=3600)
+            stats = store.stats()
+            store.close()
+            print(f"{name:<22} {rate:>10,.0f} {size / 1e6:>11.1f} {stats['recovered_records']:>10} "
+                  f"{stats['recovery_seconds']:>11.3f}")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Conversation Memory Benchmark - Resident memory and add_message throughput at many users
+
+Compares the previous dict-per-message store (ISO timestamp strings, list
+slice on every trim) with the slotted Message / ring-buffer store.
+
+Run with: python benchmarks/bench_memory.py --users 100000 --messages 12 --max-history 4
+"""
+import argparse
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.context_packer import estimate_tokens
+from src.core.memory_manager import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class LegacyMemory:
+    """The pre-ring-buffer add_message, kept here for comparison"""
+
+    def __init__(self, max_history: int = 20):
+        self.max_history = max_history
+        self.conversations = {}
+
+    def add_message(self, user_id: str, role: str, content: str):
+        if user_id not in self.conversations:
+            self.conversations[user_id] = []
+        message = {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.now().isoformat(),
+            "message_id": len(self.conversations[user_id]) + 1,
+            "tokens": estimate_tokens(content)
+        }
+        self.conversations[user_id].append(message)
+        if len(self.conversations[user_id]) > self.max_history * 2:
+            self.conversations[user_id] = self.conversations[user_id][-self.max_history * 2:]
+        logger.debug(f"Added message to user {user_id}: {role} - {content[:50]}...")
+
+
+def fill(memory, users: int, messages: int, contents):
+    """Round-robin messages over users, as concurrent sessions would arrive"""
+    user_ids = [f"user_{i}" for i in range(users)]
+    for m in range(messages):
+        role = "user" if m % 2 == 0 else "assistant"
+        content = contents[m % len(contents)]
+        for user_id in user_ids:
+            memory.add_message(user_id, role, content)
+
+
+def measure(factory, users: int, messages: int, contents):
+    # Throughput without tracing overhead
+    memory = factory()
+    gc.collect()
+    start = time.perf_counter()
+    fill(memory, users, messages, contents)
+    elapsed = time.perf_counter() - start
+    del memory
+    gc.collect()
+
+    # Resident size of the store; message strings are shared, so this is the per-message overhead
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    memory = factory()
+    fill(memory, users, messages, contents)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return users * messages / elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ConversationMemory at scale")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=12, help="messages added per user")
+    parser.add_argument("--max-history", type=int, default=4, help="exchanges kept per user")
+    args = parser.parse_args()
+
+    contents = ["Hello, can you help me with Python?", "Of course! What would you like to know?",
+                "How do I read a file line by line?", "Use a with block and iterate over the file object."]
+    data_dir = tempfile.mkdtemp()
+    stores = [
+        ("dict + list (before)", lambda: LegacyMemory(args.max_history)),
+        ("slots + ring buffer", lambda: ConversationMemory(args.max_history, data_dir=data_dir))
+    ]
+
+    kept = min(args.messages, args.max_history * 2)
+    print(f"{args.users} users x {args.messages} messages (keeping {kept} each)")
+    print(f"{'store':<22} {'add_message/s':>14} {'resident MB':>12} {'bytes/msg':>10}")
+    for name, factory in stores:
+        rate, size = measure(factory, args.users, args.messages, contents)
+        print(f"{name:<22} {rate:>14,.0f} {size / 1e6:>12.1f} {size / (args.users * kept):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
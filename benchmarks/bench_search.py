@@ -0,0 +1,93 @@
+"""
+Search Index Benchmark - Indexing throughput and query latency at millions of messages
+
+Builds an index of synthetic messages (Zipf-like vocabulary, so there are
+both very common and rare terms) and times queries of each kind, plus the
+snapshot and reload of the persisted index.
+
+Run with: python benchmarks/bench_search.py --messages 1000000 --users 50000
+"""
+import argparse
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.search_index import SearchIndex
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = {"".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size * 2)}
+    words = sorted(words)[:size]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def time_queries(index: SearchIndex, queries, **filters):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, **filters)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the conversation search index")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    words, cum_weights = make_vocabulary(args.vocabulary, rng)
+    directory = tempfile.mkdtemp()
+    try:
+        index = SearchIndex(directory, snapshot_every=args.messages * 2)
+        start = time.perf_counter()
+        for i in range(args.messages):
+            text = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(6, 30)))
+            index.add(f"user_{i % args.users}", i // args.users + 1, "user", text, 1.7e9 + i)
+        elapsed = time.perf_counter() - start
+        print(f"indexed {args.messages:,} messages in {elapsed:.1f}s "
+              f"({args.messages / elapsed:,.0f} msg/s), {len(words):,} terms")
+
+        mid = len(words) // 2
+        cases = {
+            "rare term": [rng.choice(words[mid:]) for _ in range(args.queries)],
+            "two mid terms": [f"{rng.choice(words[100:1000])} {rng.choice(words[100:1000])}"
+                              for _ in range(args.queries)],
+            "common + rare": [f"{words[0]} {rng.choice(words[mid:])}" for _ in range(args.queries)],
+            "common term": [words[rng.randint(0, 9)] for _ in range(args.queries // 10)],
+        }
+        print(f"{'query':<28} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, queries in cases.items():
+            p50, p99 = time_queries(index, queries)
+            print(f"{name:<28} {p50:>8.2f} {p99:>8.2f}")
+        p50, p99 = time_queries(index, cases["two mid terms"], user_id="user_7")
+        print(f"{'two mid terms, one user':<28} {p50:>8.2f} {p99:>8.2f}")
+        p50, p99 = time_queries(index, cases["rare term"], since=1.7e9 + args.messages * 0.9)
+        print(f"{'rare term, last 10%':<28} {p50:>8.2f} {p99:>8.2f}")
+
+        start = time.perf_counter()
+        index.close()
+        print(f"snapshot: {time.perf_counter() - start:.1f}s, "
+              f"{os.path.getsize(os.path.join(directory, 'snapshot.jsonl')) / 1e6:.0f} MB")
+        start = time.perf_counter()
+        SearchIndex(directory)
+        print(f"reload:   {time.perf_counter() - start:.1f}s")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
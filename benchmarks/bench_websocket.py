@@ -0,0 +1,151 @@
+"""
+WebSocket Benchmark - Many idle plus some active chat sockets on one worker
+
+Starts the offline stack (fake providers + one uvicorn worker), opens
+--idle WebSocket sessions that only answer heartbeats, then drives
+--active sessions that each send --messages messages and time every
+streamed reply. The same number of messages is then sent through the
+HTTP /chat/stream path with the same concurrency for comparison. Server
+memory is read from /proc before and after the idle sockets connect.
+
+    python benchmarks/bench_websocket.py --idle 10000 --active 1000 --messages 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+from typing import List
+
+import websockets
+
+from load_test import run_load, spawn_stack, stop_stack, summarize
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def read_frames(ws, frames: "asyncio.Queue"):
+    """Answer heartbeats and pass every other frame on"""
+    async for raw in ws:
+        frame = json.loads(raw)
+        if frame["type"] == "ping":
+            await ws.send('{"type": "pong"}')
+        else:
+            frames.put_nowait(frame)
+
+
+async def idle_session(url: str, stop: asyncio.Event, opened: List[int]):
+    async with websockets.connect(url, max_queue=4, ping_interval=None, open_timeout=None) as ws:
+        frames = asyncio.Queue()
+        reader = asyncio.ensure_future(read_frames(ws, frames))
+        await frames.get()  # session frame
+        opened.append(1)
+        await stop.wait()
+        reader.cancel()
+
+
+async def active_session(url: str, messages: int, connected: asyncio.Event, go: asyncio.Event,
+                         latencies: List[float], errors: List[str]):
+    try:
+        async with websockets.connect(url, ping_interval=None, open_timeout=None) as ws:
+            frames = asyncio.Queue()
+            reader = asyncio.ensure_future(read_frames(ws, frames))
+            await frames.get()
+            connected.set()
+            await go.wait()
+            for i in range(messages):
+                start = time.perf_counter()
+                await ws.send(json.dumps({"type": "message", "message": f"Tell me about subject number {i}"}))
+                while (await frames.get())["type"] != "done":
+                    pass
+                latencies.append(time.perf_counter() - start)
+            reader.cancel()
+    except Exception as e:
+        connected.set()
+        errors.append(type(e).__name__)
+
+
+async def run(args, chat_url: str, server_pid: int):
+    ws_url = chat_url.replace("http://", "ws://") + "/ws/chat"
+    baseline = rss_mb(server_pid)
+
+    stop = asyncio.Event()
+    opened: List[int] = []
+    start = time.perf_counter()
+    idle = []
+    for i in range(args.idle):
+        idle.append(asyncio.ensure_future(idle_session(f"{ws_url}?user_id=idle_{i}", stop, opened)))
+        if i % 500 == 499:
+            await asyncio.sleep(0.05)  # stay under the listen backlog
+    while len(opened) < args.idle and time.perf_counter() - start < 120:
+        await asyncio.sleep(0.2)
+    await asyncio.sleep(1.0)
+    with_idle = rss_mb(server_pid)
+    print(f"idle sockets open: {len(opened):,} in {time.perf_counter() - start:.1f}s; server RSS "
+          f"{baseline:.0f} MB -> {with_idle:.0f} MB "
+          f"({(with_idle - baseline) * 1024 / max(len(opened), 1):.1f} KB per socket)")
+
+    # Connect the active clients first, then send from all of them at once
+    latencies: List[float] = []
+    errors: List[str] = []
+    go = asyncio.Event()
+    active = []
+    for i in range(args.active):
+        connected = asyncio.Event()
+        active.append(asyncio.ensure_future(active_session(
+            f"{ws_url}?user_id=active_{i}", args.messages, connected, go, latencies, errors)))
+        await connected.wait()
+    start = time.perf_counter()
+    go.set()
+    await asyncio.gather(*active)
+    ws_result = summarize(latencies, len(errors), time.perf_counter() - start)
+    if errors:
+        print(f"WebSocket client errors: {sorted(set(errors))}")
+
+    http_result = await run_load(chat_url, "/chat/stream", args.active * args.messages, args.active,
+                                 users=args.active)
+    stop.set()
+    await asyncio.gather(*idle, return_exceptions=True)
+
+    print(f"{args.active} active clients x {args.messages} messages, with the idle sockets still open")
+    print(f"{'':<16} {'WebSocket':>12} {'HTTP stream':>12}")
+    for key in ("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+        print(f"{key:<16} {ws_result[key]:>12} {http_result[key]:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WebSocket sessions against HTTP streaming")
+    parser.add_argument("--idle", type=int, default=10000)
+    parser.add_argument("--active", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--latency", default="fixed:0.05")
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    args.error_rate = 0.0
+    args.providers = "openrouter"
+    args.routing_mode = "sequential"
+
+    # Client and server each hold one descriptor per socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.idle + args.active * 2 + 256
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    # Heartbeats are answered, but a saturated single-CPU run can delay them
+    os.environ.setdefault("WS_IDLE_TIMEOUT", "600")
+    chat_url, _, processes = spawn_stack(args)
+    try:
+        asyncio.run(run(args, chat_url, processes[1].pid))
+    finally:
+        stop_stack(processes)
+
+
+if __name__ == "__main__":
+    main()
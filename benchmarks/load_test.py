@@ -0,0 +1,195 @@
+"""
+Load Test - Drive /chat with many simulated users and report latency percentiles
+
+Fully offline: with --spawn (the default when no --url is given) it starts
+the fake provider server and the FastAPI chat server as subprocesses on
+free local ports, routes every message to the remote providers, and tears
+both down afterwards.
+
+    python benchmarks/load_test.py --requests 2000 --concurrency 100 --latency lognormal:0.2:0.5
+    python benchmarks/load_test.py --url http://localhost:8000 --endpoint /chat/stream
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+def spawn_stack(args) -> (str, str, List[subprocess.Popen]):
+    """Start the fake providers and the chat server; returns (chat_url, provider_url, processes)"""
+    provider_port, chat_port = _free_port(), _free_port()
+    provider_url = f"http://127.0.0.1:{provider_port}"
+    chat_url = f"http://127.0.0.1:{chat_port}"
+
+    provider = subprocess.Popen(
+        [sys.executable, "-m", "src.web.fake_providers", "--port", str(provider_port),
+         "--latency", args.latency, "--error-rate", str(args.error_rate),
+         "--token-delay", str(args.token_delay), "--seed", "7"],
+        cwd=ROOT
+    )
+    env = dict(
+        os.environ,
+        HUGGINGFACE_URL=f"{provider_url}/models/fake-model",
+        OPENROUTER_URL=f"{provider_url}/api/v1/chat/completions",
+        LOCAL_DEFAULT_RESPONSES="false",
+        REMOTE_PROVIDERS=args.providers,
+        ROUTING_MODE=args.routing_mode
+    )
+    chat = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.web.fastapi_server:app",
+         "--host", "127.0.0.1", "--port", str(chat_port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    processes = [provider, chat]
+    try:
+        _wait_ready(f"{provider_url}/_stats")
+        _wait_ready(f"{chat_url}/health")
+    except Exception:
+        stop_stack(processes)
+        raise
+    return chat_url, provider_url, processes
+
+
+def stop_stack(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def run_load(base_url: str, endpoint: str = "/chat", requests: int = 1000, concurrency: int = 50,
+                   users: int = 200, unique_ratio: float = 1.0, seed: int = 42,
+                   client: Optional[httpx.AsyncClient] = None) -> Dict:
+    """Send `requests` chat messages from `users` simulated users with bounded concurrency"""
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+    own_client = client is None
+    client = client or httpx.AsyncClient(
+        base_url=base_url,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    )
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            user_id = f"load_user_{rng.randrange(users)}"
+            topic = i if rng.random() < unique_ratio else rng.randrange(10)
+            payload = {"message": f"Tell me about subject number {topic}", "user_id": user_id}
+            start = time.perf_counter()
+            try:
+                if endpoint.endswith("/stream"):
+                    async with client.stream("POST", endpoint, json=payload) as response:
+                        async for _ in response.aiter_bytes():
+                            pass
+                        ok = response.status_code == 200
+                else:
+                    response = await client.post(endpoint, json=payload)
+                    ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    finally:
+        if own_client:
+            await client.aclose()
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat API")
+    parser.add_argument("--url", help="chat server to test (default: spawn a local offline stack)")
+    parser.add_argument("--endpoint", default="/chat")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--unique-ratio", type=float, default=1.0, help="fraction of prompts that are unique (rest repeat)")
+    parser.add_argument("--latency", default="lognormal:0.2:0.5", help="fake provider latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake provider error rate")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="fake provider delay between streamed tokens")
+    parser.add_argument("--providers", default="huggingface,openrouter")
+    parser.add_argument("--routing-mode", default="sequential")
+    args = parser.parse_args()
+
+    processes = []
+    provider_url = None
+    base_url = args.url
+    if base_url is None:
+        base_url, provider_url, processes = spawn_stack(args)
+
+    try:
+        result = asyncio.run(run_load(
+            base_url, args.endpoint, args.requests, args.concurrency, args.users, args.unique_ratio
+        ))
+        print(f"Load test against {base_url}{args.endpoint}")
+        for key, value in result.items():
+            print(f"  {key:<16} {value}")
+        if provider_url:
+            print(f"  provider calls   {httpx.get(f'{provider_url}/_stats').json()}")
+    finally:
+        stop_stack(processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ setup(
     version="1.0.0",
     description="AI-powered chat bot with OpenAI integration",
     packages=find_packages(),
+    package_data={"src.core": ["data/*.json"]},
     install_requires=requirements,
     python_requires=">=3.11",
     author="Vance Frommer",
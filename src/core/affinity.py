@@ -0,0 +1,54 @@
+"""
+User Affinity - Consistent-hash routing of users to worker nodes
+"""
+import bisect
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """
+    Maps each user to one node so the user's hot history stays resident there.
+
+    Every node is placed on the ring at `vnodes` points; adding or removing a
+    node only moves the users that hash next to its points (about 1/n of them)
+    instead of reshuffling everyone.
+    """
+
+    def __init__(self, nodes: Optional[List[str]] = None, vnodes: int = 100):
+        self.vnodes = vnodes
+        self._ring: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        for node in nodes or []:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._owners.values()))
+
+    def add_node(self, node: str):
+        with self._lock:
+            for i in range(self.vnodes):
+                point = _hash(f"{node}#{i}")
+                if point not in self._owners:
+                    bisect.insort(self._ring, point)
+                    self._owners[point] = node
+
+    def remove_node(self, node: str):
+        with self._lock:
+            self._ring = [p for p in self._ring if self._owners[p] != node]
+            self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def node_for(self, key: str) -> Optional[str]:
+        """Node that owns a key (the first ring point clockwise from its hash)"""
+        ring = self._ring
+        if not ring:
+            return None
+        index = bisect.bisect(ring, _hash(key)) % len(ring)
+        return self._owners[ring[index]]
@@ -2,38 +2,464 @@
 Multi-API Client - Fixed and working version
 """
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
 import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .intent_engine import IntentEngine
+from .batching import MicroBatcher
+from .coalescing import SingleFlight
+from .provider_health import ProviderHealthTracker
+from .request_context import RequestAborted, RequestContext
+from .batching import BatchStats
+from .response_cache import ResponseCache, create_response_cache, make_cache_key
+from ..utils.config_loader import load_config, PROVIDER_DEFAULTS
+from ..utils.metrics import MetricsRegistry
 
 logger = logging.getLogger(__name__)
 
+_CHUNK_RE = re.compile(r"\S+\s*|\s+")
+
+def chunk_text(text: str):
+    """Split a finished reply into word tokens for streaming"""
+    for match in _CHUNK_RE.finditer(text):
+        yield match.group(0)
+
 class MultiAPIClient:
-    def __init__(self):
-        self.usage_stats = {"total_requests": 0, "errors": 0}
+    def __init__(self, config: Optional[Dict] = None, health: Optional[ProviderHealthTracker] = None,
+                 cache: Optional[ResponseCache] = None, metrics: Optional[MetricsRegistry] = None):
+        self.config = config or load_config()
+        
+        # Usage numbers live in a thread-safe registry (also served at /metrics)
+        self.metrics = metrics or MetricsRegistry()
+        self._register_metrics()
+        
+        # Compile the local intent index once instead of on every request
+        self.intent_engine = IntentEngine.from_file(self.config.get('intents_file'))
+        self.local_default_responses = self.config.get('local_default_responses', True)
+        
+        # Pooled keep-alive HTTP sessions, created on first use
+        self._sessions: Dict[str, requests.Session] = {}
+        self._sessions_lock = threading.Lock()
+        
+        # Remote provider routing: sequential, hedged or parallel within one deadline
+        self.remote_providers = list(self.config.get('remote_providers', ["huggingface"]))
+        self.routing_mode = self.config.get('routing_mode', "sequential")
+        self.hedge_delay = self.config.get('hedge_delay', 0.5)
+        self.request_deadline = self.config.get('request_deadline', 20.0)
+        self._race_executor: Optional[ThreadPoolExecutor] = None
+        self._coalesce_executor: Optional[ThreadPoolExecutor] = None
+        self._pools_lock = threading.Lock()
+        
+        # Circuit breakers and health scores decide which providers are tried, and in what order
+        self.health = health or ProviderHealthTracker(self.remote_providers, self.config)
+        self.health.start_probe(self._probe_provider, self.config.get('health_probe_interval', 0))
+        
+        # Cache for remote answers, keyed by prompt tail and sampling parameters
+        self.cache = cache if cache is not None else create_response_cache(self.config)
+        self.cache_nondeterministic = self.config.get('cache_nondeterministic', False)
         
-    def chat_completion(self, messages: List[Dict], model: str = "huggingface", temperature: float = 0.7, max_tokens: int = 200) -> Dict:
+        # Identical requests already in flight share one upstream call
+        self.coalesce_requests = self.config.get('coalesce_requests', True)
+        self._inflight = SingleFlight()
+        
+        # Micro-batching of Hugging Face calls (one HTTP request carries many prompts)
+        self.batching_enabled = self.config.get('batching_enabled', False)
+        self._hf_batcher: Optional[MicroBatcher] = None
+        
+    def chat_completion(self, messages: List[Dict], model: str = "huggingface", temperature: float = 0.7, max_tokens: int = 200,
+                        use_cache: bool = True, stream: bool = False, context: Optional[RequestContext] = None):
         """
         Try multiple AI providers in order
+        
+        With stream=True an iterator of text tokens is returned instead of a
+        response dict.
+        
+        With a context, provider calls get no more than its remaining time and
+        RequestAborted is raised once it is cancelled or past its deadline.
         """
-        self.usage_stats["total_requests"] += 1
+        if stream:
+            return self._stream_completion(messages, model, temperature, max_tokens, use_cache, context)
         
+        self._m_requests.inc()
+        with self._m_inflight.track_inprogress():
+            return self._complete(messages, model, temperature, max_tokens, use_cache, context)
+    
+    def _complete(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, use_cache: bool,
+                  context: Optional[RequestContext] = None) -> Dict:
+        """Local intents, then cache, then remote providers, then the fallback"""
         # Convert messages to prompt
         prompt = self._messages_to_prompt(messages)
         
         # Try local responses first (most reliable)
         response = self._local_intelligent_response(prompt, messages)
         if response["success"]:
+            self._m_responses.inc(source="local")
             return response
+        
+        # Serve repeated remote answers from the cache
+        cache_key = self._cache_key(prompt, model, temperature, max_tokens) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            self._m_responses.inc(source="cache")
+            return cached
             
-        # Try Hugging Face
-        response = self._try_huggingface(prompt)
+        # Try remote providers within the request deadline (shared with identical in-flight requests,
+        # so the shared call is not tied to any one caller's context)
+        if context is not None:
+            context.check()
+        if cache_key is not None and self.coalesce_requests:
+            def call():
+                return self._inflight.do(cache_key, lambda: self._call_remote_providers(prompt, temperature, max_tokens))
+            
+            if context is None:
+                response, shared = call()
+            else:
+                # Run the shared call on its own pool so this caller can give up on it alone; not
+                # on the race pool, whose threads the call may itself need for hedged attempts
+                future = self._coalesce_pool().submit(call)
+                if not self._wait_or_abort(future, context, context.remaining()):
+                    context.check()
+                response, shared = future.result()
+            response = self._coalesced(response, shared)
+        else:
+            response = self._call_remote_providers(prompt, temperature, max_tokens, context)
         if response["success"]:
+            self._m_responses.inc(source="remote")
+            self._cache_set(cache_key, response)
             return response
             
-        # Final fallback
-        return self._fallback_response(prompt)
+        # Final fallback, unless nobody is waiting for it any more
+        if context is not None:
+            context.check()
+        self._m_responses.inc(source="fallback")
+        fallback = self._fallback_response(prompt)
+        fallback["routing"] = response.get("routing")
+        return fallback
+    
+    def _register_metrics(self):
+        """Create (or look up, when the registry is shared) this client's metrics"""
+        m = self.metrics
+        self._m_requests = m.counter("aicb_chat_requests_total", "chat_completion calls")
+        self._m_inflight = m.gauge("aicb_chat_requests_in_flight", "chat_completion calls in progress")
+        self._m_responses = m.counter("aicb_chat_responses_total", "Responses by source (local, cache, remote, fallback)", ["source"])
+        self._m_cache = m.counter("aicb_cache_lookups_total", "Response cache lookups by result", ["result"])
+        self._m_coalesced = m.counter("aicb_coalesced_requests_total", "Requests answered by another caller's in-flight upstream call")
+        self._m_provider_requests = m.counter("aicb_provider_requests_total", "Remote provider calls by outcome", ["provider", "outcome"])
+        self._m_provider_latency = m.histogram("aicb_provider_latency_seconds", "Remote provider call latency", ["provider"])
+        self._m_provider_inflight = m.gauge("aicb_provider_requests_in_flight", "Remote provider calls in progress", ["provider"])
+        self._m_provider_aborted = m.counter("aicb_provider_calls_aborted_total",
+                                             "Provider calls cut short because the request was cancelled or out of time", ["provider"])
+    
+    def _record_provider(self, name: str, success: bool, latency: float):
+        """Feed one provider call outcome to the health tracker and the metrics"""
+        self.health.record(name, success, latency)
+        self._m_provider_requests.inc(provider=name, outcome="success" if success else "error")
+        self._m_provider_latency.observe(latency, provider=name)
+    
+    def _stream_completion(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, use_cache: bool,
+                           context: Optional[RequestContext] = None):
+        """Token iterator behind chat_completion(stream=True)"""
+        self._m_requests.inc()
+        with self._m_inflight.track_inprogress():
+            yield from self._stream_tokens(messages, model, temperature, max_tokens, use_cache, context)
+    
+    def _stream_tokens(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, use_cache: bool,
+                       context: Optional[RequestContext] = None):
+        prompt = self._messages_to_prompt(messages)
+        
+        response = self._local_intelligent_response(prompt, messages)
+        if response["success"]:
+            self._m_responses.inc(source="local")
+            yield from chunk_text(response["content"])
+            return
+        
+        cache_key = self._cache_key(prompt, model, temperature, max_tokens) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            self._m_responses.inc(source="cache")
+            yield from chunk_text(cached["content"])
+            return
+        
+        # Stream from the first healthy provider that produces tokens
+        deadline = self._deadline(time.monotonic(), context)
+        for name in self.health.order(self.remote_providers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self.health.acquire(name):
+                continue
+            start = time.monotonic()
+            parts = []
+            try:
+                with self._m_provider_inflight.track_inprogress(provider=name):
+                    for token in self._stream_provider(name, prompt, temperature, max_tokens, remaining):
+                        if context is not None:
+                            context.check()  # leaving the loop closes the provider's response
+                        parts.append(token)
+                        yield token
+            except GeneratorExit:
+                self.health.release(name)
+                raise
+            except RequestAborted:
+                self.health.release(name)
+                self._m_provider_aborted.inc(provider=name)
+                raise
+            except Exception as e:
+                logger.error(f"{name} stream error: {e}")
+            self._record_provider(name, bool(parts), time.monotonic() - start)
+            if parts:
+                self._m_responses.inc(source="remote")
+                self._cache_set(cache_key, self._streamed_response(name, parts))
+                return
+        
+        if context is not None:
+            context.check()
+        self._m_responses.inc(source="fallback")
+        yield from chunk_text(self._fallback_response(prompt)["content"])
+    
+    def _streamed_response(self, name: str, parts: List[str]) -> Dict:
+        """Response dict for a completed stream (what gets cached)"""
+        return {
+            "success": True,
+            "content": "".join(parts),
+            "model": self._provider_settings(name)['model'],
+            "provider": name
+        }
+    
+    def _cache_key(self, prompt: str, model: str, temperature: float, max_tokens: int) -> Optional[str]:
+        """Cache/coalescing key for a request, or None when answers must not be shared"""
+        if temperature > 0 and not self.cache_nondeterministic:
+            return None
+        return make_cache_key(prompt, model, temperature, max_tokens)
+    
+    def _coalesced(self, response: Dict, shared: bool) -> Dict:
+        """Mark (a copy of) a response that was shared from another caller's upstream call"""
+        if not shared:
+            return response
+        self._m_coalesced.inc()
+        return {**response, "coalesced": True}
+    
+    def _cache_get(self, cache_key: Optional[str]) -> Optional[Dict]:
+        if cache_key is None or self.cache is None:
+            return None
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            self._m_cache.inc(result="miss")
+            return None
+        self._m_cache.inc(result="hit")
+        cached["cached"] = True
+        return cached
+    
+    def _cache_set(self, cache_key: Optional[str], response: Dict):
+        if cache_key is None or self.cache is None or response.get("coalesced"):
+            return
+        entry = {k: v for k, v in response.items() if k != "routing"}
+        self.cache.set(cache_key, entry)
+    
+    def _provider_call(self, name: str):
+        """Sync call function for a remote provider"""
+        return {
+            "huggingface": self._try_huggingface,
+            "openrouter": self._try_openrouter
+        }[name]
+    
+    def _call_provider(self, name: str, prompt: str, temperature: float, max_tokens: int, timeout: float) -> Dict:
+        """Call a provider whose health slot is already acquired and record the outcome"""
+        start = time.monotonic()
+        with self._m_provider_inflight.track_inprogress(provider=name):
+            response = self._provider_call(name)(prompt, temperature=temperature, max_tokens=max_tokens, timeout=timeout)
+        self._record_provider(name, response["success"], time.monotonic() - start)
+        return response
+    
+    def _await_provider(self, name: str, prompt: str, temperature: float, max_tokens: int, timeout: float,
+                        context: Optional[RequestContext] = None) -> Dict:
+        """
+        _call_provider, except that with a context the caller stops waiting as
+        soon as the request is aborted (the call itself ends within its timeout)
+        """
+        if context is None:
+            return self._call_provider(name, prompt, temperature, max_tokens, timeout)
+        
+        future = self._race_pool().submit(self._call_provider, name, prompt, temperature, max_tokens, timeout)
+        if not self._wait_or_abort(future, context, timeout) and context.done:
+            self._cancel_losers({future: name})
+            context.check()
+        return future.result()
+    
+    @staticmethod
+    @contextmanager
+    def _abort_future(context: Optional[RequestContext]):
+        """A future that completes when the context is cancelled (None without a context)"""
+        if context is None:
+            yield None
+            return
+        aborted = Future()
+        remove = context.add_callback(lambda: aborted.set_result(None))
+        try:
+            yield aborted
+        finally:
+            remove()
+    
+    def _wait_or_abort(self, future: Future, context: RequestContext, timeout: Optional[float]) -> bool:
+        """Wait for future until it is done (True), the context is cancelled or the timeout passes"""
+        with self._abort_future(context) as aborted:
+            wait([future, aborted], timeout=timeout, return_when=FIRST_COMPLETED)
+        return future.done()
+    
+    def _deadline(self, start: float, context: Optional[RequestContext]) -> float:
+        """Routing deadline: request_deadline, or sooner if the request's own deadline is sooner"""
+        deadline = start + self.request_deadline
+        if context is not None and context.deadline is not None:
+            deadline = min(deadline, context.deadline)
+        return deadline
+    
+    def _probe_provider(self, name: str) -> bool:
+        """Cheap background request used to check whether an open provider has recovered"""
+        timeout = self.config.get('health_probe_timeout', 5.0)
+        return self._provider_call(name)("ping", temperature=0.0, max_tokens=1, timeout=timeout)["success"]
+    
+    def _routing_info(self, start: float, attempted: List[str], winner: Optional[str]) -> Dict:
+        """Describe how a request was routed and how much of its deadline it used"""
+        elapsed = time.monotonic() - start
+        return {
+            "mode": self.routing_mode,
+            "winner": winner,
+            "attempted": attempted,
+            "deadline": self.request_deadline,
+            "elapsed": round(elapsed, 4),
+            "budget_used": round(min(elapsed / self.request_deadline, 1.0), 4) if self.request_deadline else None
+        }
+    
+    def _call_remote_providers(self, prompt: str, temperature: float, max_tokens: int,
+                               context: Optional[RequestContext] = None) -> Dict:
+        """
+        Call the remote providers with one shared deadline.
+        
+        sequential: one after another, each limited to the time left
+        hedged:     start the next provider if the current one has not
+                    answered within hedge_delay (or as soon as it fails)
+        parallel:   start every provider at once
+        
+        The first successful answer wins; the rest are cancelled.
+        """
+        start = time.monotonic()
+        deadline = self._deadline(start, context)
+        
+        if self.routing_mode == "sequential" or len(self.remote_providers) < 2:
+            response, attempted = self._call_sequential(prompt, temperature, max_tokens, deadline, context)
+        else:
+            response, attempted = self._call_raced(prompt, temperature, max_tokens, deadline, context)
+        
+        response["routing"] = self._routing_info(start, attempted, response.get("provider") if response["success"] else None)
+        return response
+    
+    def _call_sequential(self, prompt: str, temperature: float, max_tokens: int, deadline: float,
+                         context: Optional[RequestContext] = None):
+        """Try providers in order until one answers or the deadline passes"""
+        attempted = []
+        response = {"success": False, "error": "No healthy remote providers"}
+        for name in self.health.order(self.remote_providers):
+            if context is not None:
+                context.check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                response = {"success": False, "error": "Request deadline exceeded"}
+                break
+            if not self.health.acquire(name):
+                continue
+            attempted.append(name)
+            response = self._await_provider(name, prompt, temperature, max_tokens, remaining, context)
+            if response["success"]:
+                break
+        return response, attempted
+    
+    def _race_pool(self) -> ThreadPoolExecutor:
+        if self._race_executor is None:
+            with self._pools_lock:
+                if self._race_executor is None:
+                    self._race_executor = ThreadPoolExecutor(
+                        max_workers=self.config.get('race_workers', 32),
+                        thread_name_prefix="provider-race"
+                    )
+        return self._race_executor
+    
+    def _coalesce_pool(self) -> ThreadPoolExecutor:
+        """Runs shared (coalesced) calls that callers with a context wait on"""
+        if self._coalesce_executor is None:
+            with self._pools_lock:
+                if self._coalesce_executor is None:
+                    self._coalesce_executor = ThreadPoolExecutor(
+                        max_workers=self.config.get('race_workers', 32),
+                        thread_name_prefix="coalesced-call"
+                    )
+        return self._coalesce_executor
+    
+    def _call_raced(self, prompt: str, temperature: float, max_tokens: int, deadline: float,
+                    context: Optional[RequestContext] = None):
+        """Hedged or parallel racing over a shared thread pool"""
+        waiting = self.health.order(self.remote_providers)
+        attempted = []
+        running = {}
+        response = {"success": False, "error": "No healthy remote providers"}
+        next_launch = time.monotonic()
+        with self._abort_future(context) as aborted:
+            while waiting or running:
+                if context is not None and context.done:
+                    # Stop waiting; calls already running end within their timeouts
+                    self._cancel_losers(running)
+                    context.check()
+                now = time.monotonic()
+                if now >= deadline:
+                    response = {"success": False, "error": "Request deadline exceeded"}
+                    break
+                
+                # Launch everything in parallel mode, otherwise one provider per hedge delay
+                while waiting and (self.routing_mode == "parallel" or now >= next_launch or not running):
+                    name = waiting.pop(0)
+                    if not self.health.acquire(name):
+                        continue
+                    attempted.append(name)
+                    future = self._race_pool().submit(
+                        self._call_provider, name, prompt, temperature, max_tokens, deadline - now
+                    )
+                    running[future] = name
+                    next_launch = now + self.hedge_delay
+                
+                timeout = deadline - now
+                if waiting:
+                    timeout = min(timeout, max(next_launch - now, 0))
+                done, _ = wait(list(running) + ([aborted] if aborted is not None else []),
+                               timeout=timeout, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    if future is aborted:
+                        continue
+                    running.pop(future)
+                    result = future.result()
+                    if result["success"]:
+                        # Losers still running finish within their deadline-bounded timeout
+                        self._cancel_losers(running)
+                        return result, attempted
+                    response = result
+                    # A failed attempt hands over to the next provider immediately
+                    next_launch = time.monotonic()
+            
+            self._cancel_losers(running)
+            return response, attempted
+    
+    def _cancel_losers(self, running: Dict):
+        """Cancel race calls that have not started and give back their health slots"""
+        for future, name in running.items():
+            if future.cancel():
+                self.health.release(name)
     
     def _local_intelligent_response(self, prompt: str, messages: List[Dict]) -> Dict:
         """Intelligent local responses without API calls"""
@@ -41,94 +467,19 @@ class MultiAPIClient:
             last_user_message = ""
             for msg in reversed(messages):
                 if msg["role"] == "user":
-                    last_user_message = msg["content"].lower()
+                    last_user_message = msg["content"]
                     break
             
-            # Context-aware responses
-            response_map = {
-                "hello": [
-                    "Hello! 👋 I'm your AI assistant. How can I help you today?",
-                    "Hi there! 😊 What would you like to talk about?",
-                    "Hey! Great to see you. What can I help you with?"
-                ],
-                "hi": [
-                    "Hello! How are you doing today?",
-                    "Hi there! 👋 What's on your mind?",
-                    "Hey! Nice to meet you!"
-                ],
-                "how are you": [
-                    "I'm doing great, thanks for asking! Ready to help you with anything. 😊",
-                    "I'm functioning perfectly! How are you doing today?",
-                    "Doing well! Excited to chat with you."
-                ],
-                "what is your name": [
-                    "I'm your AI assistant! You can call me ChatBot. 🤖",
-                    "I'm an AI assistant created to help answer your questions!",
-                    "I'm your friendly neighborhood AI assistant!"
-                ],
-                "help": [
-                    "I'm here to help! What do you need assistance with?",
-                    "I'd be happy to help. What questions do you have?",
-                    "How can I assist you today? Feel free to ask me anything!"
-                ],
-                "thank": [
-                    "You're welcome! 😊 Is there anything else I can help with?",
-                    "Happy to help! Let me know if you have other questions.",
-                    "You're very welcome! I'm here whenever you need me."
-                ],
-                "python": [
-                    "Python is a fantastic programming language! 🐍 It's great for AI, web development, and automation.",
-                    "I love Python! It's one of the best languages for beginners and experts alike.",
-                    "Python is excellent for AI development! Are you working on a Python project?"
-                ],
-                "ai": [
-                    "Artificial Intelligence is fascinating! I'm an example of AI technology. 🤖",
-                    "AI is transforming our world! From assistants like me to self-driving cars.",
-                    "Artificial Intelligence helps me understand and respond to your questions!"
-                ],
-                "weather": [
-                    "I don't have real-time weather data, but I can help you find weather information online!",
-                    "For current weather, I'd recommend checking your local weather service. I can help with other questions!",
-                    "I'm not connected to weather services, but I can help you with many other topics!"
-                ],
-                "time": [
-                    f"I don't have real-time clock access, but you can check the time on your device!",
-                    "For the current time, please check your computer or phone clock.",
-                    "I'm not connected to a clock, but I can help with other questions!"
-                ]
-            }
-            
-            # Find the best matching response
-            for key, responses in response_map.items():
-                if key in last_user_message:
-                    response_text = random.choice(responses)
-                    return {
-                        "success": True,
-                        "content": response_text,
-                        "model": "local_intelligent",
-                        "provider": "local"
-                    }
+            # Context-aware responses from the compiled intent index
+            response_text = self.intent_engine.respond(last_user_message)
             
             # Default intelligent responses
-            default_responses = [
-                "That's an interesting question! I'd be happy to help you explore that topic.",
-                "I understand what you're asking. Let me provide some insights on that.",
-                "Thanks for your message! I'm here to assist you with your questions.",
-                "I appreciate you reaching out. Let me think about how best to help you.",
-                "That's a great point! Here's what I can share about that topic...",
-                "I'd be glad to help with that. Let me provide some information.",
-                "Interesting question! Here are my thoughts on that matter...",
-                "I understand you're looking for information about that. Let me help.",
-                "Thanks for asking! I can definitely provide some guidance on that.",
-                "I appreciate your question. Here's what I know about that topic.",
-                "That's a thoughtful question! Let me share what I understand about it.",
-                "I'd be happy to discuss that with you. Here's my perspective...",
-                "Great question! Let me provide some information that might help.",
-                "I understand your interest in that topic. Here's what I can tell you.",
-                "Thanks for bringing that up! It's an important topic to discuss."
-            ]
+            if response_text is None and self.local_default_responses:
+                response_text = self.intent_engine.default_response()
+            
+            if response_text is None:
+                return {"success": False, "error": "No local intent matched"}
             
-            response_text = random.choice(default_responses)
             return {
                 "success": True,
                 "content": response_text,
@@ -140,83 +491,204 @@ class MultiAPIClient:
             logger.error(f"Local response error: {e}")
             return {"success": False, "error": str(e)}
     
-    def _try_huggingface(self, prompt: str) -> Dict:
-        """Try Hugging Face Inference API"""
-        try:
-            # Use a simple, reliable model
-            API_URL = "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium"
-            
-            payload = {
-                "inputs": prompt,
-                "parameters": {
-                    "max_length": 150,
-                    "temperature": 0.7,
-                    "do_sample": True,
-                    "return_full_text": False
-                }
+    def _provider_settings(self, name: str) -> Dict:
+        """Provider settings from config, filled in with the defaults"""
+        return {**PROVIDER_DEFAULTS[name], **self.config.get('providers', {}).get(name, {})}
+    
+    def _session(self, name: str) -> requests.Session:
+        """Shared keep-alive session per provider (one TCP/TLS handshake per pooled connection)"""
+        session = self._sessions.get(name)
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(name)
+                if session is None:
+                    settings = self._provider_settings(name)
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings['max_connections'])
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._sessions[name] = session
+        return session
+    
+    def _huggingface_request(self, prompt: str, temperature: float, max_tokens: int, stream: bool = False) -> Dict:
+        """Build the Hugging Face Inference API request"""
+        settings = self._provider_settings("huggingface")
+        headers = {"Content-Type": "application/json"}
+        if settings['api_key']:
+            headers["Authorization"] = f"Bearer {settings['api_key']}"
+        
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                "max_new_tokens": max_tokens,
+                "temperature": temperature,
+                "do_sample": True,
+                "return_full_text": False
             }
-            
-            response = requests.post(API_URL, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, dict) and 'generated_text' in result:
+        }
+        if stream:
+            payload["stream"] = True
+        return {"url": settings['url'], "headers": headers, "json": payload, "timeout": settings['timeout']}
+    
+    def _parse_huggingface(self, status_code: int, result) -> Dict:
+        """Turn a Hugging Face response body into a response dict"""
+        model = self._provider_settings("huggingface")['model']
+        if status_code == 200:
+            if isinstance(result, dict) and 'generated_text' in result:
+                return {
+                    "success": True,
+                    "content": result['generated_text'],
+                    "model": model,
+                    "provider": "huggingface"
+                }
+            elif isinstance(result, list) and len(result) > 0:
+                if 'generated_text' in result[0]:
                     return {
                         "success": True,
-                        "content": result['generated_text'],
-                        "model": "microsoft/DialoGPT-medium",
+                        "content": result[0]['generated_text'],
+                        "model": model,
                         "provider": "huggingface"
                     }
-                elif isinstance(result, list) and len(result) > 0:
-                    if 'generated_text' in result[0]:
-                        return {
-                            "success": True,
-                            "content": result[0]['generated_text'],
-                            "model": "microsoft/DialoGPT-medium", 
-                            "provider": "huggingface"
-                        }
-            
-            return {"success": False, "error": "Hugging Face API unavailable"}
+        
+        return {"success": False, "error": "Hugging Face API unavailable"}
+    
+    def _openrouter_request(self, prompt: str, temperature: float, max_tokens: int, stream: bool = False) -> Dict:
+        """Build the OpenRouter chat completions request"""
+        # OpenRouter with free tier (you can sign up at https://openrouter.ai/)
+        settings = self._provider_settings("openrouter")
+        headers = {
+            "Authorization": f"Bearer {settings['api_key']}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": settings['model'],
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        if stream:
+            payload["stream"] = True
+        return {"url": settings['url'], "headers": headers, "json": payload, "timeout": settings['timeout']}
+    
+    def _parse_openrouter(self, status_code: int, result) -> Dict:
+        """Turn an OpenRouter response body into a response dict"""
+        if status_code == 200:
+            content = result['choices'][0]['message']['content']
+            return {
+                "success": True,
+                "content": content,
+                "model": result.get('model', self._provider_settings("openrouter")['model']),
+                "provider": "openrouter"
+            }
+        else:
+            return {"success": False, "error": f"OpenRouter error: {status_code}"}
+    
+    def _stream_request(self, name: str, prompt: str, temperature: float, max_tokens: int) -> Dict:
+        """Streaming variant of a provider request"""
+        if name == "huggingface":
+            return self._huggingface_request(prompt, temperature, max_tokens, stream=True)
+        return self._openrouter_request(prompt, temperature, max_tokens, stream=True)
+    
+    def _parse_stream_line(self, name: str, line: str) -> Optional[str]:
+        """Token text from one Server-Sent-Events line of a provider stream"""
+        if not line or not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return None
+        event = json.loads(data)
+        if name == "huggingface":
+            token = event.get("token") or {}
+            return None if token.get("special") else token.get("text")
+        choices = event.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content")
+    
+    def _stream_provider(self, name: str, prompt: str, temperature: float, max_tokens: int, timeout: float):
+        """Yield tokens from a provider's streaming endpoint"""
+        request = self._stream_request(name, prompt, temperature, max_tokens)
+        with self._session(name).post(
+            request["url"],
+            headers=request["headers"],
+            json=request["json"],
+            timeout=min(request["timeout"], timeout),
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"{name} stream error: {response.status_code}")
+            for line in response.iter_lines(decode_unicode=True):
+                token = self._parse_stream_line(name, line)
+                if token:
+                    yield token
+    
+    def _post(self, name: str, request: Dict, timeout: Optional[float] = None):
+        """POST a provider request over its pooled session, within the time left"""
+        return self._session(name).post(
+            request["url"],
+            headers=request["headers"],
+            json=request["json"],
+            timeout=min(request["timeout"], timeout) if timeout else request["timeout"]
+        )
+    
+    def _hf_batch_settings(self) -> Dict:
+        return {
+            "max_batch_size": self.config.get('batch_max_size', 8),
+            "max_wait": self.config.get('batch_max_wait', 0.01)
+        }
+    
+    def _get_hf_batcher(self) -> MicroBatcher:
+        if self._hf_batcher is None:
+            with self._sessions_lock:
+                if self._hf_batcher is None:
+                    self._hf_batcher = MicroBatcher(
+                        self._huggingface_batch,
+                        workers=self.config.get('batch_workers', 4),
+                        stats=BatchStats(self.metrics, "huggingface"),
+                        **self._hf_batch_settings()
+                    )
+        return self._hf_batcher
+    
+    def _parse_huggingface_batch(self, status_code: int, results, count: int) -> List[Dict]:
+        """Split a batched Hugging Face response into one response dict per prompt"""
+        if status_code != 200 or not isinstance(results, list) or len(results) != count:
+            return [{"success": False, "error": "Hugging Face API unavailable"} for _ in range(count)]
+        return [self._parse_huggingface(200, result) for result in results]
+    
+    def _huggingface_batch(self, group: tuple, prompts: List[str]) -> List[Dict]:
+        """Send prompts that share sampling parameters as one Inference API call"""
+        temperature, max_tokens = group
+        try:
+            response = self._post("huggingface", self._huggingface_request(prompts, temperature, max_tokens))
+            results = response.json() if response.status_code == 200 else None
+            return self._parse_huggingface_batch(response.status_code, results, len(prompts))
+        except Exception as e:
+            logger.error(f"Hugging Face batch error: {e}")
+            return [{"success": False, "error": str(e)} for _ in prompts]
+    
+    def _try_huggingface(self, prompt: str, temperature: float = 0.7, max_tokens: int = 200, timeout: Optional[float] = None) -> Dict:
+        """Try Hugging Face Inference API"""
+        if self.batching_enabled:
+            try:
+                return self._get_hf_batcher().submit((temperature, max_tokens), prompt).result(timeout=timeout)
+            except Exception as e:
+                logger.error(f"Hugging Face error: {e}")
+                return {"success": False, "error": str(e) or "Hugging Face batch timed out"}
+        
+        try:
+            response = self._post("huggingface", self._huggingface_request(prompt, temperature, max_tokens), timeout)
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_huggingface(response.status_code, result)
             
         except Exception as e:
             logger.error(f"Hugging Face error: {e}")
             return {"success": False, "error": str(e)}
     
-    def _try_openrouter(self, prompt: str, max_tokens: int = 200) -> Dict:
-        """Try OpenRouter - FIXED version"""
+    def _try_openrouter(self, prompt: str, max_tokens: int = 200, temperature: float = 0.7, timeout: Optional[float] = None) -> Dict:
+        """Try OpenRouter chat completions"""
         try:
-            # OpenRouter with free tier (you can sign up at https://openrouter.ai/)
-            api_key = "free"  # Replace with actual key if you get one
-            
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": "openai/gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": max_tokens  # This was missing!
-            }
-            
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=15
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                return {
-                    "success": True,
-                    "content": content,
-                    "model": "gpt-3.5-turbo",
-                    "provider": "openrouter"
-                }
-            else:
-                return {"success": False, "error": f"OpenRouter error: {response.status_code}"}
+            response = self._post("openrouter", self._openrouter_request(prompt, temperature, max_tokens), timeout)
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_openrouter(response.status_code, result)
                 
         except Exception as e:
             logger.error(f"OpenRouter error: {e}")
@@ -257,10 +729,42 @@ class MultiAPIClient:
             elif msg["role"] == "assistant":
                 conversation.append(f"Assistant: {msg['content']}")
         
-        return "\n".join(conversation[-4:])  # Last 2 exchanges
+        # History is already packed to the context token budget by the chat engine
+        return "\n".join(conversation)
     
     def get_usage_stats(self) -> Dict:
-        return self.usage_stats.copy()
+        """Headline usage numbers, read from the metrics registry"""
+        return {
+            "total_requests": int(self._m_requests.value()),
+            "errors": int(self._m_provider_requests.total(outcome="error")),
+            "cache_hits": int(self._m_cache.value(result="hit")),
+            "cache_misses": int(self._m_cache.value(result="miss")),
+            "coalesced_requests": int(self._m_coalesced.value()),
+            "fallbacks": int(self._m_responses.value(source="fallback")),
+            "in_flight": int(self._m_inflight.value())
+        }
+    
+    def get_provider_health(self) -> Dict:
+        return self.health.snapshot()
+    
+    def get_batching_stats(self) -> Dict:
+        """Batch-size distribution and queueing delay of the Hugging Face batcher"""
+        stats = self._hf_batcher.stats.snapshot() if self._hf_batcher is not None else {}
+        return {"enabled": self.batching_enabled, **stats}
+    
+    def close(self):
+        """Close pooled provider sessions, the racing pool, the batcher and the health probe"""
+        self.health.stop_probe()
+        if self._hf_batcher is not None:
+            self._hf_batcher.close()
+            self._hf_batcher = None
+        for executor in (self._race_executor, self._coalesce_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._race_executor = self._coalesce_executor = None
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
     
     def validate_api_key(self) -> bool:
         return True  # Always works with local responses
\ No newline at end of file
@@ -0,0 +1,366 @@
+"""
+Async Multi-API Client - Non-blocking provider calls over pooled HTTP connections
+"""
+import asyncio
+import httpx
+from typing import List, Dict, Optional
+import logging
+import time
+
+from .api_client import MultiAPIClient, chunk_text
+from .batching import AsyncMicroBatcher, BatchStats
+from .coalescing import AsyncSingleFlight
+from .provider_health import ProviderHealthTracker
+from .request_context import RequestAborted, RequestContext
+from .response_cache import ResponseCache
+from ..utils.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+class AsyncMultiAPIClient(MultiAPIClient):
+    """
+    Async counterpart of MultiAPIClient.
+
+    Request building, response parsing and local responses are shared with
+    the sync client; only the transport differs. Each provider gets its own
+    httpx.AsyncClient so connection limits, keep-alive and timeouts can be
+    tuned per provider through load_config.
+    """
+
+    def __init__(self, config: Optional[Dict] = None, health: Optional[ProviderHealthTracker] = None,
+                 cache: Optional[ResponseCache] = None, metrics: Optional[MetricsRegistry] = None):
+        super().__init__(config, health, cache, metrics)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._ainflight = AsyncSingleFlight()
+        self._ahf_batcher: Optional[AsyncMicroBatcher] = None
+
+    def _client(self, name: str) -> httpx.AsyncClient:
+        """Pooled keep-alive client per provider, created on first use"""
+        client = self._clients.get(name)
+        if client is None:
+            settings = self._provider_settings(name)
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings['max_connections'],
+                    max_keepalive_connections=settings['max_keepalive'],
+                    keepalive_expiry=settings['keepalive_expiry']
+                ),
+                timeout=httpx.Timeout(settings['timeout'])
+            )
+            self._clients[name] = client
+        return client
+
+    async def chat_completion(self, messages: List[Dict], model: str = "huggingface", temperature: float = 0.7, max_tokens: int = 200,
+                              use_cache: bool = True, stream: bool = False, context: Optional[RequestContext] = None):
+        """
+        Try multiple AI providers in order without blocking the event loop
+
+        With stream=True an async iterator of text tokens is returned:
+        ``async for token in await client.chat_completion(..., stream=True)``
+
+        Provider calls are cancelled as soon as `context` is cancelled or its
+        deadline passes, and RequestAborted is raised instead of answering.
+        """
+        if stream:
+            return self._astream_completion(messages, model, temperature, max_tokens, use_cache, context)
+
+        self._m_requests.inc()
+        with self._m_inflight.track_inprogress():
+            if context is None:
+                return await self._acomplete(messages, model, temperature, max_tokens, use_cache)
+            async with context.scope():
+                return await self._acomplete(messages, model, temperature, max_tokens, use_cache, context)
+
+    async def _acomplete(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, use_cache: bool,
+                         context: Optional[RequestContext] = None) -> Dict:
+        """Local intents, then cache, then remote providers, then the fallback"""
+        # Convert messages to prompt
+        prompt = self._messages_to_prompt(messages)
+
+        # Try local responses first (no I/O)
+        response = self._local_intelligent_response(prompt, messages)
+        if response["success"]:
+            self._m_responses.inc(source="local")
+            return response
+
+        # Serve repeated remote answers from the cache
+        cache_key = self._cache_key(prompt, model, temperature, max_tokens) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            self._m_responses.inc(source="cache")
+            return cached
+
+        # Try remote providers within the request deadline (shared with identical in-flight requests,
+        # so the shared call keeps the default deadline and is only cancelled once all its callers are gone)
+        if cache_key is not None and self.coalesce_requests:
+            response, shared = await self._ainflight.do(
+                cache_key, lambda: self._acall_remote_providers(prompt, temperature, max_tokens)
+            )
+            response = self._coalesced(response, shared)
+        else:
+            response = await self._acall_remote_providers(prompt, temperature, max_tokens, context)
+        if response["success"]:
+            self._m_responses.inc(source="remote")
+            self._cache_set(cache_key, response)
+            return response
+
+        # Final fallback, unless nobody is waiting for it any more
+        if context is not None:
+            context.check()
+        self._m_responses.inc(source="fallback")
+        fallback = self._fallback_response(prompt)
+        fallback["routing"] = response.get("routing")
+        return fallback
+
+    async def _astream_completion(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, use_cache: bool,
+                                  context: Optional[RequestContext] = None):
+        """Async token iterator behind chat_completion(stream=True)"""
+        self._m_requests.inc()
+        with self._m_inflight.track_inprogress():
+            async for token in self._astream_tokens(messages, model, temperature, max_tokens, use_cache, context):
+                yield token
+
+    async def _astream_tokens(self, messages: List[Dict], model: str, temperature: float, max_tokens: int, use_cache: bool,
+                              context: Optional[RequestContext] = None):
+        prompt = self._messages_to_prompt(messages)
+
+        response = self._local_intelligent_response(prompt, messages)
+        if response["success"]:
+            self._m_responses.inc(source="local")
+            for token in chunk_text(response["content"]):
+                yield token
+            return
+
+        cache_key = self._cache_key(prompt, model, temperature, max_tokens) if use_cache else None
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            self._m_responses.inc(source="cache")
+            for token in chunk_text(cached["content"]):
+                yield token
+            return
+
+        # Stream from the first healthy provider that produces tokens
+        deadline = self._deadline(time.monotonic(), context)
+        for name in self.health.order(self.remote_providers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self.health.acquire(name):
+                continue
+            start = time.monotonic()
+            parts = []
+            tokens = self._astream_provider(name, prompt, temperature, max_tokens, remaining)
+            try:
+                with self._m_provider_inflight.track_inprogress(provider=name):
+                    async for token in (tokens if context is None else context.aiter(tokens)):
+                        parts.append(token)
+                        yield token
+            except (GeneratorExit, asyncio.CancelledError):
+                self.health.release(name)
+                raise
+            except RequestAborted:
+                # The stream was cut off because nobody is reading it, not because the provider failed
+                self.health.release(name)
+                self._m_provider_aborted.inc(provider=name)
+                raise
+            except Exception as e:
+                logger.error(f"{name} stream error: {e}")
+            self._record_provider(name, bool(parts), time.monotonic() - start)
+            if parts:
+                self._m_responses.inc(source="remote")
+                self._cache_set(cache_key, self._streamed_response(name, parts))
+                return
+
+        if context is not None:
+            context.check()
+        self._m_responses.inc(source="fallback")
+        for token in chunk_text(self._fallback_response(prompt)["content"]):
+            yield token
+
+    async def _astream_provider(self, name: str, prompt: str, temperature: float, max_tokens: int, timeout: float):
+        """Yield tokens from a provider's streaming endpoint"""
+        request = self._stream_request(name, prompt, temperature, max_tokens)
+        async with self._client(name).stream(
+            "POST",
+            request["url"],
+            headers=request["headers"],
+            json=request["json"],
+            timeout=min(request["timeout"], timeout)
+        ) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"{name} stream error: {response.status_code}")
+            async for line in response.aiter_lines():
+                token = self._parse_stream_line(name, line)
+                if token:
+                    yield token
+
+    def _aprovider_call(self, name: str):
+        """Async call function for a remote provider"""
+        return {
+            "huggingface": self._atry_huggingface,
+            "openrouter": self._atry_openrouter
+        }[name]
+
+    async def _acall_provider(self, name: str, prompt: str, temperature: float, max_tokens: int, timeout: float,
+                              context: Optional[RequestContext] = None) -> Dict:
+        """Call a provider whose health slot is already acquired and record the outcome"""
+        start = time.monotonic()
+        try:
+            with self._m_provider_inflight.track_inprogress(provider=name):
+                response = await self._aprovider_call(name)(prompt, temperature=temperature, max_tokens=max_tokens, timeout=timeout)
+        except asyncio.CancelledError:
+            # A cancelled race loser (or aborted request) says nothing about the provider's health
+            self.health.release(name)
+            if context is not None and context.done:
+                self._m_provider_aborted.inc(provider=name)
+            raise
+        self._record_provider(name, response["success"], time.monotonic() - start)
+        return response
+
+    async def _acall_remote_providers(self, prompt: str, temperature: float, max_tokens: int,
+                                      context: Optional[RequestContext] = None) -> Dict:
+        """Async version of _call_remote_providers; losing calls are truly cancelled"""
+        start = time.monotonic()
+        deadline = self._deadline(start, context)
+
+        if self.routing_mode == "sequential" or len(self.remote_providers) < 2:
+            response, attempted = await self._acall_sequential(prompt, temperature, max_tokens, deadline, context)
+        else:
+            response, attempted = await self._acall_raced(prompt, temperature, max_tokens, deadline, context)
+
+        response["routing"] = self._routing_info(start, attempted, response.get("provider") if response["success"] else None)
+        return response
+
+    async def _acall_sequential(self, prompt: str, temperature: float, max_tokens: int, deadline: float,
+                                context: Optional[RequestContext] = None):
+        """Try providers in order until one answers or the deadline passes"""
+        attempted = []
+        response = {"success": False, "error": "No healthy remote providers"}
+        for name in self.health.order(self.remote_providers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                response = {"success": False, "error": "Request deadline exceeded"}
+                break
+            if not self.health.acquire(name):
+                continue
+            attempted.append(name)
+            response = await self._acall_provider(name, prompt, temperature, max_tokens, remaining, context)
+            if response["success"]:
+                break
+        return response, attempted
+
+    async def _acall_raced(self, prompt: str, temperature: float, max_tokens: int, deadline: float,
+                           context: Optional[RequestContext] = None):
+        """Hedged or parallel racing with asyncio tasks"""
+        waiting = self.health.order(self.remote_providers)
+        attempted = []
+        running = {}
+        response = {"success": False, "error": "No healthy remote providers"}
+        next_launch = time.monotonic()
+
+        try:
+            while waiting or running:
+                now = time.monotonic()
+                if now >= deadline:
+                    response = {"success": False, "error": "Request deadline exceeded"}
+                    break
+
+                # Launch everything in parallel mode, otherwise one provider per hedge delay
+                while waiting and (self.routing_mode == "parallel" or now >= next_launch or not running):
+                    name = waiting.pop(0)
+                    if not self.health.acquire(name):
+                        continue
+                    attempted.append(name)
+                    task = asyncio.ensure_future(self._acall_provider(
+                        name, prompt, temperature, max_tokens, deadline - now, context
+                    ))
+                    running[task] = name
+                    next_launch = now + self.hedge_delay
+
+                timeout = deadline - now
+                if waiting:
+                    timeout = min(timeout, max(next_launch - now, 0))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    running.pop(task)
+                    result = task.result()
+                    if result["success"]:
+                        return result, attempted
+                    response = result
+                    # A failed attempt hands over to the next provider immediately
+                    next_launch = time.monotonic()
+
+            return response, attempted
+        finally:
+            # Cancel the losers (and everything else if we were cancelled ourselves)
+            for task in running:
+                task.cancel()
+
+    async def _apost(self, name: str, request: Dict, timeout: Optional[float] = None) -> httpx.Response:
+        """POST a provider request over its pooled client, within the time left"""
+        return await self._client(name).post(
+            request["url"],
+            headers=request["headers"],
+            json=request["json"],
+            timeout=min(request["timeout"], timeout) if timeout else request["timeout"]
+        )
+
+    async def _ahuggingface_batch(self, group: tuple, prompts: List[str]) -> List[Dict]:
+        """Send prompts that share sampling parameters as one Inference API call"""
+        temperature, max_tokens = group
+        try:
+            response = await self._apost("huggingface", self._huggingface_request(prompts, temperature, max_tokens))
+            results = response.json() if response.status_code == 200 else None
+            return self._parse_huggingface_batch(response.status_code, results, len(prompts))
+        except Exception as e:
+            logger.error(f"Hugging Face batch error: {e}")
+            return [{"success": False, "error": str(e)} for _ in prompts]
+
+    async def _atry_huggingface(self, prompt: str, temperature: float = 0.7, max_tokens: int = 200, timeout: Optional[float] = None) -> Dict:
+        """Try Hugging Face Inference API"""
+        if self.batching_enabled:
+            if self._ahf_batcher is None:
+                self._ahf_batcher = AsyncMicroBatcher(
+                    self._ahuggingface_batch, stats=BatchStats(self.metrics, "huggingface"), **self._hf_batch_settings()
+                )
+            try:
+                return await asyncio.wait_for(self._ahf_batcher.submit((temperature, max_tokens), prompt), timeout)
+            except Exception as e:
+                logger.error(f"Hugging Face error: {e}")
+                return {"success": False, "error": str(e) or "Hugging Face batch timed out"}
+
+        try:
+            response = await self._apost("huggingface", self._huggingface_request(prompt, temperature, max_tokens), timeout)
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_huggingface(response.status_code, result)
+
+        except Exception as e:
+            logger.error(f"Hugging Face error: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _atry_openrouter(self, prompt: str, max_tokens: int = 200, temperature: float = 0.7, timeout: Optional[float] = None) -> Dict:
+        """Try OpenRouter chat completions"""
+        try:
+            response = await self._apost("openrouter", self._openrouter_request(prompt, temperature, max_tokens), timeout)
+            result = response.json() if response.status_code == 200 else None
+            return self._parse_openrouter(response.status_code, result)
+
+        except Exception as e:
+            logger.error(f"OpenRouter error: {e}")
+            return {"success": False, "error": str(e)}
+
+    def get_batching_stats(self) -> Dict:
+        """Batch-size distribution and queueing delay of the Hugging Face batcher"""
+        stats = self._ahf_batcher.stats.snapshot() if self._ahf_batcher is not None else {}
+        return {"enabled": self.batching_enabled, **stats}
+
+    async def aclose(self):
+        """Close pooled provider connections"""
+        if self._ahf_batcher is not None:
+            await self._ahf_batcher.close()
+            self._ahf_batcher = None
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self.close()
@@ -0,0 +1,189 @@
+"""
+Micro-Batching - Collect concurrent provider requests into batched calls
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from ..utils.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_DELAY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+
+class BatchStats:
+    """Batch-size distribution and queueing delay, recorded as registry histograms"""
+
+    def __init__(self, metrics: Optional[MetricsRegistry] = None, name: str = "default"):
+        metrics = metrics or MetricsRegistry()
+        self.name = name
+        self.batch_size = metrics.histogram(
+            "aicb_batch_size", "Items per batched provider call", ["batcher"], BATCH_SIZE_BUCKETS
+        )
+        self.queue_delay = metrics.histogram(
+            "aicb_batch_queue_delay_seconds", "Time an item waited before its batch was sent", ["batcher"], QUEUE_DELAY_BUCKETS
+        )
+
+    def record(self, queued_at: List[float], sent_at: float):
+        self.batch_size.observe(len(queued_at), batcher=self.name)
+        for queued in queued_at:
+            self.queue_delay.observe(sent_at - queued, batcher=self.name)
+
+    def snapshot(self) -> Dict:
+        sizes = self.batch_size.snapshot(batcher=self.name)
+        delays = self.queue_delay.snapshot(batcher=self.name)
+        batches, items = sizes["count"], sizes["sum"]
+        return {
+            "batches": batches,
+            "items": int(items),
+            "avg_batch_size": round(items / batches, 2) if batches else 0.0,
+            "batch_size_buckets": {f"<={bound}": count for bound, count in sizes["buckets"].items()},
+            "queue_delay_ms": {
+                "avg": round(delays["sum"] / delays["count"] * 1000, 3) if delays["count"] else 0.0,
+                "p95": round((self.queue_delay.quantile(0.95, batcher=self.name) or 0.0) * 1000, 3),
+                "buckets": {f"<={bound * 1000:g}ms": count for bound, count in delays["buckets"].items()}
+            }
+        }
+
+
+class MicroBatcher:
+    """
+    Thread-based micro-batcher.
+
+    Items submitted under the same group (requests that can share one call,
+    e.g. same sampling parameters) are sent together once max_batch_size
+    items are waiting or the oldest has waited max_wait seconds. Batches run
+    on a small pool so collection continues while a batch is in flight.
+    batch_fn(group, items) must return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn: Callable[[Hashable, List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait: float = 0.01, workers: int = 4,
+                 stats: Optional[BatchStats] = None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats or BatchStats()
+        self._pending: Dict[Hashable, List[tuple]] = {}
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="micro-batch")
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, group: Hashable, item: Any) -> Future:
+        future = Future()
+        with self._cond:
+            queue = self._pending.setdefault(group, [])
+            queue.append((item, future, time.monotonic()))
+            if len(queue) == 1 or len(queue) >= self.max_batch_size:
+                self._cond.notify()
+        return future
+
+    def _take_ready(self):
+        """Pop a full or timed-out batch, or return the time until one is due"""
+        now = time.monotonic()
+        wait = None
+        for group, queue in self._pending.items():
+            due = queue[0][2] + self.max_wait
+            if len(queue) >= self.max_batch_size or now >= due:
+                batch = queue[:self.max_batch_size]
+                del queue[:self.max_batch_size]
+                if not queue:
+                    del self._pending[group]
+                return group, batch, None
+            wait = due - now if wait is None else min(wait, due - now)
+        return None, None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    group, batch, wait = self._take_ready()
+                    if batch:
+                        break
+                    self._cond.wait(wait)
+            self.stats.record([queued for _, _, queued in batch], time.monotonic())
+            self._executor.submit(self._execute, group, batch)
+
+    def _execute(self, group: Hashable, batch: List[tuple]):
+        try:
+            results = self.batch_fn(group, [item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncMicroBatcher:
+    """asyncio version of MicroBatcher; batch_fn is a coroutine function"""
+
+    def __init__(self, batch_fn: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+                 max_batch_size: int = 8, max_wait: float = 0.01, stats: Optional[BatchStats] = None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats or BatchStats()
+        self._pending: Dict[Hashable, List[tuple]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks = set()
+
+    async def submit(self, group: Hashable, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._pending.setdefault(group, [])
+        queue.append((item, future, time.monotonic()))
+        if len(queue) >= self.max_batch_size:
+            self._flush(group)
+        elif len(queue) == 1:
+            self._timers[group] = loop.call_later(self.max_wait, self._flush, group)
+        return await future
+
+    def _flush(self, group: Hashable):
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, None)
+        if not batch:
+            return
+        # Callers that gave up while queued are left out of the batch
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        self.stats.record([queued for _, _, queued in batch], time.monotonic())
+        task = asyncio.ensure_future(self._execute(group, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, group: Hashable, batch: List[tuple]):
+        try:
+            results = await self.batch_fn(group, [item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in list(self._tasks):
+            task.cancel()
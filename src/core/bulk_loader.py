@@ -0,0 +1,119 @@
+"""
+Bulk Loader - Parallel warm start from saved conversation files
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .context_packer import estimate_tokens
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _loads(raw: bytes):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def parse_conversation_file(path: str) -> Tuple[Optional[str], str, List[tuple], int]:
+    """
+    Parse one saved conversation into (user_id, exported_at, rows, bytes).
+
+    Rows are plain (role, content, timestamp, message_id, tokens) tuples so
+    they pickle cheaply back from worker processes.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    data = _loads(raw)
+    rows = []
+    for i, message in enumerate(data.get("messages", []), 1):
+        timestamp = message.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        content = message.get("content", "")
+        rows.append((
+            message.get("role", "user"),
+            content,
+            timestamp if timestamp is not None else os.path.getmtime(path),
+            message.get("message_id", i),
+            message.get("tokens") or estimate_tokens(content)
+        ))
+    return data.get("user_id"), data.get("exported_at", ""), rows, len(raw)
+
+
+def find_conversation_files(data_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(data_dir, "*.json")))
+
+
+def bulk_load(memory, data_dir: Optional[str] = None, workers: int = 0, processes: bool = False) -> Dict:
+    """
+    Parse every saved conversation in data_dir in parallel and merge it into memory.
+
+    When a user has several saved files the newest export wins. Users that
+    already have history in memory (e.g. traffic that arrived while a
+    background load was running) are left alone.
+    """
+    data_dir = data_dir or memory.data_dir
+    paths = find_conversation_files(data_dir)
+    workers = workers or min(32, (os.cpu_count() or 1) * (1 if processes else 4))
+    pool_class = ProcessPoolExecutor if processes and len(paths) > 1 else ThreadPoolExecutor
+    start = time.perf_counter()
+
+    newest: Dict[str, tuple] = {}
+    total_bytes = 0
+    errors = 0
+    with pool_class(max_workers=workers) as pool:
+        futures = [(path, pool.submit(parse_conversation_file, path)) for path in paths]
+        for path, future in futures:
+            try:
+                user_id, exported_at, rows, size = future.result()
+            except Exception as e:
+                errors += 1
+                logger.warning(f"Skipping unreadable conversation file {path}: {e}")
+                continue
+            total_bytes += size
+            if user_id and (user_id not in newest or exported_at >= newest[user_id][0]):
+                newest[user_id] = (exported_at, rows)
+
+    imported = sum(1 for user_id, (_, rows) in newest.items() if memory.import_history(user_id, rows))
+    elapsed = time.perf_counter() - start
+    stats = {
+        "files": len(paths),
+        "errors": errors,
+        "users_imported": imported,
+        "users_skipped": len(newest) - imported,
+        "megabytes": round(total_bytes / 1e6, 3),
+        "seconds": round(elapsed, 3),
+        "files_per_s": round(len(paths) / elapsed, 1) if elapsed else 0.0,
+        "mb_per_s": round(total_bytes / 1e6 / elapsed, 2) if elapsed else 0.0,
+        "parser": "orjson" if orjson is not None else "json",
+        "pool": f"{'processes' if pool_class is ProcessPoolExecutor else 'threads'} x {workers}"
+    }
+    logger.info(f"Warm start loaded {imported} conversations from {len(paths)} files: "
+                f"{stats['files_per_s']} files/s, {stats['mb_per_s']} MB/s")
+    return stats
+
+
+def start_bulk_load(memory, data_dir: Optional[str] = None, workers: int = 0, processes: bool = False) -> Future:
+    """Run bulk_load on a background thread; the future resolves to its stats"""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(bulk_load(memory, data_dir, workers, processes))
+        except Exception as e:
+            logger.error(f"Background warm start failed: {e}")
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="warm-start", daemon=True).start()
+    return future
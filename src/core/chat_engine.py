@@ -2,15 +2,84 @@
 AI Chat Engine - Updated for free APIs
 """
 from .api_client import MultiAPIClient
+from .async_api_client import AsyncMultiAPIClient
 from .memory_manager import ConversationMemory
-from typing import List, Dict
+from .context_packer import ContextPacker
+from .summarizer import ConversationSummarizer
+from .conversation_store import create_conversation_store
+from .cold_tier import ColdTier
+from .search_index import SearchIndex
+from .bulk_loader import bulk_load, start_bulk_load
+from .keyed_lock import KeyedLock
+from .request_context import DEADLINE, RequestAborted, RequestContext
+from ..utils.config_loader import load_config
+from ..utils.metrics import MetricsRegistry
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from functools import partial
+from typing import List, Dict, Optional
+import asyncio
+import time
 
 class AIChatEngine:
-    def __init__(self, api_key: str = "free", model: str = "huggingface"):
-        self.api_client = MultiAPIClient()
+    def __init__(self, api_key: str = "free", model: str = "huggingface", config: Optional[Dict] = None):
+        self.config = config or load_config()
+        self.metrics = MetricsRegistry()
+        self.api_client = MultiAPIClient(self.config, metrics=self.metrics)
+        self.async_api_client = AsyncMultiAPIClient(
+            self.config, health=self.api_client.health, cache=self.api_client.cache, metrics=self.metrics
+        )
         self.model = model
-        self.memory = ConversationMemory()
+        max_users = self.config.get('memory_max_users', 0)
+        max_bytes = self.config.get('memory_max_bytes', 0)
+        cold_tier = None
+        if max_users or max_bytes:
+            cold_tier = ColdTier(self.config.get('cold_tier_dir', 'data/cold'), self.config.get('cold_tier_compress', True))
+        search_index = None
+        if self.config.get('search_index', True):
+            # Persisted next to the conversation store; in-memory when there is none.
+            # Workers sharing the store also share one index log
+            persist = self.config.get('storage_backend', 'memory') != 'memory'
+            search_index = SearchIndex(
+                self.config.get('search_dir', 'data/search') if persist else None,
+                snapshot_every=self.config.get('search_snapshot_every', 100000),
+                max_messages=self.config.get('search_max_messages', 500000),
+                shared=self.config.get('memory_read_through', False)
+            )
+        store = create_conversation_store(self.config)
+        summarizer = None
+        if self.config.get('history_summary', True):
+            summarizer = ConversationSummarizer(
+                self.config.get('summary_max_tokens', 200),
+                max_users=self.config.get('summary_max_users', 10000),
+                store=store, shared=self.config.get('memory_read_through', False)
+            )
+        self.memory = ConversationMemory(
+            self.config.get('max_history', 20), summarizer=summarizer, store=store,
+            max_users=max_users, max_bytes=max_bytes, cold_tier=cold_tier, metrics=self.metrics,
+            read_through=self.config.get('memory_read_through', False), search_index=search_index
+        )
+        self.context_packer = ContextPacker(self.config.get('context_token_budget', 1024))
+        
+        # One message at a time per user; history reads and writes (which may hit
+        # disk or a shared store) run on a bounded pool, off the event loop
+        self._user_locks = KeyedLock()
+        self._executor = ThreadPoolExecutor(max_workers=self.config.get('chat_workers', 8),
+                                            thread_name_prefix="chat-memory")
+        self._m_user_wait = self.metrics.histogram(
+            "aicb_chat_user_wait_seconds", "Time a message waited for the same user's earlier messages")
+        self._m_batch_items = self.metrics.counter("aicb_chat_batch_items_total", "chat_many items by outcome", ["outcome"])
+        self._m_aborted = self.metrics.counter(
+            "aicb_chat_aborted_total", "Messages abandoned because the client left or ran out of time, by the stage reached",
+            ["reason", "stage"])
         self.system_prompts = self._load_system_prompts()
+        
+        # Warm start from conversations saved in data/conversations
+        self.warm_start = None
+        if self.config.get('warm_start', False):
+            load = start_bulk_load if self.config.get('warm_start_background', True) else bulk_load
+            self.warm_start = load(self.memory, workers=self.config.get('import_workers', 0),
+                                   processes=self.config.get('import_processes', False))
     
     def _load_system_prompts(self) -> Dict:
         return {
@@ -20,47 +89,324 @@ class AIChatEngine:
             "professional": "You are a professional business AI assistant."
         }
     
-    def chat(self, message: str, user_id: str = "default", conversation_mode: str = "default") -> str:
+    def chat(self, message: str, user_id: str = "default", conversation_mode: str = "default",
+             temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+             context: Optional[RequestContext] = None) -> str:
         """
         Process user message and return AI response
+        
+        Raises RequestAborted, without storing anything, if `context` is
+        cancelled or its deadline passes first.
+        """
+        return self._chat_result(message, user_id, conversation_mode, temperature, max_tokens, context)["response"]
+    
+    async def achat(self, message: str, user_id: str = "default", conversation_mode: str = "default",
+                    temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                    context: Optional[RequestContext] = None) -> str:
+        """
+        Async version of chat; provider calls do not block the event loop
         """
+        return (await self._achat_result(message, user_id, conversation_mode, temperature, max_tokens, context))["response"]
+    
+    async def achat_result(self, message: str, user_id: str = "default", conversation_mode: str = "default",
+                           temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                           context: Optional[RequestContext] = None) -> Dict:
+        """achat, returning {"success", "response", "error"} so callers can tell a failed exchange"""
+        return await self._achat_result(message, user_id, conversation_mode, temperature, max_tokens, context)
+    
+    def _chat_result(self, message: str, user_id: str, conversation_mode: str,
+                     temperature: Optional[float], max_tokens: Optional[int],
+                     context: Optional[RequestContext] = None) -> Dict:
+        """One exchange as {"success", "response", "error"}"""
+        start = time.perf_counter()
+        stage = "waiting"
         try:
-            # Get conversation history
-            history = self.memory.get_conversation(user_id)
-            
-            # Build messages
-            system_prompt = self.system_prompts.get(conversation_mode, self.system_prompts["default"])
-            messages = self._build_messages(history, message, system_prompt)
-            
-            # Call API
-            api_response = self.api_client.chat_completion(messages=messages)
-            
-            if api_response["success"]:
-                ai_response = api_response["content"]
+            with self._user_locks.hold(user_id):
+                self._m_user_wait.observe(time.perf_counter() - start)
+                if context is not None:
+                    context.check()  # the client may have gone while earlier messages ran
+                stage = "provider"
+                try:
+                    messages = self._prepare_messages(message, user_id, conversation_mode)
+                    
+                    # Call API
+                    api_response = self.api_client.chat_completion(messages=messages, context=context,
+                                                                   **self._completion_params(temperature, max_tokens))
+                    
+                    response = self._record_response(user_id, message, api_response)
+                    return {"success": api_response["success"], "response": response, "error": api_response.get("error")}
                 
-                # Update conversation memory
-                self.memory.add_message(user_id, "user", message)
-                self.memory.add_message(user_id, "assistant", ai_response)
+                except RequestAborted:
+                    raise
+                except Exception as e:
+                    return {"success": False, "response": f"I encountered an error: {str(e)}", "error": str(e)}
+        except RequestAborted:
+            self._count_aborted(context, stage)
+            raise
+    
+    async def _achat_result(self, message: str, user_id: str, conversation_mode: str,
+                            temperature: Optional[float], max_tokens: Optional[int],
+                            context: Optional[RequestContext] = None) -> Dict:
+        """Async version of _chat_result"""
+        stage = "waiting"
+        try:
+            async with self._user_turn(user_id, context):
+                stage = "provider"
+                try:
+                    messages = await self._offload(self._prepare_messages, message, user_id, conversation_mode)
+                    
+                    # Call API (cancelled as soon as the context is)
+                    api_response = await self.async_api_client.chat_completion(messages=messages, context=context,
+                                                                               **self._completion_params(temperature, max_tokens))
+                    
+                    response = await self._offload(self._record_response, user_id, message, api_response)
+                    return {"success": api_response["success"], "response": response, "error": api_response.get("error")}
                 
-                return ai_response
+                except RequestAborted:
+                    raise
+                except Exception as e:
+                    return {"success": False, "response": f"I encountered an error: {str(e)}", "error": str(e)}
+        except (RequestAborted, asyncio.CancelledError):
+            self._count_aborted(context, stage)
+            raise
+    
+    @asynccontextmanager
+    async def _user_turn(self, user_id: str, context: Optional[RequestContext]):
+        """Hold the user's lock; waiting for it is given up when the request is aborted"""
+        start = time.perf_counter()
+        async with AsyncExitStack() as stack:
+            if context is None:
+                await stack.enter_async_context(self._user_locks.ahold(user_id))
             else:
-                return f"I apologize, but I'm having trouble connecting to AI services right now. Please try again in a moment."
-                
+                async with context.scope():
+                    await stack.enter_async_context(self._user_locks.ahold(user_id))
+            self._m_user_wait.observe(time.perf_counter() - start)
+            yield
+    
+    def _count_aborted(self, context: Optional[RequestContext], stage: str):
+        """Count a message given up on: 'waiting' never reached a provider, 'provider' cut one short"""
+        if context is not None and context.done:
+            self._m_aborted.inc(reason=context.reason or DEADLINE, stage=stage)
+    
+    def chat_many(self, items: List[tuple], concurrency: Optional[int] = None,
+                  temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                  context: Optional[RequestContext] = None) -> List[Dict]:
+        """
+        Answer many (user_id, message[, conversation_mode]) items; results are in input order
+        """
+        chains = self._batch_chains(items)
+        results: List[Optional[Dict]] = [None] * len(items)
+        
+        def run_chain(indices):
+            for i in indices:
+                user_id, message, mode = items[i][0], items[i][1], items[i][2] if len(items[i]) > 2 else "default"
+                results[i] = self._batch_result(
+                    i, user_id, self._chat_result(message, user_id, mode, temperature, max_tokens, context))
+        
+        with ThreadPoolExecutor(max_workers=concurrency or self.config.get('batch_concurrency', 16),
+                                thread_name_prefix="chat-batch") as pool:
+            for future in [pool.submit(run_chain, indices) for indices in chains]:
+                future.result()
+        return results
+    
+    async def achat_many(self, items: List[tuple], concurrency: Optional[int] = None,
+                         temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                         context: Optional[RequestContext] = None, admit=None) -> List[Dict]:
+        """Async version of chat_many"""
+        return [result async for result in
+                self.achat_many_iter(items, concurrency, temperature, max_tokens, context, admit)]
+    
+    async def achat_many_iter(self, items: List[tuple], concurrency: Optional[int] = None,
+                              temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                              context: Optional[RequestContext] = None, admit=None):
+        """
+        Yield chat_many results in input order, each as soon as it and every earlier item are done
+        
+        `admit`, if given, is awaited before each item and returns an async
+        context manager held while the item runs (e.g. an admission permit);
+        if it raises, that item fails with the exception as its error.
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in items]
+        semaphore = asyncio.Semaphore(concurrency or self.config.get('batch_concurrency', 16))
+        
+        async def run_chain(indices):
+            try:
+                for i in indices:
+                    user_id, message, mode = items[i][0], items[i][1], items[i][2] if len(items[i]) > 2 else "default"
+                    async with semaphore:
+                        result = await self._admitted_result(admit, message, user_id, mode, temperature,
+                                                             max_tokens, context)
+                    futures[i].set_result(self._batch_result(i, user_id, result))
+            except Exception as e:
+                # Never leave the ordered reader waiting on an item that will not finish
+                for i in indices:
+                    if not futures[i].done():
+                        futures[i].set_exception(e)
+        
+        tasks = [asyncio.ensure_future(run_chain(indices)) for indices in self._batch_chains(items)]
+        try:
+            for future in futures:
+                yield await future
+        finally:
+            # The consumer went away (e.g. the client disconnected): stop the rest
+            for task in tasks:
+                task.cancel()
+    
+    async def _admitted_result(self, admit, message: str, user_id: str, conversation_mode: str,
+                               temperature: Optional[float], max_tokens: Optional[int],
+                               context: Optional[RequestContext]) -> Dict:
+        """_achat_result for one batch item, holding whatever `admit` hands out"""
+        try:
+            permit = await admit() if admit is not None else nullcontext()
+        except RequestAborted:
+            raise
         except Exception as e:
-            return f"I encountered an error: {str(e)}"
+            return {"success": False, "response": "", "error": str(e)}
+        async with permit:
+            return await self._achat_result(message, user_id, conversation_mode, temperature, max_tokens, context)
     
-    def _build_messages(self, history: List[Dict], new_message: str, system_prompt: str) -> List[Dict]:
-        """Build message list for API call"""
-        messages = [{"role": "system", "content": system_prompt}]
+    @staticmethod
+    def _batch_chains(items: List[tuple]) -> List[List[int]]:
+        """Item indices grouped by user; each user's items run in order, users run concurrently"""
+        chains: Dict[str, List[int]] = {}
+        for i, item in enumerate(items):
+            chains.setdefault(item[0], []).append(i)
+        return list(chains.values())
+    
+    def _batch_result(self, index: int, user_id: str, result: Dict) -> Dict:
+        self._m_batch_items.inc(outcome="success" if result["success"] else "error")
+        return {"index": index, "user_id": user_id, **result}
+    
+    def chat_stream(self, message: str, user_id: str = "default", conversation_mode: str = "default",
+                    temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                    context: Optional[RequestContext] = None):
+        """
+        Yield the AI response token by token; the full reply is stored once the stream finishes
+        """
+        start = time.perf_counter()
+        stage = "waiting"
+        try:
+            with self._user_locks.hold(user_id):
+                self._m_user_wait.observe(time.perf_counter() - start)
+                if context is not None:
+                    context.check()
+                stage = "provider"
+                try:
+                    messages = self._prepare_messages(message, user_id, conversation_mode)
+                    parts = []
+                    for token in self.api_client.chat_completion(messages=messages, stream=True, context=context,
+                                                                 **self._completion_params(temperature, max_tokens)):
+                        parts.append(token)
+                        yield token
+                except RequestAborted:
+                    raise
+                except Exception as e:
+                    yield f"I encountered an error: {str(e)}"
+                    return
+                
+                self._record_response(user_id, message, {"success": True, "content": "".join(parts)})
+        except RequestAborted:
+            self._count_aborted(context, stage)
+            raise
+    
+    async def achat_stream(self, message: str, user_id: str = "default", conversation_mode: str = "default",
+                           temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                           context: Optional[RequestContext] = None):
+        """
+        Async version of chat_stream
+        """
+        stage = "waiting"
+        try:
+            async with self._user_turn(user_id, context):
+                stage = "provider"
+                try:
+                    messages = await self._offload(self._prepare_messages, message, user_id, conversation_mode)
+                    parts = []
+                    stream = await self.async_api_client.chat_completion(messages=messages, stream=True, context=context,
+                                                                         **self._completion_params(temperature, max_tokens))
+                    async for token in stream:
+                        parts.append(token)
+                        yield token
+                except RequestAborted:
+                    raise
+                except Exception as e:
+                    yield f"I encountered an error: {str(e)}"
+                    return
+                
+                await self._offload(self._record_response, user_id, message, {"success": True, "content": "".join(parts)})
+        except (RequestAborted, asyncio.CancelledError):
+            self._count_aborted(context, stage)
+            raise
+    
+    async def _offload(self, fn, *args):
+        """Run blocking memory work on the engine's thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+    
+    def _prepare_messages(self, message: str, user_id: str, conversation_mode: str) -> List[Dict]:
+        """Look up history and build the provider message list"""
+        # Get conversation history
+        history = self.memory.get_conversation(user_id)
         
-        # Add conversation history
-        for msg in history[-6:]:  # Last 3 exchanges
-            messages.append({"role": msg["role"], "content": msg["content"]})
+        # Build messages
+        system_prompt = self.system_prompts.get(conversation_mode, self.system_prompts["default"])
+        return self._build_messages(history, message, system_prompt, self.memory.get_summary(user_id))
+    
+    def _completion_params(self, temperature: Optional[float], max_tokens: Optional[int]) -> Dict:
+        """Sampling parameters, falling back to the configured defaults"""
+        return {
+            "temperature": self.config.get('temperature', 0.7) if temperature is None else temperature,
+            "max_tokens": self.config.get('max_tokens', 200) if max_tokens is None else max_tokens
+        }
+    
+    def _record_response(self, user_id: str, message: str, api_response: Dict) -> str:
+        """Store a successful exchange and return the reply text"""
+        if api_response["success"]:
+            ai_response = api_response["content"]
+            
+            # Update conversation memory
+            self.memory.add_message(user_id, "user", message)
+            self.memory.add_message(user_id, "assistant", ai_response)
+            
+            return ai_response
+        else:
+            return f"I apologize, but I'm having trouble connecting to AI services right now. Please try again in a moment."
+    
+    def _build_messages(self, history: List[Dict], new_message: str, system_prompt: str,
+                        summary: Optional[str] = None) -> List[Dict]:
+        """Build message list for API call"""
+        system_messages = [{"role": "system", "content": system_prompt}]
         
-        # Add new user message
-        messages.append({"role": "user", "content": new_message})
+        # Older, trimmed history as one compact system message
+        if summary:
+            system_messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
         
-        return messages
+        # As much recent history as fits in the context token budget
+        return self.context_packer.pack(history, new_message, system_messages)
+    
+    async def aclear_conversation(self, user_id: str):
+        """Clear a user's history once their in-flight messages are done"""
+        async with self._user_locks.ahold(user_id):
+            await self._offload(self.memory.clear_conversation, user_id)
+    
+    async def aconversation_length(self, user_id: str) -> int:
+        """Number of stored messages for a user; the history is read off the event loop"""
+        return await self._offload(self._conversation_length, user_id)
+    
+    def _conversation_length(self, user_id: str) -> int:
+        return len(self.memory.get_conversation(user_id))
+    
+    async def aget_conversation_stats(self, user_id: str) -> Dict:
+        """Async version of get_conversation_stats"""
+        return await self._offload(self.get_conversation_stats, user_id)
+    
+    async def aiter_export(self, user_id: str, format: str = "json"):
+        """memory.iter_export with the history lookup done off the event loop"""
+        return await self._offload(self.memory.iter_export, user_id, format)
+    
+    async def asearch(self, query: str, **kwargs) -> Dict:
+        """memory.search_index.search run off the event loop"""
+        return await self._offload(partial(self.memory.search_index.search, query, **kwargs))
     
     def get_conversation_stats(self, user_id: str) -> Dict:
         """Get statistics for a conversation"""
@@ -69,5 +415,14 @@ class AIChatEngine:
             "total_messages": len(conversation),
             "user_messages": len([m for m in conversation if m["role"] == "user"]),
             "assistant_messages": len([m for m in conversation if m["role"] == "assistant"]),
+            # Both clients share one registry, so this covers sync and async traffic
             "api_usage": self.api_client.get_usage_stats()
-        }
\ No newline at end of file
+        }
+    
+    async def aclose(self):
+        """Release pooled provider connections"""
+        await self.async_api_client.aclose()
+        await asyncio.to_thread(self._executor.shutdown, True)  # waits for in-flight memory work
+        if self.memory.summarizer is not None:
+            self.memory.summarizer.close()
+        self.memory.close()
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Cold Tier - On-disk home for conversations evicted from memory
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from typing import List, Optional, Tuple
+
+from .message import History, Message, message_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class ColdTier:
+    """
+    One file per evicted user, optionally zlib-compressed.
+
+    put() writes a user's resident history (with their summary notes, if
+    any); take() reads it back and removes the file, so a user lives in
+    exactly one tier at a time.
+    """
+
+    def __init__(self, directory: str = "data/cold", compress: bool = True, level: int = 6):
+        self.directory = directory
+        self.compress = compress
+        self.level = level
+        os.makedirs(directory, exist_ok=True)
+        self._users = set()
+        self._lock = threading.Lock()
+        self._index_existing()
+
+    def _index_existing(self):
+        """Files left by a previous run are still valid cold users"""
+        for name in os.listdir(self.directory):
+            if not name.endswith((".json", ".json.z")):
+                continue
+            try:
+                self._users.add(self._read(os.path.join(self.directory, name))["user_id"])
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable cold tier file {name}: {e}")
+
+    def _path(self, user_id: str) -> str:
+        digest = hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + (".json.z" if self.compress else ".json"))
+
+    def _read(self, path: str) -> dict:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if path.endswith(".z"):
+            raw = zlib.decompress(raw)
+        return json.loads(raw)
+
+    def put(self, user_id: str, history: History, summary: Optional[List[str]] = None):
+        data = json.dumps({
+            "user_id": user_id,
+            "next_id": history.next_id,
+            "messages": [[m.role, m.content, m.timestamp, m.message_id, m.tokens] for m in history],
+            "summary": summary
+        }, ensure_ascii=False).encode('utf-8')
+        if self.compress:
+            data = zlib.compress(data, self.level)
+        path = self._path(user_id)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._users.add(user_id)
+
+    def peek(self, user_id: str) -> List[Message]:
+        """Read an evicted history without bringing it back (for exports)"""
+        if user_id not in self._users:
+            return []
+        try:
+            return [Message(*row) for row in self._read(self._path(user_id))["messages"]]
+        except FileNotFoundError:
+            # Reloaded by another thread in the meantime
+            return []
+
+    def take(self, user_id: str, maxlen: int) -> Tuple[Optional[History], Optional[List[str]]]:
+        """Load and remove a user's evicted history and summary notes ((None, None) if not in the cold tier)"""
+        with self._lock:
+            if user_id not in self._users:
+                return None, None
+            self._users.discard(user_id)
+        path = self._path(user_id)
+        try:
+            data = self._read(path)
+            os.remove(path)
+        except Exception as e:
+            logger.error(f"Failed to reload cold conversation for user {user_id}: {e}")
+            return None, None
+        history = History(maxlen)
+        history.extend(Message(*row) for row in data["messages"])
+        history.next_id = data["next_id"]
+        history.nbytes = sum(message_bytes(m) for m in history)
+        return history, data.get("summary")
+
+    def discard(self, user_id: str):
+        with self._lock:
+            if user_id not in self._users:
+                return
+            self._users.discard(user_id)
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+    def user_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._users)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
@@ -0,0 +1,54 @@
+"""
+Context Packer - Fill a prompt token budget with the newest conversation history
+"""
+import re
+from typing import Dict, List
+
+# Words, numbers and single punctuation marks; long words count as several
+# tokens, roughly as a BPE tokenizer would split them
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+# Role/separator framing each message adds on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, dependency-free token estimate for a piece of text"""
+    return sum(1 + (len(piece) - 1) // 4 for piece in _PIECE_RE.findall(text))
+
+
+def message_tokens(message: Dict) -> int:
+    """Token cost of a message, using the count cached on stored messages"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(message["content"])
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextPacker:
+    """
+    Builds the provider message list under a token budget.
+
+    The system prompt and the new user message are always included; the
+    rest of the budget is filled with history, newest first, stopping at
+    the first message that does not fit so the kept history stays
+    contiguous. Only the messages that are kept are looked at.
+    """
+
+    def __init__(self, token_budget: int = 1024):
+        self.token_budget = token_budget
+
+    def pack(self, history: List[Dict], new_message: str, system_messages: List[Dict]) -> List[Dict]:
+        used = sum(message_tokens(msg) for msg in system_messages)
+        used += estimate_tokens(new_message) + MESSAGE_OVERHEAD_TOKENS
+
+        kept = []
+        for msg in reversed(history):
+            cost = message_tokens(msg)
+            if used + cost > self.token_budget:
+                break
+            used += cost
+            kept.append({"role": msg["role"], "content": msg["content"]})
+        kept.reverse()
+
+        return list(system_messages) + kept + [{"role": "user", "content": new_message}]
@@ -0,0 +1,241 @@
+"""
+Conversation Store - Pluggable persistence for ConversationMemory
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from .message import Message
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore(ABC):
+    """
+    Interface for conversation persistence backends.
+
+    ConversationMemory keeps recent history in RAM and calls append() for
+    every new message, so append() must be cheap; backends queue writes
+    and persist them in the background. load() is used the first time a
+    user is seen by this process.
+
+    Backends that set keeps_summaries also hold each user's rolling
+    summary notes (see ConversationSummarizer).
+    """
+
+    keeps_summaries = False
+
+    @abstractmethod
+    def append(self, user_id: str, message: Message):
+        ...
+
+    @abstractmethod
+    def load(self, user_id: str, limit: int) -> List[Message]:
+        """Up to `limit` newest messages for a user, oldest first"""
+
+    @abstractmethod
+    def clear(self, user_id: str):
+        ...
+
+    @abstractmethod
+    def user_ids(self) -> List[str]:
+        ...
+
+    def load_summary(self, user_id: str) -> Optional[List[str]]:
+        return None
+
+    def save_summary(self, user_id: str, notes: Optional[List[str]]):
+        """Replace a user's summary notes (None deletes them)"""
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until every queued write is durable"""
+
+    def sync(self, user_id: str, timeout: Optional[float] = None):
+        """Block until this process's queued writes for a user are visible to other processes"""
+        self.flush(timeout)
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLite store in WAL mode with a write-behind writer thread.
+
+    Appends and clears go on a queue in call order. The writer takes up to
+    batch_size of them at a time, waiting at most flush_interval for a
+    batch to fill, and commits each batch as one transaction (group
+    commit). With synchronous=NORMAL, WAL commits are not fsynced
+    individually; FULL fsyncs every batch.
+    """
+
+    def __init__(self, path: str = "data/conversations.db", batch_size: int = 256,
+                 flush_interval: float = 0.05, synchronous: str = "NORMAL"):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        if synchronous.upper() not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"Invalid SQLite synchronous setting: {synchronous}")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._write_conn = self._connect(synchronous)
+        self._write_conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_user_time ON messages (user_id, timestamp);
+        """)
+        self._read_conn = self._connect(synchronous)
+        self._read_lock = threading.Lock()
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._batches = 0
+        self._written = 0
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self, synchronous: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        return conn
+
+    def append(self, user_id: str, message: Message):
+        self._queue.put(("append", user_id, message))
+
+    def clear(self, user_id: str):
+        self._queue.put(("clear", user_id, None))
+
+    def flush(self, timeout: Optional[float] = None):
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        done.wait(timeout)
+
+    def _take_batch(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1][0] == "append":
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"SQLite write of {len(batch)} operations failed: {e}")
+            for op, _, arg in batch:
+                if op in ("flush", "stop"):
+                    arg.set()
+                if op == "stop":
+                    return
+
+    def _write(self, batch: List[tuple]):
+        rows = []
+        conn = self._write_conn
+        conn.execute("BEGIN")
+        try:
+            for op, user_id, message in batch:
+                if op == "append":
+                    rows.append((user_id, message.message_id, message.role, message.content,
+                                 message.timestamp, message.tokens))
+                elif op == "clear":
+                    # Keep call order: earlier appends for this user land before the delete
+                    conn.executemany("INSERT INTO messages (user_id, message_id, role, content, timestamp, tokens) "
+                                     "VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    rows = []
+                    conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            conn.executemany("INSERT INTO messages (user_id, message_id, role, content, timestamp, tokens) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._batches += 1
+        self._written += sum(1 for op, _, _ in batch if op == "append")
+
+    def load(self, user_id: str, limit: int) -> List[Message]:
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT role, content, timestamp, message_id, tokens FROM messages "
+                "WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        return [Message(*row) for row in reversed(rows)]
+
+    def user_ids(self) -> List[str]:
+        with self._read_lock:
+            return [row[0] for row in self._read_conn.execute("SELECT DISTINCT user_id FROM messages")]
+
+    def stats(self) -> Dict:
+        written, batches = self._written, self._batches
+        return {
+            "backend": "sqlite",
+            "pending": self._queue.qsize(),
+            "messages_written": written,
+            "batches": batches,
+            "avg_batch_size": round(written / batches, 2) if batches else 0.0
+        }
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        stopped = threading.Event()
+        self._queue.put(("stop", None, stopped))
+        stopped.wait()
+        self._write_conn.close()
+        self._read_conn.close()
+
+
+def create_conversation_store(config: Dict) -> Optional[ConversationStore]:
+    """Build the configured storage backend (None keeps history in memory only)"""
+    backend = config.get('storage_backend', 'memory')
+    if backend in (None, '', 'none', 'memory'):
+        return None
+    if backend == 'sqlite':
+        return SQLiteConversationStore(
+            path=config.get('storage_path', 'data/conversations.db'),
+            batch_size=config.get('storage_batch_size', 256),
+            flush_interval=config.get('storage_flush_interval', 0.05),
+            synchronous=config.get('storage_synchronous', 'NORMAL')
+        )
+    if backend == 'journal':
+        from .journal_store import JournalConversationStore
+        return JournalConversationStore(
+            directory=config.get('journal_dir', 'data/journal'),
+            shards=config.get('journal_shards', 8),
+            retain=config.get('max_history', 20) * 2,
+            compact_every=config.get('journal_compact_every', 10000),
+            fsync_interval=config.get('journal_fsync_interval', 1.0)
+        )
+    if backend == 'redis':
+        from .redis_store import RedisConversationStore, connect_redis
+        return RedisConversationStore(
+            connect_redis(config.get('redis_url', 'redis://localhost:6379/0')),
+            prefix=config.get('redis_prefix', 'aicb'),
+            retain=config.get('max_history', 20) * 2,
+            batch_size=config.get('storage_batch_size', 256),
+            flush_interval=config.get('redis_flush_interval', 0.005)
+        )
+    logger.error(f"Unknown conversation storage backend: {backend}")
+    return None
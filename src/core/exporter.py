@@ -0,0 +1,147 @@
+"""
+Conversation Exporter - Streaming JSON / NDJSON / text exports with optional gzip
+"""
+import argparse
+import io
+import json
+import logging
+import tarfile
+import time
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "text": ("text/plain; charset=utf-8", "txt")
+}
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def _message_json(message, user_id: Optional[str] = None) -> str:
+    data = {
+        "role": message.role,
+        "content": message.content,
+        "timestamp": _iso(message.timestamp),
+        "message_id": message.message_id,
+        "tokens": message.tokens
+    }
+    if user_id is not None:
+        data = {"user_id": user_id, **data}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def iter_export(user_id: str, messages: Iterable, format: str = "json") -> Iterator[str]:
+    """Yield an export piece by piece; only one message is formatted at a time"""
+    if format == "json":
+        # total_messages would need a second pass, so it goes after the messages
+        yield json.dumps({"user_id": user_id, "exported_at": datetime.now().isoformat()},
+                         ensure_ascii=False)[:-1] + ', "messages": ['
+        count = 0
+        for message in messages:
+            yield ("\n  " if count == 0 else ",\n  ") + _message_json(message)
+            count += 1
+        yield f'\n], "total_messages": {count}}}\n'
+    elif format == "ndjson":
+        for message in messages:
+            yield _message_json(message, user_id) + "\n"
+    elif format == "text":
+        yield f"Conversation with {user_id}\n"
+        yield f"Exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        yield "-" * 50 + "\n"
+        for message in messages:
+            role = "You" if message.role == "user" else "Assistant"
+            clock = time.strftime("%H:%M:%S", time.localtime(message.timestamp))
+            yield f"[{clock}] {role}: {message.content}\n"
+    else:
+        raise ValueError(f"Unsupported export format: {format}")
+
+
+def gzip_chunks(chunks: Iterable[str], level: int = 6, min_chunk: int = 64 * 1024) -> Iterator[bytes]:
+    """Compress a stream of text into gzip bytes without holding it all in memory"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = []
+    size = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= min_chunk:
+            yield b"".join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b"".join(pending)
+
+
+def export_all(memory, path: str, format: str = "ndjson", compress: bool = True) -> int:
+    """
+    Write every user's conversation to one file; returns the number of users.
+
+    format "ndjson" writes one line per message (gzip when compress is set);
+    "tar" writes one JSON member per user. Conversations are read one at a
+    time without making them resident, so memory use does not grow with
+    the number of users.
+    """
+    count = 0
+    if format == "tar":
+        with tarfile.open(path, "w:gz" if compress else "w") as archive:
+            for user_id in memory.get_user_ids():
+                data = "".join(iter_export(user_id, memory.peek_history(user_id), "json")).encode('utf-8')
+                info = tarfile.TarInfo(name=user_id.replace("/", "_") + ".json")
+                info.size = len(data)
+                info.mtime = int(time.time())
+                archive.addfile(info, io.BytesIO(data))
+                count += 1
+    elif format == "ndjson":
+        def lines():
+            nonlocal count
+            for user_id in memory.get_user_ids():
+                count += 1
+                yield from iter_export(user_id, memory.peek_history(user_id), "ndjson")
+
+        with open(path, 'wb') as f:
+            if compress:
+                for data in gzip_chunks(lines()):
+                    f.write(data)
+            else:
+                for line in lines():
+                    f.write(line.encode('utf-8'))
+    else:
+        raise ValueError(f"Unsupported bulk export format: {format}")
+    logger.info(f"Exported {count} conversations to {path}")
+    return count
+
+
+def main():
+    """Bulk export from the configured conversation store"""
+    from .conversation_store import create_conversation_store
+    from .memory_manager import ConversationMemory
+    from ..utils.config_loader import load_config
+
+    parser = argparse.ArgumentParser(description="Export every stored conversation")
+    parser.add_argument("path", help="output file (.ndjson[.gz] or .tar[.gz])")
+    parser.add_argument("--format", choices=["ndjson", "tar"], default="ndjson")
+    parser.add_argument("--no-compress", action="store_true")
+    args = parser.parse_args()
+
+    config = load_config()
+    store = create_conversation_store(config)
+    if store is None:
+        parser.error("STORAGE_BACKEND must be sqlite, journal or redis to export stored conversations")
+    memory = ConversationMemory(config.get('max_history', 20), store=store)
+    try:
+        count = export_all(memory, args.path, args.format, not args.no_compress)
+        print(f"Exported {count} conversations to {args.path}")
+    finally:
+        memory.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Intent Engine - Compiled keyword matcher for local responses
+"""
+import json
+import os
+import random
+import re
+from collections import deque
+from typing import List, Dict, Optional
+
+DEFAULT_INTENTS_FILE = os.path.join(os.path.dirname(__file__), "data", "intents.json")
+
+_WORD_RE = re.compile(r"\w+")
+
+# ASCII bytes that are not \w, mapped to spaces so ASCII text splits without the regex
+_NON_WORD = bytes(c for c in range(128) if not _WORD_RE.match(chr(c)))
+_ASCII_SEPARATORS = bytes.maketrans(_NON_WORD, b" " * len(_NON_WORD))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words (the unit patterns are matched on)"""
+    if text.isascii():
+        return text.encode().lower().translate(_ASCII_SEPARATORS).decode().split()
+    return _WORD_RE.findall(text.lower())
+
+
+class IntentEngine:
+    """
+    Word-level Aho-Corasick automaton over every intent pattern.
+
+    Patterns match on whole words, so "hi" no longer fires inside "this".
+    When several intents match, the highest priority wins and ties go to the
+    intent listed first. Lookup walks the message once, so its cost depends
+    on the message length and not on how many intents are loaded. The
+    failure links are folded into one transition table per state, so each
+    word costs a dict lookup or two, and a message holding no pattern's
+    first word is turned away with one set check before the walk.
+    """
+
+    def __init__(self, intents: List[Dict], default_responses: Optional[List[str]] = None):
+        self.intents = intents
+        self.default_responses = list(default_responses or [])
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [-1]
+        self._rank: List[tuple] = []
+        self._delta: List[Dict[str, int]] = [{}]  # transitions other than the root's, failures included
+        self._starts = frozenset()  # first words of the patterns
+        self._build()
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "IntentEngine":
+        """Load intents from a JSON data file"""
+        with open(path or DEFAULT_INTENTS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get("intents", []), data.get("default_responses", []))
+
+    def _better(self, a: int, b: int) -> int:
+        """Return whichever intent index ranks higher (-1 means no intent)"""
+        if a < 0:
+            return b
+        if b < 0:
+            return a
+        return a if self._rank[a] >= self._rank[b] else b
+
+    def _build(self):
+        """Compile the patterns into goto/fail/output tables"""
+        for index, intent in enumerate(self.intents):
+            # Higher priority first, then earlier position in the file
+            self._rank.append((intent.get("priority", 0), -index))
+            for pattern in intent.get("patterns", []):
+                words = tokenize(pattern)
+                if not words:
+                    continue
+                state = 0
+                for word in words:
+                    nxt = self._goto[state].get(word)
+                    if nxt is None:
+                        nxt = len(self._goto)
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._out.append(-1)
+                        self._goto[state][word] = nxt
+                    state = nxt
+                self._out[state] = self._better(self._out[state], index)
+
+        # Breadth-first pass to set failure links and fold outputs along them
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(word, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._better(self._out[nxt], self._out[self._fail[nxt]])
+
+        # Same order again: a state's failure target is filled in before the state
+        self._delta = [{} for _ in self._goto]
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            queue.extend(self._goto[state].values())
+            self._delta[state] = {**self._delta[self._fail[state]], **self._goto[state]}
+        self._starts = frozenset(self._goto[0])
+
+    def match(self, text: str) -> Optional[Dict]:
+        """Return the best matching intent for text, or None"""
+        words = tokenize(text)
+        if self._starts.isdisjoint(words):
+            return None  # no pattern can start anywhere in the message
+        delta, root, out, rank = self._delta, self._goto[0], self._out, self._rank
+        state = 0
+        best = -1
+        for word in words:
+            if state:
+                state = delta[state].get(word) or root.get(word, 0)
+            else:
+                state = root.get(word, 0)
+                if not state:
+                    continue
+            found = out[state]
+            if found >= 0 and (best < 0 or rank[found] > rank[best]):
+                best = found
+        return self.intents[best] if best >= 0 else None
+
+    def respond(self, text: str) -> Optional[str]:
+        """Pick a response for the best matching intent, or None on a miss"""
+        intent = self.match(text)
+        if intent is None or not intent.get("responses"):
+            return None
+        return random.choice(intent["responses"])
+
+    def default_response(self) -> Optional[str]:
+        """Pick one of the generic responses used when nothing matches"""
+        return random.choice(self.default_responses) if self.default_responses else None
+
+    def __len__(self) -> int:
+        return len(self.intents)
@@ -0,0 +1,340 @@
+"""
+Journal Store - Append-only JSONL conversation store with snapshot compaction
+"""
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .conversation_store import ConversationStore
+from .message import Message
+
+logger = logging.getLogger(__name__)
+
+
+# A journal record's location: journal generation << _OFFSET_BITS | byte offset
+_OFFSET_BITS = 40
+_OFFSET_MASK = (1 << _OFFSET_BITS) - 1
+
+
+def _iter_lines(path: str) -> Iterator[Tuple[int, bytes]]:
+    """Stream (offset, line) pairs of a file through mmap without reading it into memory"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        while True:
+            offset = mm.tell()
+            line = mm.readline()
+            if not line:
+                return
+            yield offset, line
+
+
+class _User:
+    """Where a user's newest messages are on disk (nothing but offsets is kept in memory)"""
+    __slots__ = ("snapshot", "snapshot_count", "records")
+
+    def __init__(self):
+        self.snapshot: Optional[int] = None  # offset of the user's snapshot line
+        self.snapshot_count = 0  # messages at the end of that line still among the newest `retain`
+        self.records = array("Q")  # journal records since, oldest first
+
+
+class _Shard:
+    def __init__(self, directory: str, index: int, retain: int):
+        self.journal_path = os.path.join(directory, f"journal-{index}.jsonl")
+        self.rotated_path = self.journal_path + ".compacting"
+        self.snapshot_path = os.path.join(directory, f"snapshot-{index}.jsonl")
+        self.retain = retain
+        self.users: Dict[str, _User] = {}
+        self.gen = 1  # of the live journal; a journal being compacted is gen - 1
+        self.seq = 0
+        self.since_snapshot = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.file = None
+
+    def apply(self, record: Dict, ref: int):
+        user_id = record["u"]
+        if record.get("x"):
+            self.users.pop(user_id, None)
+            return
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = _User()
+        user.records.append(ref)
+        if len(user.records) > self.retain:
+            del user.records[0]
+        self.trim_snapshot(user)
+
+    def trim_snapshot(self, user: _User):
+        user.snapshot_count = min(user.snapshot_count, self.retain - len(user.records))
+        if not user.snapshot_count:
+            user.snapshot = None
+
+    def read(self, snapshot: Optional[int], snapshot_count: int, records, limit: int,
+             files: Dict[str, object]) -> List[Message]:
+        """
+        Up to `limit` newest messages at these locations, read from the
+        snapshot and journals; files caches the open files, for the caller to close
+        """
+        refs = records[-limit:]
+        messages = []
+        keep = min(snapshot_count, limit - len(refs))
+        if keep > 0:
+            rows = json.loads(self._readline(files, self.snapshot_path, snapshot))["m"]
+            messages = [Message(*row) for row in rows[len(rows) - keep:]]
+        for ref in refs:
+            path = self.journal_path if ref >> _OFFSET_BITS == self.gen else self.rotated_path
+            record = json.loads(self._readline(files, path, ref & _OFFSET_MASK))
+            messages.append(Message(record["r"], record["c"], record["t"], record["i"], record["k"]))
+        return messages
+
+    @staticmethod
+    def _readline(files: Dict[str, object], path: str, offset: int) -> bytes:
+        f = files.get(path)
+        if f is None:
+            f = files[path] = open(path, 'rb')
+        f.seek(offset)
+        return f.readline()
+
+
+def _close_all(files: Dict[str, object]):
+    for f in files.values():
+        f.close()
+
+
+class JournalConversationStore(ConversationStore):
+    """
+    File-based store with no dependencies beyond the standard library.
+
+    Users are hashed onto shards. Every append or clear is one JSON line
+    appended to that shard's journal (O(1) however long the conversation).
+    Only the locations of each user's newest `retain` messages (their
+    snapshot line and journal offsets) are kept in memory; load() reads
+    the messages back from disk, so resident memory is left to
+    ConversationMemory's limits. A background thread flushes and fsyncs
+    journals every fsync_interval seconds and, once a shard has
+    compact_every new records, writes a snapshot of its state and drops
+    the old journal.
+
+    Every record carries a per-shard sequence number and snapshots store
+    the last one they include. On startup each shard replays its snapshot,
+    then any journal still being compacted, then the live journal, and
+    skips records the snapshot already covers. A torn final line from a
+    crash is ignored.
+    """
+
+    def __init__(self, directory: str = "data/journal", shards: int = 8, retain: int = 40,
+                 compact_every: int = 10000, fsync_interval: float = 1.0):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._shards = [_Shard(directory, i, retain) for i in range(shards)]
+        self._snapshots = 0
+
+        start = time.perf_counter()
+        self.recovered_records = sum(self._recover(shard) for shard in self._shards)
+        self.recovery_seconds = time.perf_counter() - start
+        for shard in self._shards:
+            shard.file = open(shard.journal_path, 'ab')
+            if shard.file.tell() and not self._ends_with_newline(shard.journal_path):
+                # Terminate a torn final record so the next append starts on its own line
+                shard.file.write(b"\n")
+            if os.path.exists(shard.rotated_path):
+                # A compaction was interrupted; its journal is replayed, so snapshot now
+                self._write_snapshot(shard, shard.seq, self._state(shard), shard.gen)
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _shard(self, user_id: str) -> _Shard:
+        return self._shards[zlib.crc32(user_id.encode('utf-8')) % len(self._shards)]
+
+    def _recover(self, shard: _Shard) -> int:
+        replayed = 0
+        snapshot_seq = 0
+        for offset, line in _iter_lines(shard.snapshot_path):
+            entry = json.loads(line)
+            if "seq" in entry:
+                snapshot_seq = entry["seq"]
+                continue
+            user = shard.users[entry["u"]] = _User()
+            user.snapshot = offset
+            user.snapshot_count = min(len(entry["m"]), shard.retain)
+        shard.seq = snapshot_seq
+
+        for gen, path in ((shard.gen - 1, shard.rotated_path), (shard.gen, shard.journal_path)):
+            for offset, line in _iter_lines(path):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping torn journal record in {path}")
+                    continue
+                if record["s"] <= snapshot_seq:
+                    continue
+                shard.apply(record, gen << _OFFSET_BITS | offset)
+                shard.seq = record["s"]
+                shard.since_snapshot += 1
+                replayed += 1
+        return replayed
+
+    def _write(self, user_id: str, record: Dict):
+        shard = self._shard(user_id)
+        with shard.lock:
+            shard.seq += 1
+            record["s"] = shard.seq
+            ref = shard.gen << _OFFSET_BITS | shard.file.tell()
+            shard.file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+            shard.apply(record, ref)
+            shard.since_snapshot += 1
+            shard.dirty = True
+
+    def append(self, user_id: str, message: Message):
+        self._write(user_id, {
+            "u": user_id, "r": message.role, "c": message.content,
+            "t": message.timestamp, "i": message.message_id, "k": message.tokens
+        })
+
+    def clear(self, user_id: str):
+        self._write(user_id, {"u": user_id, "x": 1})
+
+    def load(self, user_id: str, limit: int) -> List[Message]:
+        shard = self._shard(user_id)
+        with shard.lock:
+            user = shard.users.get(user_id)
+            if user is None or limit <= 0:
+                return []
+            # Reads happen under the lock, so compaction cannot move the files meanwhile
+            shard.file.flush()
+            files = {}
+            try:
+                return shard.read(user.snapshot, user.snapshot_count, user.records, limit, files)
+            finally:
+                _close_all(files)
+
+    def user_ids(self) -> List[str]:
+        result = []
+        for shard in self._shards:
+            with shard.lock:
+                result.extend(shard.users)
+        return result
+
+    def _sync(self, shard: _Shard):
+        with shard.lock:
+            if not shard.dirty:
+                return
+            shard.file.flush()
+            shard.dirty = False
+            # A descriptor of our own: compact() may close shard.file while this one fsyncs
+            fileno = os.dup(shard.file.fileno())
+        try:
+            os.fsync(fileno)
+        finally:
+            os.close(fileno)
+
+    def flush(self, timeout: Optional[float] = None):
+        for shard in self._shards:
+            self._sync(shard)
+
+    def compact(self, shard: _Shard):
+        """Snapshot a shard's state and drop the journal records it covers"""
+        with shard.lock:
+            shard.file.flush()
+            os.fsync(shard.file.fileno())
+            shard.file.close()
+            os.replace(shard.journal_path, shard.rotated_path)
+            shard.gen += 1
+            shard.file = open(shard.journal_path, 'ab')
+            seq = shard.seq
+            state = self._state(shard)
+            shard.since_snapshot = 0
+            shard.dirty = False
+        self._write_snapshot(shard, seq, state, shard.gen - 1)
+
+    @staticmethod
+    def _state(shard: _Shard) -> List[tuple]:
+        """Copies of every user's locations; the caller holds the lock"""
+        return [(user_id, user, (user.snapshot, user.snapshot_count, array("Q", user.records)))
+                for user_id, user in shard.users.items()]
+
+    def _write_snapshot(self, shard: _Shard, seq: int, state: List[tuple], covered_gen: int):
+        """
+        Atomically replace the shard snapshot, then drop the journal it covers.
+        The messages are read back from the old snapshot and the journals
+        without the lock; records up to covered_gen are then served from the
+        new snapshot.
+        """
+        tmp_path = shard.snapshot_path + ".tmp"
+        lines = []
+        files = {}
+        try:
+            with open(tmp_path, 'wb') as f:
+                offset = f.write(json.dumps({"seq": seq}).encode('utf-8') + b"\n")
+                for user_id, user, locations in state:
+                    rows = [[m.role, m.content, m.timestamp, m.message_id, m.tokens]
+                            for m in shard.read(*locations, shard.retain, files)]
+                    lines.append((user_id, user, offset, len(rows)))
+                    offset += f.write(json.dumps({"u": user_id, "m": rows}, ensure_ascii=False).encode('utf-8') + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            _close_all(files)
+        with shard.lock:
+            os.replace(tmp_path, shard.snapshot_path)
+            first_uncovered = (covered_gen + 1) << _OFFSET_BITS
+            for user_id, user, offset, count in lines:
+                if shard.users.get(user_id) is not user:
+                    continue  # cleared meanwhile
+                covered = 0
+                while covered < len(user.records) and user.records[covered] < first_uncovered:
+                    covered += 1
+                del user.records[:covered]
+                user.snapshot = offset
+                user.snapshot_count = count
+                shard.trim_snapshot(user)
+            os.remove(shard.rotated_path)
+        self._snapshots += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.fsync_interval):
+            for shard in self._shards:
+                try:
+                    self._sync(shard)
+                    if shard.since_snapshot >= self.compact_every:
+                        self.compact(shard)
+                except Exception as e:
+                    logger.error(f"Journal maintenance failed for {shard.journal_path}: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "journal",
+            "shards": len(self._shards),
+            "users": sum(len(shard.users) for shard in self._shards),
+            "records_since_snapshot": sum(shard.since_snapshot for shard in self._shards),
+            "snapshots": self._snapshots,
+            "recovered_records": self.recovered_records,
+            "recovery_seconds": round(self.recovery_seconds, 4)
+        }
+
+    def close(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+        for shard in self._shards:
+            shard.file.close()
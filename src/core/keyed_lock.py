@@ -0,0 +1,121 @@
+"""
+Keyed Locks - Per-user serialization for conversation updates
+"""
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+
+class _Entry:
+    __slots__ = ("locked", "waiters", "holders")
+
+    def __init__(self):
+        self.locked = False
+        self.waiters = deque()
+        self.holders = 0  # holding or waiting
+
+
+class _ThreadWaiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        self.event.set()
+
+
+class _TaskWaiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class KeyedLock:
+    """
+    Lock per key shared by threads (hold) and asyncio tasks (ahold), so
+    the sync and async paths for one user are serialized together. Callers
+    with the same key run one at a time, in arrival order whichever kind
+    they are; different keys never contend. A release hands the lock
+    straight to the next waiter. Locks exist only while someone holds or
+    waits for them, so memory does not grow with the number of users.
+
+    hold() blocks its thread while waiting, so it is not for the event loop.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def _enter(self, key: str, waiter) -> tuple:
+        """Take the key's lock if it is free, else queue waiter; returns (entry, taken)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            entry.holders += 1
+            if not entry.locked:
+                entry.locked = True
+                return entry, True
+            entry.waiters.append(waiter)
+            return entry, False
+
+    def _release(self, key: str, entry: _Entry):
+        with self._lock:
+            entry.holders -= 1
+            if entry.waiters:
+                entry.waiters.popleft().wake()
+                return
+            entry.locked = False
+            if not entry.holders:
+                del self._entries[key]
+
+    @contextmanager
+    def hold(self, key: str):
+        waiter = _ThreadWaiter()
+        entry, taken = self._enter(key, waiter)
+        if not taken:
+            waiter.event.wait()
+        try:
+            yield
+        finally:
+            self._release(key, entry)
+
+    @asynccontextmanager
+    async def ahold(self, key: str):
+        waiter = _TaskWaiter(asyncio.get_running_loop())
+        entry, taken = self._enter(key, waiter)
+        if not taken:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = waiter.granted
+                    if not granted:
+                        entry.waiters.remove(waiter)
+                        entry.holders -= 1
+                if granted:
+                    self._release(key, entry)  # handed over just as we gave up; pass it on
+                raise
+        try:
+            yield
+        finally:
+            self._release(key, entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -3,57 +3,277 @@ Enhanced Conversation Memory Manager - Complete implementation
 """
 import json
 import os
-from typing import List, Dict, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Iterator, List, Dict, Optional
 from datetime import datetime
 import logging
+from .cold_tier import ColdTier
+from .context_packer import estimate_tokens
+from .conversation_store import ConversationStore
+from .exporter import EXPORT_FORMATS, iter_export
+from .keyed_lock import KeyedLock
+from .message import History, Message, message_bytes
+from .search_index import SearchIndex
+from .summarizer import ConversationSummarizer
+from ..utils.metrics import MetricsRegistry
 
 logger = logging.getLogger(__name__)
 
+
 class ConversationMemory:
-    def __init__(self, max_history: int = 20, data_dir: str = "data/conversations"):
+    def __init__(self, max_history: int = 20, data_dir: str = "data/conversations",
+                 summarizer: Optional[ConversationSummarizer] = None,
+                 store: Optional[ConversationStore] = None,
+                 max_users: int = 0, max_bytes: int = 0, cold_tier: Optional[ColdTier] = None,
+                 metrics: Optional[MetricsRegistry] = None, read_through: bool = False,
+                 search_index: Optional[SearchIndex] = None):
         self.max_history = max_history
         self.data_dir = data_dir
-        self.conversations: Dict[str, List[Dict]] = {}
+        # Least recently active first; 0 disables a limit
+        self.conversations: "OrderedDict[str, History]" = OrderedDict()
+        self.summarizer = summarizer
+        self.store = store
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.cold_tier = cold_tier
+        # Re-read the shared store on every access (several workers, no affinity)
+        self.read_through = read_through and store is not None
+        self.search_index = search_index
+        self.resident_bytes = 0
+        self._lock = threading.RLock()
+        # Users popped for the cold tier but not yet written there; still readable
+        self._evicting: Dict[str, tuple] = {}
+        self._to_cold = deque()
+        # One reload or cold write at a time per user
+        self._loading = KeyedLock()
         os.makedirs(data_dir, exist_ok=True)
         
+        metrics = metrics or MetricsRegistry()
+        self._m_resident_users = metrics.gauge("aicb_memory_resident_users", "Conversations held in memory")
+        self._m_resident_bytes = metrics.gauge("aicb_memory_resident_bytes", "Approximate size of resident conversations")
+        self._m_cold_users = metrics.gauge("aicb_memory_cold_users", "Conversations evicted to the cold tier")
+        self._m_evictions = metrics.counter("aicb_memory_evictions_total", "Idle conversations evicted from memory")
+        self._m_reload = metrics.histogram("aicb_memory_reload_seconds", "Time to bring an evicted conversation back")
+    
+    def _load_history(self, user_id: str) -> Optional[History]:
+        """Resident history for a user, reloaded from the cold tier or store if needed"""
+        if self.read_through:
+            return self._refresh(user_id)
+        
+        with self._lock:
+            history = self._resident(user_id)
+        if history is not None:
+            self._write_evicted()
+            return history
+        
+        # Callers arriving during a reload wait for it instead of seeing no history
+        with self._loading.hold(user_id):
+            with self._lock:
+                history = self._resident(user_id)
+            if history is None:
+                start = time.perf_counter()
+                if self.cold_tier is not None and user_id in self.cold_tier:
+                    history, summary = self.cold_tier.take(user_id, self.max_history * 2)
+                    if history is not None and self.summarizer is not None:
+                        self.summarizer.restore(user_id, summary)
+                if history is None and self.store is not None:
+                    history = self._history_from_store(user_id)
+                if history is not None:
+                    self._m_reload.observe(time.perf_counter() - start)
+                    history = self._admit(user_id, history)
+        self._write_evicted()
+        return history
+    
+    def _resident(self, user_id: str) -> Optional[History]:
+        """The resident history, taking back one still being written to the cold tier; the caller holds the lock"""
+        history = self.conversations.get(user_id)
+        if history is not None:
+            self.conversations.move_to_end(user_id)
+            return history
+        entry = self._evicting.pop(user_id, None)
+        if entry is None:
+            return None
+        history = self.conversations[user_id] = entry[0]
+        self.resident_bytes += history.nbytes
+        self._evict_idle()
+        self._update_gauges()
+        return history
+    
+    def _history_from_store(self, user_id: str) -> Optional[History]:
+        messages = self.store.load(user_id, self.max_history * 2)
+        if not messages:
+            return None
+        history = History(self.max_history * 2)
+        history.extend(messages)
+        history.next_id = messages[-1].message_id + 1
+        history.nbytes = sum(message_bytes(m) for m in messages)
+        return history
+    
+    def _refresh(self, user_id: str) -> Optional[History]:
+        """Replace the resident copy with the shared store's current history"""
+        history = self._history_from_store(user_id)
+        with self._lock:
+            stale = self.conversations.pop(user_id, None)
+            if stale is not None:
+                self.resident_bytes -= stale.nbytes
+            if history is not None:
+                self.conversations[user_id] = history
+                self.resident_bytes += history.nbytes
+                self._evict_idle()
+            self._update_gauges()
+        self._write_evicted()
+        return history
+    
+    def _admit(self, user_id: str, history: History) -> History:
+        """Make a history resident, evicting idle users if over the limits"""
+        with self._lock:
+            existing = self.conversations.get(user_id)
+            if existing is not None:
+                # Another thread loaded it first
+                self.conversations.move_to_end(user_id)
+                return existing
+            self.conversations[user_id] = history
+            self.resident_bytes += history.nbytes
+            self._evict_idle()
+            self._update_gauges()
+        self._write_evicted()
+        return history
+    
+    def _evict_idle(self):
+        """
+        Pop least recently active users until within limits; the caller
+        holds the lock and calls _write_evicted() once it has released it
+        """
+        while len(self.conversations) > 1 and (
+                (self.max_users and len(self.conversations) > self.max_users) or
+                (self.max_bytes and self.resident_bytes > self.max_bytes)):
+            user_id, history = self.conversations.popitem(last=False)
+            self.resident_bytes -= history.nbytes
+            if self.cold_tier is not None and history:
+                entry = self._evicting[user_id] = (history,)
+                self._to_cold.append((user_id, entry))
+            self._m_evictions.inc()
+    
+    def _write_evicted(self):
+        """Write users popped by _evict_idle() to the cold tier, without holding the lock"""
+        while self._to_cold:
+            with self._lock:
+                if not self._to_cold:
+                    return
+                user_id, entry = self._to_cold.popleft()
+            with self._loading.hold(user_id):
+                with self._lock:
+                    if self._evicting.get(user_id) is not entry:
+                        continue  # taken back or cleared meanwhile
+                    history = entry[0]
+                    snapshot = History(history.maxlen)
+                    snapshot.extend(history)
+                    snapshot.next_id = history.next_id
+                # The summary goes with the history, so it is neither lost nor left behind
+                summary = self.summarizer.evict(user_id) if self.summarizer is not None else None
+                self.cold_tier.put(user_id, snapshot, summary)
+                with self._lock:
+                    written = self._evicting.get(user_id) is entry
+                    if written:
+                        del self._evicting[user_id]
+                    returned = self.conversations.get(user_id) is history
+                    self._update_gauges()
+                if not written:
+                    # Taken back or cleared during the write; the file is stale
+                    self.cold_tier.discard(user_id)
+                    if returned and self.summarizer is not None:
+                        self.summarizer.restore(user_id, summary)
+    
+    def _update_gauges(self):
+        self._m_resident_users.set(len(self.conversations))
+        self._m_resident_bytes.set(self.resident_bytes)
+        self._m_cold_users.set(len(self.cold_tier) if self.cold_tier is not None else 0)
+        
     def add_message(self, user_id: str, role: str, content: str):
         """Add a message to conversation history"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = []
-            
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat(),
-            "message_id": len(self.conversations[user_id]) + 1
-        }
+        history = self._load_history(user_id)
+        if history is None:
+            history = self._admit(user_id, History(self.max_history * 2))
         
-        self.conversations[user_id].append(message)
+        # Token count is taken once here so prompt packing never re-tokenizes history
+        message = Message(role, content, time.time(), history.next_id, estimate_tokens(content))
+        size = message_bytes(message)
         
-        # Trim history if too long
-        if len(self.conversations[user_id]) > self.max_history * 2:
-            self.conversations[user_id] = self.conversations[user_id][-self.max_history * 2:]
-            
-        logger.debug(f"Added message to user {user_id}: {role} - {content[:50]}...")
+        with self._lock:
+            entry = self._evicting.get(user_id)
+            if entry is not None and entry[0] is history:
+                self._resident(user_id)  # evicted since it was loaded; keep it
+            history.next_id += 1
+            # The ring buffer drops the oldest message when full; fold it into the
+            # rolling summary (in the background)
+            if len(history) == history.maxlen:
+                size -= message_bytes(history[0])
+                if self.summarizer is not None:
+                    self.summarizer.submit(user_id, [history[0]])
+            history.append(message)
+            history.nbytes += size
+            if self.conversations.get(user_id) is history:
+                self.resident_bytes += size
+                if self.max_bytes and self.resident_bytes > self.max_bytes:
+                    self._evict_idle()
+                self._update_gauges()
+        self._write_evicted()
+        if self.store is not None:
+            self.store.append(user_id, message)
+            if self.read_through:
+                # The user's next request may land on another worker
+                self.store.sync(user_id)
+        if self.search_index is not None:
+            self.search_index.add(user_id, message.message_id, role, content, message.timestamp)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Added message to user {user_id}: {role} - {content[:50]}...")
     
-    def get_conversation(self, user_id: str) -> List[Dict]:
-        """Get conversation history for user"""
-        return self.conversations.get(user_id, [])
+    def get_conversation(self, user_id: str) -> History:
+        """Get conversation history for user (oldest first; do not modify)"""
+        return self._load_history(user_id) or History(0)
     
-    def get_last_n_messages(self, user_id: str, n: int) -> List[Dict]:
+    def get_last_n_messages(self, user_id: str, n: int) -> List[Message]:
         """Get last N messages from conversation"""
         conversation = self.get_conversation(user_id)
-        return conversation[-n:] if conversation else []
+        return list(islice(reversed(conversation), n))[::-1] if n > 0 else []
+    
+    def get_summary(self, user_id: str) -> Optional[str]:
+        """Rolling summary of messages trimmed from the history, if any"""
+        return self.summarizer.get(user_id) if self.summarizer is not None else None
     
     def clear_conversation(self, user_id: str):
         """Clear conversation history for user"""
-        if user_id in self.conversations:
-            self.conversations[user_id] = []
+        if self.summarizer is not None:
+            self.summarizer.clear(user_id)
+        if self.store is not None:
+            self.store.clear(user_id)
+            if self.read_through:
+                self.store.sync(user_id)
+        if self.search_index is not None:
+            self.search_index.remove_user(user_id)
+        with self._loading.hold(user_id):
+            with self._lock:
+                self._evicting.pop(user_id, None)
+            if self.cold_tier is not None:
+                self.cold_tier.discard(user_id)
+        with self._lock:
+            history = self.conversations.get(user_id)
+            if history is not None:
+                self.resident_bytes -= history.nbytes
+                history.nbytes = 0
+                history.clear()
+                self._update_gauges()
+        if history is not None:
             logger.info(f"Cleared conversation for user {user_id}")
     
     def save_conversation(self, user_id: str, filename: Optional[str] = None):
         """Save conversation to JSON file"""
-        if user_id not in self.conversations or not self.conversations[user_id]:
+        history = self._load_history(user_id)
+        if not history:
             logger.warning(f"No conversation to save for user {user_id}")
             return None
             
@@ -67,8 +287,8 @@ class ConversationMemory:
             conversation_data = {
                 "user_id": user_id,
                 "exported_at": datetime.now().isoformat(),
-                "total_messages": len(self.conversations[user_id]),
-                "messages": self.conversations[user_id]
+                "total_messages": len(history),
+                "messages": [msg.to_dict() for msg in history]
             }
             
             with open(filepath, 'w', encoding='utf-8') as f:
@@ -87,7 +307,20 @@ class ConversationMemory:
             with open(filepath, 'r', encoding='utf-8') as f:
                 conversation_data = json.load(f)
             
-            self.conversations[user_id] = conversation_data.get("messages", [])
+            history = History(self.max_history * 2)
+            for message in conversation_data.get("messages", []):
+                history.append(Message.from_dict(message, history.next_id))
+                history.next_id = max(history.next_id, history[-1].message_id) + 1
+            history.nbytes = sum(message_bytes(m) for m in history)
+            with self._lock:
+                self._evicting.pop(user_id, None)
+                previous = self.conversations.pop(user_id, None)
+                if previous is not None:
+                    self.resident_bytes -= previous.nbytes
+            self._admit(user_id, history)
+            if self.search_index is not None:
+                self.search_index.remove_user(user_id)
+                self._index_messages(user_id, history)
             logger.info(f"Loaded conversation for user {user_id} from {filepath}")
             return True
             
@@ -95,46 +328,82 @@ class ConversationMemory:
             logger.error(f"Failed to load conversation for user {user_id}: {e}")
             return False
     
+    def import_history(self, user_id: str, rows: List[tuple]) -> bool:
+        """Install (role, content, timestamp, message_id, tokens) rows unless the user already has history"""
+        if not rows or self._load_history(user_id):
+            return False
+        history = History(self.max_history * 2)
+        history.extend(Message(*row) for row in rows)
+        history.next_id = max(row[3] for row in rows) + 1
+        history.nbytes = sum(message_bytes(m) for m in history)
+        with self._lock:
+            if self.conversations.get(user_id):
+                return False
+            previous = self.conversations.pop(user_id, None)
+            if previous is not None:
+                self.resident_bytes -= previous.nbytes
+        self._admit(user_id, history)
+        self._index_messages(user_id, history)
+        return True
+    
+    def _index_messages(self, user_id: str, messages):
+        if self.search_index is not None:
+            for message in messages:
+                self.search_index.add(user_id, message.message_id, message.role, message.content, message.timestamp)
+    
     def export_conversation(self, user_id: str, format: str = "json") -> Optional[str]:
         """Export conversation in specified format"""
-        if format == "json":
-            return self._export_json(user_id)
-        elif format == "text":
-            return self._export_text(user_id)
-        else:
+        chunks = self.iter_export(user_id, format)
+        return "".join(chunks) if chunks is not None else None
+    
+    def iter_export(self, user_id: str, format: str = "json") -> Optional[Iterator[str]]:
+        """Stream an export (json, ndjson or text); None if the user has no conversation"""
+        if format not in EXPORT_FORMATS:
             logger.error(f"Unsupported export format: {format}")
             return None
-    
-    def _export_json(self, user_id: str) -> Optional[str]:
-        """Export conversation as JSON string"""
-        if user_id not in self.conversations:
+        history = self._load_history(user_id)
+        if history is None:
             return None
-            
-        conversation_data = {
-            "user_id": user_id,
-            "exported_at": datetime.now().isoformat(),
-            "total_messages": len(self.conversations[user_id]),
-            "messages": self.conversations[user_id]
-        }
-        
-        return json.dumps(conversation_data, indent=2, ensure_ascii=False)
+        # Snapshot the message list so the export is consistent while new messages arrive
+        return iter_export(user_id, list(history), format)
     
-    def _export_text(self, user_id: str) -> Optional[str]:
-        """Export conversation as readable text"""
-        if user_id not in self.conversations:
-            return None
-            
-        text_lines = [f"Conversation with {user_id}"]
-        text_lines.append(f"Exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        text_lines.append("-" * 50)
-        
-        for msg in self.conversations[user_id]:
-            role = "You" if msg["role"] == "user" else "Assistant"
-            timestamp = datetime.fromisoformat(msg["timestamp"]).strftime("%H:%M:%S")
-            text_lines.append(f"[{timestamp}] {role}: {msg['content']}")
-        
-        return "\n".join(text_lines)
+    def peek_history(self, user_id: str) -> List[Message]:
+        """A user's messages from whichever tier holds them, without making them resident"""
+        with self._lock:
+            history = self.conversations.get(user_id)
+            if history is None and user_id in self._evicting:
+                history = self._evicting[user_id][0]
+            if history is not None:
+                return list(history)
+        if self.cold_tier is not None and user_id in self.cold_tier:
+            return self.cold_tier.peek(user_id)
+        if self.store is not None:
+            return self.store.load(user_id, self.max_history * 2)
+        return []
     
     def get_user_ids(self) -> List[str]:
         """Get list of all user IDs with conversations"""
-        return list(self.conversations.keys())
\ No newline at end of file
+        with self._lock:
+            user_ids = list(self.conversations.keys()) + list(self._evicting)
+        if self.cold_tier is not None:
+            user_ids += self.cold_tier.user_ids()
+        if self.store is not None:
+            user_ids += self.store.user_ids()
+        return list(dict.fromkeys(user_ids))
+    
+    def get_tier_stats(self) -> Dict:
+        """Resident and evicted conversation counts"""
+        with self._lock:
+            return {
+                "resident_users": len(self.conversations),
+                "resident_bytes": self.resident_bytes,
+                "cold_users": len(self.cold_tier) if self.cold_tier is not None else 0,
+                "evictions": int(self._m_evictions.value())
+            }
+    
+    def close(self):
+        """Flush pending writes and release the store"""
+        if self.store is not None:
+            self.store.close()
+        if self.search_index is not None:
+            self.search_index.close()
\ No newline at end of file
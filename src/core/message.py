@@ -0,0 +1,82 @@
+"""
+Message - Compact stored message record and per-user ring buffer
+"""
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict
+
+from .context_packer import estimate_tokens
+
+
+class Message:
+    """
+    Compact stored message. Reads like the old dict (msg["role"], msg.get())
+    so existing callers keep working; timestamps are epoch seconds.
+    """
+    __slots__ = ("role", "content", "timestamp", "message_id", "tokens")
+
+    def __init__(self, role: str, content: str, timestamp: float, message_id: int, tokens: int):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
+        self.message_id = message_id
+        self.tokens = tokens
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict:
+        """JSON form used by exports and saved files (ISO timestamp)"""
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat(),
+            "message_id": self.message_id,
+            "tokens": self.tokens
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, message_id: int) -> "Message":
+        timestamp = data.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        content = data.get("content", "")
+        return cls(
+            data.get("role", "user"),
+            content,
+            timestamp if timestamp is not None else time.time(),
+            data.get("message_id", message_id),
+            data.get("tokens") or estimate_tokens(content)
+        )
+
+    def __repr__(self) -> str:
+        return f"Message({self.message_id}, {self.role!r}, {self.content[:30]!r})"
+
+
+# Approximate resident cost of a Message record beyond its content
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def message_bytes(message: Message) -> int:
+    return len(message.content) + MESSAGE_OVERHEAD_BYTES
+
+
+class History(deque):
+    """
+    Bounded per-user ring buffer of messages. next_id keeps ids monotonic
+    after trimming; nbytes is the approximate resident size, kept up to
+    date by ConversationMemory.
+    """
+    __slots__ = ("next_id", "nbytes")
+
+    def __init__(self, maxlen: int):
+        super().__init__((), maxlen)
+        self.next_id = 1
+        self.nbytes = 0
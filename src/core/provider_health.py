@@ -0,0 +1,186 @@
+"""
+Provider Health - Circuit breakers and health scores for remote providers
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderHealth:
+    """Rolling outcome window, latency EWMA and breaker state for one provider"""
+
+    def __init__(self, window: int):
+        self.outcomes = deque(maxlen=window)
+        self.latency_ewma: Optional[float] = None
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_started: Optional[float] = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def expected_latency(self) -> float:
+        """Latency inflated by the chance of having to retry elsewhere"""
+        if self.latency_ewma is None:
+            return 0.0  # Untried providers go first so they get measured
+        return self.latency_ewma / max(1.0 - self.error_rate, 0.05)
+
+
+class ProviderHealthTracker:
+    """
+    Per-provider circuit breaker (closed -> open -> half-open) plus health scores.
+
+    A provider opens after failure_threshold failures in a row, or when its
+    error rate over the last `window` calls reaches error_rate_threshold.
+    While open it is skipped entirely. After `cooldown` seconds one trial call
+    (a real request or the background probe) is let through: success closes
+    the breaker, failure opens it again.
+    """
+
+    def __init__(self, providers: List[str], config: Optional[Dict] = None):
+        config = config or {}
+        self.failure_threshold = config.get('breaker_failure_threshold', 5)
+        self.error_rate_threshold = config.get('breaker_error_rate', 0.5)
+        self.min_samples = config.get('breaker_min_samples', 10)
+        self.cooldown = config.get('breaker_cooldown', 30.0)
+        self.alpha = config.get('health_latency_alpha', 0.3)
+        self.window = config.get('health_window', 20)
+        self.providers = list(providers)
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._probe_stop = threading.Event()
+
+    def _get(self, name: str) -> ProviderHealth:
+        health = self._health.get(name)
+        if health is None:
+            health = self._health[name] = ProviderHealth(self.window)
+        return health
+
+    def _trial_available(self, health: ProviderHealth, now: float) -> bool:
+        """Whether an open or half-open breaker may let one call through"""
+        if health.state == OPEN:
+            return now - health.opened_at >= self.cooldown
+        # Half-open: one trial at a time; a trial that never reported back expires
+        return health.trial_started is None or now - health.trial_started >= self.cooldown
+
+    def order(self, providers: List[str]) -> List[str]:
+        """Providers that may be called now, best expected latency first"""
+        now = time.monotonic()
+        ranked = []
+        with self._lock:
+            for index, name in enumerate(providers):
+                health = self._get(name)
+                if health.state == CLOSED:
+                    ranked.append((0, health.expected_latency(), index, name))
+                elif self._trial_available(health, now):
+                    ranked.append((1, health.expected_latency(), index, name))
+        return [name for *_, name in sorted(ranked)]
+
+    def acquire(self, name: str) -> bool:
+        """Reserve a call slot; open breakers only admit a single trial"""
+        now = time.monotonic()
+        with self._lock:
+            health = self._get(name)
+            if health.state == CLOSED:
+                return True
+            if not self._trial_available(health, now):
+                return False
+            health.state = HALF_OPEN
+            health.trial_started = now
+            return True
+
+    def release(self, name: str):
+        """Give back a reserved slot whose call never produced an outcome"""
+        with self._lock:
+            health = self._get(name)
+            if health.state == HALF_OPEN:
+                health.trial_started = None
+
+    def record(self, name: str, success: bool, latency: float):
+        """Record a call outcome and move the breaker accordingly"""
+        with self._lock:
+            health = self._get(name)
+            health.outcomes.append(1 if success else 0)
+            if health.latency_ewma is None:
+                health.latency_ewma = latency
+            else:
+                health.latency_ewma += self.alpha * (latency - health.latency_ewma)
+
+            if success:
+                health.consecutive_failures = 0
+                if health.state != CLOSED:
+                    # Recovered: start over with a clean window
+                    health.state = CLOSED
+                    health.trial_started = None
+                    health.outcomes.clear()
+                    health.outcomes.append(1)
+                    logger.info(f"Circuit closed for provider {name}")
+                return
+
+            health.consecutive_failures += 1
+            tripped = (
+                health.state == HALF_OPEN
+                or health.consecutive_failures >= self.failure_threshold
+                or (len(health.outcomes) >= self.min_samples and health.error_rate >= self.error_rate_threshold)
+            )
+            if tripped:
+                if health.state != OPEN:
+                    logger.warning(f"Circuit opened for provider {name} (error rate {health.error_rate:.0%})")
+                health.state = OPEN
+                health.opened_at = time.monotonic()
+                health.trial_started = None
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            return self._get(name).state
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Current breaker state and scores for every known provider"""
+        with self._lock:
+            return {
+                name: {
+                    "state": self._get(name).state,
+                    "error_rate": round(self._get(name).error_rate, 4),
+                    "latency_ewma": self._get(name).latency_ewma,
+                    "consecutive_failures": self._get(name).consecutive_failures
+                }
+                for name in self.providers
+            }
+
+    def start_probe(self, probe: Callable[[str], bool], interval: float):
+        """Probe open providers in the background instead of spending user requests on them"""
+        if self._probe_thread is not None or interval <= 0:
+            return
+
+        def run():
+            while not self._probe_stop.wait(interval):
+                for name in self.providers:
+                    if self.state(name) == CLOSED or not self.acquire(name):
+                        continue
+                    start = time.monotonic()
+                    try:
+                        success = bool(probe(name))
+                    except Exception as e:
+                        logger.debug(f"Health probe for {name} failed: {e}")
+                        success = False
+                    self.record(name, success, time.monotonic() - start)
+
+        self._probe_thread = threading.Thread(target=run, name="provider-health-probe", daemon=True)
+        self._probe_thread.start()
+
+    def stop_probe(self):
+        self._probe_stop.set()
+        self._probe_thread = None
@@ -0,0 +1,281 @@
+"""
+Redis Store - Shared conversation state for multiple workers and nodes
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from .conversation_store import ConversationStore
+from .message import Message
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryRedis:
+    """
+    Minimal in-process stand-in for the Redis commands the store uses
+    (lists, sets, strings, delete, pipelines). For tests and single-process
+    development with REDIS_URL=memory://.
+    """
+
+    def __init__(self):
+        self._lists: Dict[str, list] = defaultdict(list)
+        self._sets: Dict[str, set] = defaultdict(set)
+        self._strings: Dict[str, bytes] = {}
+        self._lock = threading.RLock()
+        self.round_trips = 0
+
+    def rpush(self, key: str, *values):
+        with self._lock:
+            self._lists[key].extend(v.encode('utf-8') if isinstance(v, str) else v for v in values)
+            return len(self._lists[key])
+
+    def ltrim(self, key: str, start: int, end: int):
+        with self._lock:
+            items = self._lists[key]
+            end = len(items) + end if end < 0 else end
+            start = max(len(items) + start, 0) if start < 0 else start
+            self._lists[key] = items[start:end + 1]
+            return True
+
+    def lrange(self, key: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            items = self._lists.get(key, [])
+            end = len(items) + end if end < 0 else end
+            start = max(len(items) + start, 0) if start < 0 else start
+            return list(items[start:end + 1])
+
+    def sadd(self, key: str, *members):
+        with self._lock:
+            self._sets[key].update(m.encode('utf-8') if isinstance(m, str) else m for m in members)
+
+    def srem(self, key: str, *members):
+        with self._lock:
+            self._sets[key].difference_update(m.encode('utf-8') if isinstance(m, str) else m for m in members)
+
+    def smembers(self, key: str) -> set:
+        with self._lock:
+            return set(self._sets.get(key, ()))
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._strings.get(key)
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._strings[key] = value.encode('utf-8') if isinstance(value, str) else value
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._lists.pop(key, None)
+                self._sets.pop(key, None)
+                self._strings.pop(key, None)
+
+    def pipeline(self, transaction: bool = False) -> "_InMemoryPipeline":
+        return _InMemoryPipeline(self)
+
+
+class _InMemoryPipeline:
+    def __init__(self, client: InMemoryRedis):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        def queue_command(*args):
+            self._commands.append((name, args))
+            return self
+        return queue_command
+
+    def execute(self) -> list:
+        # One round trip for the whole batch, applied atomically
+        with self._client._lock:
+            self._client.round_trips += 1
+            results = [getattr(self._client, name)(*args) for name, args in self._commands]
+        self._commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._commands = []
+
+
+def connect_redis(url: str):
+    """Client for a redis:// URL, or the in-process stand-in for memory://"""
+    if url.startswith("memory://"):
+        return InMemoryRedis()
+    if redis is None:
+        raise ImportError("The redis package is required for STORAGE_BACKEND=redis (pip install redis)")
+    return redis.Redis.from_url(url)
+
+
+class RedisConversationStore(ConversationStore):
+    """
+    Conversation store on a Redis-compatible server, shared by every worker.
+
+    Each user is a capped list of JSON rows. Appends and clears are queued
+    and a writer thread sends them in pipelines (one round trip per batch,
+    up to batch_size operations or flush_interval seconds). load() waits
+    for this worker's own pending writes for that user, so a worker always
+    reads its own writes, and load_many() fetches several users in one
+    pipelined round trip. Rolling summaries are kept as one JSON string
+    per user, so every worker folds into and reads the same summary.
+    """
+
+    keeps_summaries = True
+
+    def __init__(self, client, prefix: str = "aicb", retain: int = 40,
+                 batch_size: int = 256, flush_interval: float = 0.005):
+        self.client = client
+        self.prefix = prefix
+        self.retain = retain
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._users_key = f"{prefix}:users"
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._pending_cond = threading.Condition()
+        self._pipelines = 0
+        self._thread = threading.Thread(target=self._run, name="redis-writer", daemon=True)
+        self._thread.start()
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.prefix}:conv:{user_id}"
+
+    def _summary_key(self, user_id: str) -> str:
+        return f"{self.prefix}:summary:{user_id}"
+
+    def _enqueue(self, op: str, user_id: Optional[str], arg=None):
+        if user_id is not None:
+            with self._pending_cond:
+                self._pending[user_id] += 1
+        self._queue.put((op, user_id, arg))
+
+    def append(self, user_id: str, message: Message):
+        self._enqueue("append", user_id, message)
+
+    def clear(self, user_id: str):
+        self._enqueue("clear", user_id)
+
+    def flush(self, timeout: Optional[float] = None):
+        done = threading.Event()
+        self._queue.put(("flush", None, done))
+        done.wait(timeout)
+
+    def _take_batch(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1][0] in ("append", "clear"):
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Redis pipeline of {len(batch)} operations failed: {e}")
+            with self._pending_cond:
+                for op, user_id, _ in batch:
+                    if user_id is not None:
+                        self._pending[user_id] -= 1
+                        if not self._pending[user_id]:
+                            del self._pending[user_id]
+                self._pending_cond.notify_all()
+            for op, _, arg in batch:
+                if op in ("flush", "stop"):
+                    arg.set()
+                if op == "stop":
+                    return
+
+    def _write(self, batch: List[tuple]):
+        appended = defaultdict(list)
+        pipe = self.client.pipeline(transaction=False)
+        for op, user_id, message in batch:
+            if op == "append":
+                appended[user_id].append(json.dumps(
+                    [message.role, message.content, message.timestamp, message.message_id, message.tokens],
+                    ensure_ascii=False
+                ))
+            elif op == "clear":
+                # Appends queued before the clear are dropped with it
+                appended.pop(user_id, None)
+                pipe.delete(self._key(user_id))
+                pipe.srem(self._users_key, user_id)
+        for user_id, rows in appended.items():
+            pipe.rpush(self._key(user_id), *rows)
+            pipe.ltrim(self._key(user_id), -self.retain, -1)
+            pipe.sadd(self._users_key, user_id)
+        pipe.execute()
+        self._pipelines += 1
+
+    def sync(self, user_id: str, timeout: Optional[float] = None):
+        self._wait_own_writes([user_id], timeout if timeout is not None else 5.0)
+
+    def _wait_own_writes(self, user_ids: List[str], timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        with self._pending_cond:
+            while any(self._pending.get(u) for u in user_ids):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._pending_cond.wait(remaining)
+
+    @staticmethod
+    def _decode(rows) -> List[Message]:
+        return [Message(*json.loads(row)) for row in rows]
+
+    def load(self, user_id: str, limit: int) -> List[Message]:
+        if limit <= 0:
+            return []
+        self._wait_own_writes([user_id])
+        return self._decode(self.client.lrange(self._key(user_id), -limit, -1))
+
+    def load_many(self, user_ids: List[str], limit: int) -> Dict[str, List[Message]]:
+        """Histories for several users in one pipelined round trip"""
+        self._wait_own_writes(user_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.lrange(self._key(user_id), -limit, -1)
+        return {user_id: self._decode(rows) for user_id, rows in zip(user_ids, pipe.execute())}
+
+    def load_summary(self, user_id: str) -> Optional[List[str]]:
+        raw = self.client.get(self._summary_key(user_id))
+        return json.loads(raw) if raw else None
+
+    def save_summary(self, user_id: str, notes: Optional[List[str]]):
+        # Written directly: the summarizer saves from its own thread, in fold order
+        if notes:
+            self.client.set(self._summary_key(user_id), json.dumps(notes, ensure_ascii=False))
+        else:
+            self.client.delete(self._summary_key(user_id))
+
+    def user_ids(self) -> List[str]:
+        return [m.decode('utf-8') if isinstance(m, bytes) else m for m in self.client.smembers(self._users_key)]
+
+    def stats(self) -> Dict:
+        return {"backend": "redis", "pending": self._queue.qsize(), "pipelines": self._pipelines}
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        stopped = threading.Event()
+        self._queue.put(("stop", None, stopped))
+        stopped.wait()
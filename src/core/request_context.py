@@ -0,0 +1,122 @@
+"""
+Request Context - Deadline and cancellation token for one chat request
+"""
+import asyncio
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+DISCONNECTED = "disconnected"
+DEADLINE = "deadline"
+
+
+class RequestAborted(Exception):
+    """The request was cancelled or ran out of time; nobody is waiting for its result"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request aborted: {reason}")
+        self.reason = reason
+
+
+class RequestContext:
+    """
+    Carries one request's deadline and cancellation token from the server
+    through AIChatEngine to the API clients.
+
+    cancel() may be called from any thread. Async work inside scope() is
+    interrupted at once (it builds on asyncio.timeout); sync code checks
+    between steps with check(), can be woken through add_callback(), and
+    bounds blocking calls by remaining().
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.reason: Optional[str] = None
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def done(self) -> bool:
+        return self.cancelled or self.expired
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def cancel(self, reason: str = DISCONNECTED):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback on cancel() (now, if already cancelled); returns a function that removes it"""
+        with self._lock:
+            if self.reason is None:
+                key = next(self._ids)
+                self._callbacks[key] = callback
+                return lambda: self._callbacks.pop(key, None)
+        callback()
+        return lambda: None
+
+    def check(self):
+        """Raise RequestAborted if the request was cancelled or its deadline has passed"""
+        if self.reason is not None:
+            raise RequestAborted(self.reason)
+        if self.expired:
+            raise RequestAborted(DEADLINE)
+
+    @asynccontextmanager
+    async def scope(self):
+        """Interrupt the enclosed async work with RequestAborted on cancel() or at the deadline"""
+        self.check()
+        loop = asyncio.get_running_loop()
+        timeout = asyncio.timeout(self.remaining())
+        try:
+            async with timeout:
+                active = True
+
+                def expire():
+                    if active:
+                        timeout.reschedule(0)
+
+                remove = self.add_callback(lambda: loop.call_soon_threadsafe(expire))
+                try:
+                    yield
+                finally:
+                    active = False
+                    remove()
+        except TimeoutError:
+            if not timeout.expired():
+                raise  # raised by the enclosed code itself
+            raise RequestAborted(self.reason or DEADLINE) from None
+
+    async def aiter(self, iterator):
+        """Items of an async iterator; each wait for the next one is interrupted like scope()"""
+        try:
+            while True:
+                async with self.scope():
+                    try:
+                        item = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield item
+        finally:
+            await iterator.aclose()
@@ -0,0 +1,131 @@
+"""
+Response Cache - Pluggable cache for provider responses
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def make_cache_key(prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    """Stable key for a prompt tail plus the parameters that change the answer"""
+    normalized = _WHITESPACE_RE.sub(" ", prompt).strip()
+    raw = json.dumps([normalized, model, round(temperature, 3), max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(ABC):
+    """
+    Interface for response cache backends.
+
+    Values are response dicts. Backends for an external store (Redis,
+    memcached, ...) implement the same four methods.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Dict, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class InMemoryResponseCache(ResponseCache):
+    """In-process LRU cache bounded by total entry size in bytes, with per-entry TTL"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: Optional[float] = 300.0):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(key: str, value: Dict) -> int:
+        return len(key) + len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, size, value = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return dict(value)
+
+    def set(self, key: str, value: Dict, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (expires_at, size, dict(value))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions
+            }
+
+
+def create_response_cache(config: Dict) -> Optional[ResponseCache]:
+    """Build the configured cache backend (None disables caching)"""
+    backend = config.get('response_cache', 'memory')
+    if backend in (None, '', 'none'):
+        return None
+    if backend == 'memory':
+        return InMemoryResponseCache(
+            max_bytes=config.get('cache_max_bytes', 64 * 1024 * 1024),
+            default_ttl=config.get('cache_ttl', 300.0)
+        )
+    logger.error(f"Unknown response cache backend: {backend}")
+    return None
@@ -0,0 +1,600 @@
+"""
+Search Index - Incremental inverted index over conversation messages
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from heapq import nlargest
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no shared index (several workers on one directory) without file locks
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_ROTATED_LOG = re.compile(r"index\.(\d+)\.jsonl")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in is it its me my of on or so "
+    "that the this to was we were what when which who will with you your".split()
+)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords or single characters"""
+    return [t for t in _WORD.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+class _Postings:
+    __slots__ = ("docs", "tfs")
+
+    def __init__(self):
+        # Doc ids are assigned in increasing order, so docs stays sorted
+        self.docs = array("I")
+        self.tfs = array("H")
+
+
+class SearchIndex:
+    """
+    Inverted index updated as messages are added, with BM25 ranking.
+
+    Every message is a document; each term keeps a sorted postings list of
+    document ids with term frequencies, and each user keeps the list of
+    their document ids so a cleared conversation can be dropped. A query
+    walks the rarest term's postings and binary-searches the others
+    (all terms must match), so cost grows with the rarest term rather
+    than the size of the index. Matches are collected newest first and
+    at most max_candidates are ranked, which bounds queries made only of
+    very common terms; total_exact is False when that cap was hit. A
+    since/until range is binary-searched on the doc ids, which follow
+    message time except for late (imported) messages; late messages
+    outside the range count toward the cap. A message whose user already
+    has one with the same or a later message_id is skipped, so importing
+    a conversation again is harmless.
+
+    With max_messages, the oldest messages fall out of the index once it
+    holds more than that. Cleared and expired messages leave dead ids in
+    the postings; once they outnumber the live ones, compact() rebuilds
+    the index in the background and swaps it in, replaying changes made
+    meanwhile.
+
+    With a directory, every change is appended to a JSONL log whose first
+    line holds its generation. snapshot() (run in the background every
+    snapshot_every changes, and on close) renames the log to
+    index.<gen>.jsonl and starts the next one, writes the live messages to
+    snapshot.jsonl outside the lock, and then deletes the logs it covers.
+    Startup loads the snapshot and replays every log newer than it.
+
+    shared=True is for several worker processes on one directory (as with
+    MEMORY_READ_THROUGH). The log is then the one order of changes: workers
+    append under a shared flock and apply changes, their own included, by
+    reading the log back before every change and search, so each worker
+    indexes and searches every worker's messages. Rotation takes the lock
+    exclusively just to rename the log, and snapshots are written under a
+    second lock file; a worker that fell behind a deleted log reloads.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 1.0,
+                 snapshot_every: int = 100000, max_candidates: int = 10000, max_messages: int = 0,
+                 shared: bool = False):
+        if shared and directory and fcntl is None:
+            raise ValueError("A shared search index needs fcntl file locks")
+        self.directory = directory
+        self.shared = bool(shared and directory)
+        self.max_candidates = max_candidates
+        self.max_messages = max_messages
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self._logged = 0
+        self._lock = threading.RLock()
+        self._reset()
+        self._pending: Optional[list] = None  # changes made while compact() rebuilds
+        self._epoch = 0  # bumped when the index is reloaded, so a running compact() is discarded
+        self._log = None
+        self._tail = None
+        self._closed = threading.Event()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._log_path = os.path.join(directory, "index.jsonl")
+            self._snapshot_path = os.path.join(directory, "snapshot.jsonl")
+            self._snapshot_lock = threading.Lock()
+            with self._file_lock("index.lock"), self._file_lock("snapshot.lock"):
+                self._recover()
+            self._open_log()
+        if directory or max_messages:
+            threading.Thread(target=self._run, name="search-index-maintenance", daemon=True).start()
+
+    def _reset(self):
+        self._postings: Dict[str, _Postings] = {}
+        self._user_docs: Dict[str, array] = {}
+        self._doc_users: List[Optional[str]] = []
+        self._doc_roles: List[Optional[str]] = []
+        self._doc_contents: List[Optional[str]] = []
+        self._doc_message_ids = array("I")
+        self._doc_times = array("d")
+        self._doc_time_max = array("d")  # latest timestamp up to each doc id, non-decreasing
+        self._doc_late = array("I")  # doc ids older than a message indexed before them
+        self._doc_lens = array("I")
+        self._live_docs = 0
+        self._total_len = 0
+        self._oldest = 0  # no live message has a lower doc id
+
+    def __len__(self) -> int:
+        return self._live_docs
+
+    def add(self, user_id: str, message_id: int, role: str, content: str, timestamp: float):
+        """Index one message"""
+        terms = None if self.shared else Counter(tokenize(content))
+        self._change(["a", user_id, message_id, role, content, timestamp], terms)
+
+    def remove_user(self, user_id: str):
+        """Drop every indexed message of a user"""
+        self._change(["c", user_id])
+
+    def _change(self, record: list, terms: Optional[Counter] = None):
+        with self._lock:
+            if self.shared:
+                # Applied when read back from the log, after other workers' earlier changes
+                self._append(record)
+                return
+            self._apply(record, terms)
+            if self._log is not None:
+                self._append(record)
+
+    def _apply(self, record: list, terms: Optional[Counter] = None):
+        if record[0] == "a":
+            _, user_id, message_id, role, content, timestamp = record
+            docs = self._user_docs.get(user_id)
+            if docs and self._doc_message_ids[docs[-1]] >= message_id:
+                return  # already indexed
+            self._apply_add(user_id, message_id, role, content, timestamp,
+                            terms if terms is not None else Counter(tokenize(content)))
+            self._expire()
+        else:
+            self._apply_remove(record[1])
+        if self._pending is not None:
+            self._pending.append((record, terms))
+
+    def _apply_add(self, user_id, message_id, role, content, timestamp, terms: Counter):
+        doc = len(self._doc_users)
+        self._doc_users.append(user_id)
+        self._doc_roles.append(role)
+        self._doc_contents.append(content)
+        self._doc_message_ids.append(message_id)
+        self._doc_times.append(timestamp)
+        latest = self._doc_time_max[-1] if doc else timestamp
+        if timestamp < latest:
+            self._doc_late.append(doc)  # imported history, say
+        self._doc_time_max.append(max(latest, timestamp))
+        length = sum(terms.values())
+        self._doc_lens.append(length)
+        self._live_docs += 1
+        self._total_len += length
+        docs = self._user_docs.get(user_id)
+        if docs is None:
+            docs = self._user_docs[user_id] = array("I")
+        docs.append(doc)
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = _Postings()
+            postings.docs.append(doc)
+            postings.tfs.append(min(tf, 65535))
+
+    def _apply_remove(self, user_id: str):
+        for doc in self._user_docs.pop(user_id, ()):
+            if self._doc_users[doc] is not None:
+                self._drop(doc)
+
+    def _drop(self, doc: int):
+        # Postings keep the dead id until the next compaction; search skips it
+        self._doc_users[doc] = None
+        self._doc_roles[doc] = None
+        self._doc_contents[doc] = None
+        self._live_docs -= 1
+        self._total_len -= self._doc_lens[doc]
+
+    def _expire(self):
+        """Drop the oldest messages while more than max_messages are indexed"""
+        while self.max_messages and self._live_docs > self.max_messages:
+            doc = self._oldest
+            self._oldest += 1
+            if self._doc_users[doc] is not None:
+                self._drop(doc)
+
+    def search(self, query: str, user_id: Optional[str] = None, since: Optional[float] = None,
+               until: Optional[float] = None, offset: int = 0, limit: int = 20) -> Dict:
+        """Ranked hits for messages containing every query term"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if self.shared:
+                self._follow()
+            if not terms or any(t not in self._postings for t in terms):
+                return {"total": 0, "total_exact": True, "hits": []}
+            lists = sorted((self._postings[t] for t in terms), key=lambda p: len(p.docs))
+            n = max(self._live_docs, 1)
+            avg_len = self._total_len / n or 1.0
+            idfs = [math.log(1 + (n - len(p.docs) + 0.5) / (len(p.docs) + 0.5)) for p in lists]
+
+            first = lists[0]
+            candidates = first.docs
+            if user_id is not None:
+                user_docs = self._user_docs.get(user_id)
+                if user_docs is None:
+                    return {"total": 0, "total_exact": True, "hits": []}
+                # Walk whichever is shorter: the user's messages or the rarest term
+                if len(user_docs) < len(candidates):
+                    candidates = user_docs
+            walk_first = candidates is first.docs
+            rest = list(zip(lists[1:], idfs[1:])) if walk_first else list(zip(lists, idfs))
+            # Candidates are walked newest first, so each search only needs to look
+            # below where the previous one landed
+            bounds = [len(postings.docs) for postings, _ in rest]
+
+            doc_users, doc_times, doc_lens = self._doc_users, self._doc_times, self._doc_lens
+            scored: List[Tuple[float, int]] = []
+            skipped = 0
+            exact = True
+            for j in self._walk(candidates, since, until):
+                doc = candidates[j]
+                owner = doc_users[doc]
+                if owner is None or (user_id is not None and owner != user_id):
+                    continue
+                timestamp = doc_times[doc]
+                if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                    # Only late messages get here; they count toward the cap like scored ones
+                    skipped += 1
+                    if len(scored) + skipped >= self.max_candidates:
+                        exact = False
+                        break
+                    continue
+                norm = K1 * (1 - B + B * doc_lens[doc] / avg_len)
+                score = 0.0
+                if walk_first:
+                    tf = first.tfs[j]
+                    score = idfs[0] * tf * (K1 + 1) / (tf + norm)
+                for k, (postings, idf) in enumerate(rest):
+                    i = bisect_left(postings.docs, doc, 0, bounds[k])
+                    bounds[k] = i
+                    if i == len(postings.docs) or postings.docs[i] != doc:
+                        break
+                    tf = postings.tfs[i]
+                    score += idf * tf * (K1 + 1) / (tf + norm)
+                else:
+                    scored.append((score, doc))
+                    if len(scored) + skipped >= self.max_candidates:
+                        exact = False
+                        break
+
+            top = nlargest(offset + limit, scored)[offset:]
+            hits = [{
+                "user_id": doc_users[doc],
+                "message_id": self._doc_message_ids[doc],
+                "role": self._doc_roles[doc],
+                "content": self._doc_contents[doc],
+                "timestamp": doc_times[doc],
+                "score": round(score, 4)
+            } for score, doc in top]
+        return {"total": len(scored), "total_exact": exact, "hits": hits}
+
+    def _walk(self, candidates: array, since: Optional[float], until: Optional[float]):
+        """
+        Positions in candidates that can fall in [since, until], newest first.
+        Messages indexed in timestamp order are binary-searched by the running
+        latest timestamp; late ones past the range are looked up one by one.
+        """
+        lo, hi = 0, len(self._doc_times)
+        if since is not None:
+            lo = bisect_left(self._doc_time_max, since)  # everything below is older than since
+        if until is not None:
+            hi = max(bisect_right(self._doc_time_max, until), lo)
+        end = len(candidates)
+        if hi < len(self._doc_times):
+            for k in range(len(self._doc_late) - 1, bisect_left(self._doc_late, hi) - 1, -1):
+                doc = self._doc_late[k]
+                j = bisect_left(candidates, doc, 0, end)
+                end = j
+                if j < len(candidates) and candidates[j] == doc:
+                    yield j
+        yield from range(bisect_left(candidates, hi, 0, end) - 1, bisect_left(candidates, lo) - 1, -1)
+
+    @contextmanager
+    def _file_lock(self, name: str, exclusive: bool = False):
+        """flock a lock file in the directory, across worker processes; a no-op unless shared"""
+        if not self.shared:
+            yield
+            return
+        # A fresh descriptor each time, so threads of this process exclude each other too
+        with open(os.path.join(self.directory, name), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _recover(self):
+        """Load the snapshot and every newer log; the caller holds both file locks"""
+        start = time.perf_counter()
+        self._reset()
+        self._epoch += 1
+        self._pending = None
+        snapshot_gen = 0
+        if os.path.exists(self._snapshot_path):
+            try:
+                with open(self._snapshot_path, 'r', encoding='utf-8') as f:
+                    snapshot_gen = json.loads(f.readline())["gen"]
+                    for line in f:
+                        user_id, message_id, role, content, timestamp = json.loads(line)
+                        self._apply_add(user_id, message_id, role, content, timestamp, Counter(tokenize(content)))
+            except Exception as e:
+                logger.error(f"Unreadable search index snapshot {self._snapshot_path}, rebuilding from the logs: {e}")
+                self._reset()
+                snapshot_gen = 0
+        replayed = 0
+        self._gen = snapshot_gen + 1
+        for gen, path in self._rotated_logs():
+            if gen > snapshot_gen:
+                with open(path, 'rb') as f:
+                    replayed += self._read_log(f)
+            self._gen = max(self._gen, gen + 1)
+        self._create_log()
+        if self._tail is not None:
+            self._tail.close()
+        self._open_tail()
+        replayed += self._read_log(self._tail)
+        if not self.shared:
+            self._tail.close()
+            self._tail = None
+        self._expire()
+        self._logged = replayed
+        if self._live_docs:
+            logger.info(f"Search index loaded {self._live_docs} messages ({replayed} from the logs) "
+                        f"in {time.perf_counter() - start:.2f}s")
+
+    def _read_log(self, f) -> int:
+        """Apply the complete lines from f's position on; returns how many changes there were"""
+        replayed = 0
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                # End of the log, or a line still being written (or torn by a crash)
+                f.seek(position)
+                return replayed
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping unreadable search index log line in {f.name}")
+                continue
+            if isinstance(record, list):
+                self._apply(record)
+                replayed += 1
+
+    def _open_tail(self):
+        """Open the live log for reading, just past its generation header"""
+        self._tail = open(self._log_path, 'rb')
+        self._gen = json.loads(self._tail.readline())["gen"]
+
+    def _rotated_logs(self) -> List[Tuple[int, str]]:
+        """Closed change logs still on disk, oldest first"""
+        logs = []
+        for name in os.listdir(self.directory):
+            match = _ROTATED_LOG.fullmatch(name)
+            if match:
+                logs.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(logs)
+
+    def _create_log(self):
+        """Start the live log with its generation header, unless it exists"""
+        if os.path.exists(self._log_path) and os.path.getsize(self._log_path):
+            return
+        # Linked into place whole, so readers never see a log without its header
+        tmp_path = f"{self._log_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"gen": self._gen}) + "\n")
+        try:
+            if os.path.exists(self._log_path):
+                os.replace(tmp_path, self._log_path)  # empty, left by a crash
+            else:
+                os.link(tmp_path, self._log_path)
+        except FileExistsError:
+            pass  # another worker created it first
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _open_log(self):
+        if self.shared:
+            # Unbuffered: each change is a single write() at the end of the file
+            self._log = open(self._log_path, 'ab', buffering=0)
+            return
+        self._log = open(self._log_path, 'a', encoding='utf-8')
+        with open(self._log_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Terminate a torn final record so the next change starts on its own line
+                self._log.write("\n")
+
+    def _append(self, record: list):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        if not self.shared:
+            self._log.write(line)
+            self._logged += 1
+            return
+        with self._file_lock("index.lock"):
+            if os.fstat(self._log.fileno()).st_ino != os.stat(self._log_path).st_ino:
+                self._log.close()
+                self._open_log()  # another worker rotated the log
+            self._log.write(line.encode('utf-8'))
+            self._catch_up()
+
+    def _follow(self):
+        """Apply the changes other workers appended to the shared log"""
+        with self._file_lock("index.lock"):
+            self._catch_up()
+
+    def _catch_up(self):
+        """_follow for a caller that already holds the log's file lock"""
+        self._logged += self._read_log(self._tail)
+        if os.fstat(self._tail.fileno()).st_ino == os.stat(self._log_path).st_ino:
+            return
+        # Rotated by a worker that held the lock exclusively, so the old log is complete
+        previous = self._gen
+        self._tail.close()
+        self._open_tail()
+        self._logged = 0
+        for gen in range(previous + 1, self._gen):
+            path = os.path.join(self.directory, f"index.{gen}.jsonl")
+            if not os.path.exists(path):
+                logger.warning(f"Search index fell behind the shared log at generation {gen}; reloading")
+                with self._file_lock("snapshot.lock"):
+                    self._recover()
+                return
+            with open(path, 'rb') as f:
+                self._read_log(f)
+        self._logged += self._read_log(self._tail)
+
+    def _rotate(self) -> int:
+        """Close the change log and start the next one; returns the closed log's generation"""
+        gen = self._gen
+        self._log.close()
+        os.replace(self._log_path, os.path.join(self.directory, f"index.{gen}.jsonl"))
+        self._gen += 1
+        self._create_log()
+        self._open_log()
+        self._logged = 0
+        return gen
+
+    def _copy_docs(self) -> tuple:
+        """Plain copies of the per-message columns, so they can be read without the lock"""
+        return (self._doc_users[:], self._doc_message_ids[:], self._doc_roles[:],
+                self._doc_contents[:], self._doc_times[:])
+
+    def _state(self) -> Dict:
+        return {k: v for k, v in self.__dict__.items() if k.startswith("_doc") or k in (
+            "_postings", "_user_docs", "_live_docs", "_total_len", "_oldest")}
+
+    @property
+    def dead_docs(self) -> int:
+        return len(self._doc_users) - self._live_docs
+
+    def compact(self):
+        """Rebuild the postings without cleared or expired messages"""
+        with self._lock:
+            if self._pending is not None:
+                return  # already running
+            self._pending = []
+            epoch = self._epoch
+            docs = self._copy_docs()
+        try:
+            fresh = SearchIndex()
+            for user_id, message_id, role, content, timestamp in zip(*docs):
+                if user_id is not None:
+                    fresh._apply_add(user_id, message_id, role, content, timestamp, Counter(tokenize(content)))
+            # Catch up on changes made meanwhile; only the last few are applied under the lock
+            while True:
+                with self._lock:
+                    if self._epoch != epoch:
+                        return  # reloaded from disk meanwhile
+                    changes, self._pending = self._pending, []
+                    if len(changes) < 256:
+                        fresh._apply_changes(changes)
+                        self.__dict__.update(fresh._state())
+                        self._expire()
+                        self._pending = None
+                        return
+                fresh._apply_changes(changes)
+        finally:
+            with self._lock:
+                if self._epoch == epoch:
+                    self._pending = None
+
+    def _apply_changes(self, changes: list):
+        for record, terms in changes:
+            self._apply(record, terms)
+
+    def snapshot(self, min_changes: int = 0):
+        """Write the live messages to disk and drop the change logs they cover"""
+        if not self.directory:
+            return
+        # Only the log rotation and column copies hold the lock; adds and
+        # searches carry on while the snapshot is written
+        with self._lock:
+            with self._file_lock("index.lock", exclusive=True):
+                if self.shared:
+                    self._catch_up()
+                if self._logged < min_changes:
+                    return  # nothing new, or another worker just rotated
+                gen = self._rotate()
+            docs = self._copy_docs()
+        with self._snapshot_lock, self._file_lock("snapshot.lock", exclusive=True):
+            if gen <= self._snapshot_gen():
+                return  # a newer snapshot was written meanwhile
+            tmp_path = self._snapshot_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"gen": gen}) + "\n")
+                for user_id, message_id, role, content, timestamp in zip(*docs):
+                    if user_id is not None:
+                        f.write(json.dumps([user_id, message_id, role, content, timestamp],
+                                           ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._snapshot_path)
+            for old, path in self._rotated_logs():
+                if old <= gen:
+                    os.remove(path)
+
+    def _snapshot_gen(self) -> int:
+        if not os.path.exists(self._snapshot_path):
+            return 0
+        with open(self._snapshot_path, 'r', encoding='utf-8') as f:
+            return json.loads(f.readline())["gen"]
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                if self.dead_docs > max(self._live_docs, 1000):
+                    self.compact()
+                if self._log is None:
+                    continue
+                if self._logged >= self.snapshot_every:
+                    self.snapshot(self.snapshot_every)
+                with self._lock:
+                    if self._closed.is_set():
+                        continue
+                    if self.shared:
+                        self._follow()
+                    else:
+                        self._log.flush()
+            except Exception as e:
+                logger.error(f"Search index maintenance failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            if self.shared:
+                self._follow()
+            return {"messages": self._live_docs, "users": len(self._user_docs), "terms": len(self._postings)}
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._log is None:
+            return
+        self.snapshot(min_changes=1)
+        with self._lock:
+            self._log.close()
+            if self._tail is not None:
+                self._tail.close()
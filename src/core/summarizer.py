@@ -0,0 +1,176 @@
+"""
+Conversation Summarizer - Rolling per-user summaries of trimmed history
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .context_packer import estimate_tokens
+from .conversation_store import ConversationStore
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Words kept from each folded message
+NOTE_WORDS = 24
+
+
+def summarize_message(message: Dict) -> str:
+    """One short note per message: the first sentence, cut to NOTE_WORDS words"""
+    first = _SENTENCE_RE.split(message["content"].strip(), maxsplit=1)[0]
+    words = first.split()
+    text = " ".join(words[:NOTE_WORDS]) + ("..." if len(words) > NOTE_WORDS else "")
+    speaker = "User" if message["role"] == "user" else "Assistant"
+    return f"{speaker}: {text}"
+
+
+class _Summary:
+    __slots__ = ("notes", "tokens")
+
+    def __init__(self):
+        self.notes = deque()
+        self.tokens = 0
+
+
+class ConversationSummarizer:
+    """
+    Folds messages trimmed from memory into a bounded rolling summary.
+
+    Folding runs on a single background thread, so it stays off the
+    request path and each user's messages are folded in order. The default
+    is extractive: one short note per message, oldest notes dropped once
+    the summary exceeds max_tokens, so each fold only touches the new
+    messages. A custom summarize_fn(previous_summary, messages) -> str
+    (e.g. an LLM call) replaces that.
+
+    Summaries follow their history: ConversationMemory takes a user's
+    summary out with evict() when it moves the history to the cold tier,
+    and puts it back with restore(), so without a store a summary is only
+    dropped with its history. With a store that keeps summaries (Redis),
+    every fold is saved there and summaries are loaded from it, so they
+    survive eviction and restarts, and at most max_users are cached, least
+    recently used dropped first; shared=True (several workers on one
+    store) reads the store's copy every time instead of a cached one.
+    """
+
+    def __init__(self, max_tokens: int = 200,
+                 summarize_fn: Optional[Callable[[str, List[Dict]], str]] = None,
+                 max_users: int = 10000, store: Optional[ConversationStore] = None,
+                 shared: bool = False):
+        self.max_tokens = max_tokens
+        self.summarize_fn = summarize_fn
+        self.max_users = max_users
+        self.store = store if store is not None and store.keeps_summaries else None
+        self.shared = shared and self.store is not None
+        self._summaries: "OrderedDict[str, _Summary]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+
+    def submit(self, user_id: str, messages: List[Dict]):
+        """Queue trimmed messages to be folded into the user's summary"""
+        if messages:
+            self._executor.submit(self._fold, user_id, list(messages))
+
+    def _fold(self, user_id: str, messages: List[Dict]):
+        try:
+            if self.summarize_fn is not None:
+                text = self.summarize_fn(self.get(user_id) or "", messages)
+                notes = [text] if text else []
+                replace = True
+            else:
+                notes = [summarize_message(msg) for msg in messages]
+                replace = False
+            if self.store is not None and (self.shared or user_id not in self._summaries):
+                self._load(user_id)
+            with self._lock:
+                summary = self._cached(user_id, create=True)
+                if replace:
+                    summary.notes.clear()
+                    summary.tokens = 0
+                self._add_notes(summary, notes)
+                saved = [note for note, _ in summary.notes]
+            if self.store is not None:
+                self.store.save_summary(user_id, saved)
+        except Exception as e:
+            logger.error(f"Failed to summarize history for user {user_id}: {e}")
+
+    def _cached(self, user_id: str, create: bool = False) -> Optional[_Summary]:
+        """The in-memory summary, marked as recently used; the caller holds the lock"""
+        summary = self._summaries.get(user_id)
+        if summary is not None:
+            self._summaries.move_to_end(user_id)
+        elif create:
+            summary = self._summaries[user_id] = _Summary()
+            # Only a store can give a dropped summary back
+            while self.store is not None and len(self._summaries) > self.max_users:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def _add_notes(self, summary: _Summary, notes: List[str]):
+        for note in notes:
+            summary.notes.append((note, estimate_tokens(note)))
+            summary.tokens += summary.notes[-1][1]
+        while summary.tokens > self.max_tokens and len(summary.notes) > 1:
+            summary.tokens -= summary.notes.popleft()[1]
+
+    def _load(self, user_id: str):
+        """Replace the cached summary with the store's copy"""
+        notes = self.store.load_summary(user_id)
+        with self._lock:
+            self._summaries.pop(user_id, None)
+            if notes:
+                self._add_notes(self._cached(user_id, create=True), notes)
+
+    def get(self, user_id: str) -> Optional[str]:
+        """Current summary text for a user, or None"""
+        if self.store is not None and (self.shared or user_id not in self._summaries):
+            self._load(user_id)
+        with self._lock:
+            summary = self._cached(user_id)
+            if summary is None or not summary.notes:
+                return None
+            return "\n".join(note for note, _ in summary.notes)
+
+    def evict(self, user_id: str) -> Optional[List[str]]:
+        """
+        Drop a user's summary from memory along with their history; returns
+        its notes for the caller to keep, or None when the store has them
+        """
+        with self._lock:
+            summary = self._summaries.pop(user_id, None)
+        if summary is None or self.store is not None:
+            return None
+        return [note for note, _ in summary.notes]
+
+    def restore(self, user_id: str, notes: Optional[List[str]]):
+        """Bring back notes returned by evict(), before any folded since"""
+        if not notes:
+            return
+        with self._lock:
+            summary = self._cached(user_id, create=True)
+            newer = [note for note, _ in summary.notes]
+            summary.notes.clear()
+            summary.tokens = 0
+            self._add_notes(summary, notes + newer)
+
+    def clear(self, user_id: str):
+        self._discard(user_id)
+        # Folds already queued for this user must not bring the summary back
+        self._executor.submit(self._discard, user_id)
+
+    def _discard(self, user_id: str):
+        with self._lock:
+            self._summaries.pop(user_id, None)
+        if self.store is not None:
+            self.store.save_summary(user_id, None)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Wait until every queued fold has been applied"""
+        self._executor.submit(lambda: None).result(timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
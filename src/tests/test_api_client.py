@@ -0,0 +1,574 @@
+"""
+Test suite for the Multi-API client
+"""
+import asyncio
+import time
+import pytest
+import httpx
+from src.core.api_client import MultiAPIClient
+from src.core.async_api_client import AsyncMultiAPIClient
+from src.core.intent_engine import IntentEngine
+from src.core.request_context import RequestAborted, RequestContext
+from src.utils.metrics import MetricsRegistry
+
+
+class TestIntentEngine:
+    def test_whole_word_matching(self):
+        """Short patterns do not fire inside longer words"""
+        engine = IntentEngine.from_file()
+        assert engine.match("hi there")["name"] == "hi"
+        assert engine.match("this is said plainly") is None
+
+    def test_priority_and_multi_word_patterns(self):
+        """Higher priority wins regardless of position in the message"""
+        engine = IntentEngine.from_file()
+        assert engine.match("python help please")["name"] == "help"
+        assert engine.match("so, how are you today?")["name"] == "how_are_you"
+
+    def test_overlapping_patterns(self):
+        """Failure links find patterns that start inside a partial match"""
+        engine = IntentEngine([
+            {"name": "long", "priority": 1, "patterns": ["a b c"]},
+            {"name": "short", "priority": 2, "patterns": ["b d"]},
+        ])
+        assert engine.match("a b d")["name"] == "short"
+        assert engine.match("x a b c")["name"] == "long"
+        assert engine.match("a b") is None
+
+    def test_ascii_and_unicode_text_split_the_same_way(self):
+        """The ASCII fast path splits words exactly like the regex"""
+        from src.core.intent_engine import tokenize
+        assert tokenize("Hi, HOW-are_you? (42)") == ["hi", "how", "are_you", "42"]
+        assert tokenize("Héllo, wörld—ok") == ["héllo", "wörld", "ok"]
+        engine = IntentEngine.from_file()
+        assert engine.match("Thanks!!")["name"] == engine.match("thanks ✓")["name"]
+
+
+class TestMultiAPIClient:
+    def test_local_response(self):
+        """Matched intents are answered locally"""
+        client = MultiAPIClient({"local_default_responses": True})
+        result = client.chat_completion([{"role": "user", "content": "Hello!"}])
+        assert result["success"]
+        assert result["provider"] == "local"
+
+    def test_local_miss_without_defaults(self):
+        """Unmatched messages fall through when default responses are off"""
+        client = MultiAPIClient({"local_default_responses": False})
+        result = client._local_intelligent_response("", [{"role": "user", "content": "zzz"}])
+        assert not result["success"]
+
+    def test_hedged_race_picks_first_answer(self):
+        """A slow provider is hedged and the faster one wins"""
+        client = MultiAPIClient({
+            "local_default_responses": False,
+            "remote_providers": ["huggingface", "openrouter"],
+            "routing_mode": "hedged",
+            "hedge_delay": 0.05,
+            "request_deadline": 2.0
+        })
+
+        def slow(prompt, **kwargs):
+            time.sleep(0.5)
+            return {"success": True, "content": "slow", "provider": "huggingface"}
+
+        def fast(prompt, **kwargs):
+            return {"success": True, "content": "fast", "provider": "openrouter"}
+
+        client._try_huggingface = slow
+        client._try_openrouter = fast
+        result = client.chat_completion([{"role": "user", "content": "zzz"}])
+        client.close()
+
+        assert result["content"] == "fast"
+        assert result["routing"]["winner"] == "openrouter"
+        assert result["routing"]["attempted"] == ["huggingface", "openrouter"]
+        assert result["routing"]["elapsed"] < 0.5
+
+    def test_deadline_caps_sequential_calls(self):
+        """Each sequential call only gets the time left in the budget"""
+        client = MultiAPIClient({
+            "local_default_responses": False,
+            "remote_providers": ["huggingface", "openrouter"],
+            "request_deadline": 5.0
+        })
+        timeouts = []
+
+        def failing(prompt, timeout=None, **kwargs):
+            timeouts.append(timeout)
+            return {"success": False, "error": "down"}
+
+        client._try_huggingface = failing
+        client._try_openrouter = failing
+        result = client.chat_completion([{"role": "user", "content": "zzz"}])
+
+        assert result["provider"] == "local_fallback"
+        assert result["routing"]["winner"] is None
+        assert all(t <= 5.0 for t in timeouts)
+
+
+class TestAsyncMultiAPIClient:
+    @pytest.mark.asyncio
+    async def test_pooled_huggingface_call(self):
+        """Remote calls go through the per-provider pooled client"""
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(200, json=[{"generated_text": "remote reply"}])
+
+        client = AsyncMultiAPIClient({"local_default_responses": False})
+        client._clients["huggingface"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            result = await client.chat_completion([{"role": "user", "content": "zzz"}], temperature=0.2, max_tokens=32)
+        finally:
+            await client.aclose()
+
+        assert result["provider"] == "huggingface"
+        assert result["content"] == "remote reply"
+        assert len(seen) == 1
+
+    @pytest.mark.asyncio
+    async def test_parallel_race_cancels_losers(self):
+        """The losing provider task is cancelled once a winner answers"""
+        client = AsyncMultiAPIClient({
+            "local_default_responses": False,
+            "remote_providers": ["huggingface", "openrouter"],
+            "routing_mode": "parallel",
+            "request_deadline": 2.0
+        })
+        cancelled = asyncio.Event()
+
+        async def slow(prompt, **kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def fast(prompt, **kwargs):
+            return {"success": True, "content": "fast", "provider": "openrouter"}
+
+        client._atry_huggingface = slow
+        client._atry_openrouter = fast
+        result = await client.chat_completion([{"role": "user", "content": "zzz"}])
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+        assert result["routing"]["winner"] == "openrouter"
+        assert result["routing"]["budget_used"] < 0.5
+
+
+class TestRequestContext:
+    @pytest.mark.asyncio
+    async def test_cancel_aborts_async_provider_call(self):
+        """Cancelling the context cancels the in-flight provider call at once"""
+        client = AsyncMultiAPIClient({"local_default_responses": False, "coalesce_requests": False})
+        cancelled = asyncio.Event()
+
+        async def slow(prompt, **kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        client._atry_huggingface = slow
+        context = RequestContext()
+        asyncio.get_running_loop().call_later(0.05, context.cancel)
+        start = time.perf_counter()
+        with pytest.raises(RequestAborted) as aborted:
+            await client.chat_completion([{"role": "user", "content": "zzz"}], context=context)
+
+        assert aborted.value.reason == "disconnected"
+        assert time.perf_counter() - start < 1.0
+        assert cancelled.is_set()
+        assert client.metrics.get("aicb_provider_calls_aborted_total").value(provider="huggingface") == 1
+        assert client.health.acquire("huggingface")  # the slot was given back, not recorded as a failure
+
+    @pytest.mark.asyncio
+    async def test_deadline_cancels_shared_call_once_its_caller_leaves(self):
+        """A coalesced upstream call is cancelled when its only caller's deadline passes"""
+        client = AsyncMultiAPIClient({"local_default_responses": False})
+        cancelled = asyncio.Event()
+
+        async def slow(prompt, **kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        client._atry_huggingface = slow
+        with pytest.raises(RequestAborted) as aborted:
+            await client.chat_completion([{"role": "user", "content": "zzz"}], context=RequestContext(0.05))
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+        assert aborted.value.reason == "deadline"
+        assert client._ainflight.in_flight() == 0
+
+    def test_sync_caller_stops_waiting_when_cancelled(self):
+        """The sync client returns as soon as the context is cancelled from another thread"""
+        import threading
+        client = MultiAPIClient({"local_default_responses": False})
+
+        def slow(prompt, timeout=None, **kwargs):
+            time.sleep(0.5)
+            return {"success": True, "content": "late", "provider": "huggingface"}
+
+        client._try_huggingface = slow
+        context = RequestContext()
+        threading.Timer(0.05, context.cancel).start()
+        start = time.perf_counter()
+        with pytest.raises(RequestAborted):
+            client.chat_completion([{"role": "user", "content": "zzz"}], context=context)
+        assert time.perf_counter() - start < 0.4
+
+        with pytest.raises(RequestAborted) as aborted:
+            client.chat_completion([{"role": "user", "content": "zzz"}], context=RequestContext(0))
+        assert aborted.value.reason == "deadline"
+
+    def test_shared_hedged_call_does_not_starve_the_race_pool(self):
+        """A coalesced call waited on with a context runs off the race pool its attempts use"""
+        client = MultiAPIClient({
+            "local_default_responses": False,
+            "remote_providers": ["huggingface", "openrouter"],
+            "routing_mode": "hedged",
+            "race_workers": 1,
+            "request_deadline": 2.0
+        })
+        client._try_huggingface = lambda prompt, **kwargs: {"success": True, "content": "hf", "provider": "huggingface"}
+        context = RequestContext(1.0)
+        for _ in range(3):
+            result = client.chat_completion([{"role": "user", "content": "zzz"}], temperature=0.0, context=context)
+        client.close()
+
+        assert result["content"] == "hf"
+        assert not context._callbacks  # every wait removed its cancel callback
+
+
+class TestProviderHealth:
+    def test_breaker_opens_and_skips_provider(self):
+        """An open provider costs nothing until its cooldown elapses"""
+        client = MultiAPIClient({
+            "local_default_responses": False,
+            "remote_providers": ["huggingface"],
+            "breaker_failure_threshold": 2,
+            "breaker_cooldown": 60
+        })
+        calls = []
+
+        def failing(prompt, **kwargs):
+            calls.append(prompt)
+            return {"success": False, "error": "down"}
+
+        client._try_huggingface = failing
+        for _ in range(5):
+            result = client.chat_completion([{"role": "user", "content": "zzz"}])
+            assert result["provider"] == "local_fallback"
+
+        assert client.health.state("huggingface") == "open"
+        assert len(calls) == 2
+        assert result["routing"]["attempted"] == []
+
+    def test_half_open_trial_closes_breaker(self):
+        """One trial after the cooldown decides whether the provider is back"""
+        from src.core.provider_health import ProviderHealthTracker
+        tracker = ProviderHealthTracker(["a"], {"breaker_failure_threshold": 1, "breaker_cooldown": 0.05})
+        tracker.record("a", False, 0.1)
+        assert tracker.state("a") == "open"
+        assert not tracker.acquire("a")
+
+        time.sleep(0.06)
+        assert tracker.acquire("a")
+        assert not tracker.acquire("a")  # only one trial in flight
+        tracker.record("a", True, 0.1)
+        assert tracker.state("a") == "closed"
+
+    def test_order_prefers_faster_provider(self):
+        """Closed providers are ordered by latency inflated by error rate"""
+        from src.core.provider_health import ProviderHealthTracker
+        tracker = ProviderHealthTracker(["slow", "fast"])
+        tracker.record("slow", True, 2.0)
+        tracker.record("fast", True, 0.2)
+        assert tracker.order(["slow", "fast"]) == ["fast", "slow"]
+
+
+class TestResponseCache:
+    def test_repeated_prompt_served_from_cache(self):
+        """Prompts differing only in whitespace hit the provider once; case still matters"""
+        client = MultiAPIClient({"local_default_responses": False})
+        calls = []
+
+        def remote(prompt, **kwargs):
+            calls.append(prompt)
+            return {"success": True, "content": "remote", "provider": "huggingface"}
+
+        client._try_huggingface = remote
+        messages = [{"role": "user", "content": "zzz   question"}]
+        first = client.chat_completion(messages, temperature=0.0)
+        second = client.chat_completion([{"role": "user", "content": " zzz question\n"}], temperature=0.0)
+        third = client.chat_completion(messages, temperature=0.0, max_tokens=50)
+        shouted = client.chat_completion([{"role": "user", "content": "ZZZ question"}], temperature=0.0)
+        sampled = client.chat_completion(messages)
+
+        assert len(calls) == 4
+        assert second["cached"] and "cached" not in first
+        assert "cached" not in third and "cached" not in shouted and "cached" not in sampled
+        stats = client.get_usage_stats()
+        assert stats["cache_hits"] == 1 and stats["cache_misses"] == 3
+
+    def test_nondeterministic_opt_out(self):
+        """temperature > 0 bypasses the cache unless opted in"""
+        client = MultiAPIClient({"local_default_responses": False})
+        assert client._cache_key("prompt", "huggingface", 0.7, 200) is None
+        assert client._cache_key("prompt", "huggingface", 0.0, 200) is not None
+        client = MultiAPIClient({"local_default_responses": False, "cache_nondeterministic": True})
+        assert client._cache_key("prompt", "huggingface", 0.7, 200) is not None
+
+    def test_lru_byte_bound_and_ttl(self):
+        """Oldest entries are evicted past max_bytes and expired entries vanish"""
+        from src.core.response_cache import InMemoryResponseCache
+        cache = InMemoryResponseCache(max_bytes=300, default_ttl=None)
+        for i in range(10):
+            cache.set(f"k{i}", {"content": "x" * 40})
+        assert cache.get("k0") is None
+        assert cache.get("k9") is not None
+        assert cache.stats()["bytes"] <= 300
+
+        cache.set("short", {"content": "y"}, ttl=0.01)
+        time.sleep(0.02)
+        assert cache.get("short") is None
+
+    def test_backends_must_implement_the_interface(self):
+        """ResponseCache is abstract; a backend missing a method cannot be created"""
+        from src.core.response_cache import ResponseCache
+
+        class Incomplete(ResponseCache):
+            def get(self, key):
+                return None
+
+        with pytest.raises(TypeError):
+            ResponseCache()
+        with pytest.raises(TypeError):
+            Incomplete()
+
+
+class TestStreaming:
+    def test_stream_remote_tokens_and_cache(self):
+        """Remote tokens are yielded as they arrive and the reply is cached"""
+        client = MultiAPIClient({"local_default_responses": False})
+
+        def fake_stream(name, prompt, temperature, max_tokens, timeout):
+            yield "Hello"
+            yield " world"
+
+        client._stream_provider = fake_stream
+        messages = [{"role": "user", "content": "zzz"}]
+        assert list(client.chat_completion(messages, temperature=0.0, stream=True)) == ["Hello", " world"]
+        assert client.chat_completion(messages, temperature=0.0)["content"] == "Hello world"
+        assert client.get_usage_stats()["cache_hits"] == 1
+
+    def test_parse_stream_lines(self):
+        """Both provider SSE formats decode to token text"""
+        client = MultiAPIClient({})
+        assert client._parse_stream_line("huggingface", 'data: {"token": {"text": "Hi"}}') == "Hi"
+        assert client._parse_stream_line("openrouter", 'data: {"choices": [{"delta": {"content": "Yo"}}]}') == "Yo"
+        assert client._parse_stream_line("openrouter", "data: [DONE]") is None
+        assert client._parse_stream_line("openrouter", ": keep-alive") is None
+
+    @pytest.mark.asyncio
+    async def test_async_stream_local(self):
+        """Local answers stream as word chunks on the async client"""
+        client = AsyncMultiAPIClient({"local_default_responses": True})
+        stream = await client.chat_completion([{"role": "user", "content": "hello"}], stream=True)
+        tokens = [token async for token in stream]
+        assert len(tokens) > 1
+
+
+class TestCoalescing:
+    def test_threads_share_one_upstream_call(self):
+        """Concurrent identical requests from threads make one provider call"""
+        import threading
+        client = MultiAPIClient({"local_default_responses": False, "response_cache": "none"})
+        calls = []
+        release = threading.Event()
+
+        def remote(prompt, **kwargs):
+            calls.append(prompt)
+            release.wait(1)
+            return {"success": True, "content": "shared", "provider": "huggingface"}
+
+        client._try_huggingface = remote
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                client.chat_completion([{"role": "user", "content": "viral"}], temperature=0.0)
+            ))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert all(r["content"] == "shared" for r in results)
+        assert client.get_usage_stats()["coalesced_requests"] == 7
+
+    @pytest.mark.asyncio
+    async def test_async_callers_share_one_upstream_call(self):
+        """Concurrent identical coroutines make one provider call"""
+        client = AsyncMultiAPIClient({"local_default_responses": False, "response_cache": "none"})
+        calls = []
+
+        async def remote(prompt, **kwargs):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            return {"success": True, "content": "shared", "provider": "huggingface"}
+
+        client._atry_huggingface = remote
+        results = await asyncio.gather(*[
+            client.chat_completion([{"role": "user", "content": "viral"}], temperature=0.0) for _ in range(10)
+        ])
+
+        assert len(calls) == 1
+        assert sum(1 for r in results if r.get("coalesced")) == 9
+        assert client.get_usage_stats()["coalesced_requests"] == 9
+
+
+class TestMicroBatching:
+    def test_thread_batcher_groups_concurrent_items(self):
+        """Items submitted within the window go out as one batch"""
+        from src.core.batching import MicroBatcher
+        batches = []
+
+        def batch_fn(group, items):
+            batches.append(list(items))
+            return [item.upper() for item in items]
+
+        batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait=0.05)
+        futures = [batcher.submit("g", f"p{i}") for i in range(4)]
+        results = [future.result(timeout=1) for future in futures]
+        batcher.close()
+
+        assert results == ["P0", "P1", "P2", "P3"]
+        assert batches == [["p0", "p1", "p2", "p3"]]
+        snapshot = batcher.stats.snapshot()
+        assert snapshot["batches"] == 1 and snapshot["avg_batch_size"] == 4
+
+    @pytest.mark.asyncio
+    async def test_async_client_batches_huggingface_calls(self):
+        """Concurrent distinct prompts share one Inference API request"""
+        import json
+        requests_seen = []
+
+        def handler(request):
+            inputs = json.loads(request.content)["inputs"]
+            requests_seen.append(inputs)
+            return httpx.Response(200, json=[[{"generated_text": f"re: {p[-2:]}"}] for p in inputs])
+
+        client = AsyncMultiAPIClient({
+            "local_default_responses": False,
+            "response_cache": "none",
+            "batching_enabled": True,
+            "batch_max_size": 16,
+            "batch_max_wait": 0.02
+        })
+        client._clients["huggingface"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            results = await asyncio.gather(*[
+                client.chat_completion([{"role": "user", "content": f"q{i:02d}"}]) for i in range(5)
+            ])
+        finally:
+            await client.aclose()
+
+        assert len(requests_seen) == 1 and len(requests_seen[0]) == 5
+        assert [r["content"] for r in results] == [f"re: {i:02d}" for i in range(5)]
+        assert client.get_batching_stats()["enabled"]
+
+
+class TestFakeProviders:
+    def _client(self, app, providers):
+        client = AsyncMultiAPIClient({
+            "local_default_responses": False,
+            "response_cache": "none",
+            "remote_providers": providers,
+            "providers": {
+                "huggingface": {"url": "http://fake/models/fake-model"},
+                "openrouter": {"url": "http://fake/api/v1/chat/completions"}
+            }
+        })
+        for name in ("huggingface", "openrouter"):
+            client._clients[name] = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+        return client
+
+    @pytest.mark.asyncio
+    async def test_client_against_fake_providers(self):
+        """Both provider shapes round-trip through the offline stand-in"""
+        from src.web.fake_providers import create_fake_provider_app
+        app = create_fake_provider_app()
+        for provider in ("huggingface", "openrouter"):
+            client = self._client(app, [provider])
+            try:
+                result = await client.chat_completion([{"role": "user", "content": "zzz"}])
+                stream = await client.chat_completion([{"role": "user", "content": "zzz"}], stream=True)
+                streamed = "".join([token async for token in stream])
+            finally:
+                await client.aclose()
+            assert result["provider"] == provider
+            assert result["content"] == "Fake reply to: User: zzz"
+            assert streamed == result["content"]
+
+    @pytest.mark.asyncio
+    async def test_fake_provider_errors(self):
+        """A 100% error rate sends the client to its fallback"""
+        from src.web.fake_providers import create_fake_provider_app
+        client = self._client(create_fake_provider_app(error_rate=1.0), ["huggingface"])
+        try:
+            result = await client.chat_completion([{"role": "user", "content": "zzz"}])
+        finally:
+            await client.aclose()
+        assert result["provider"] == "local_fallback"
+
+
+class TestMetrics:
+    def test_registry_counts_across_threads_and_renders(self):
+        """Concurrent increments are not lost and render as Prometheus text"""
+        import threading
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "Test counter", ["kind"])
+        latency = registry.histogram("test_seconds", "Test latency", buckets=(0.1, 1.0))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(kind="a")
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latency.observe(0.05)
+        latency.observe(0.5)
+
+        assert counter.value(kind="a") == 8000
+        assert registry.counter("test_total", labelnames=["kind"]) is counter
+        text = registry.render()
+        assert 'test_total{kind="a"} 8000' in text
+        assert 'test_seconds_bucket{le="0.1"} 1' in text
+        assert 'test_seconds_bucket{le="+Inf"} 2' in text
+        assert "test_seconds_count 2" in text
+
+    def test_client_usage_stats_come_from_registry(self):
+        """Sync and async clients sharing a registry report combined usage"""
+        registry = MetricsRegistry()
+        client = MultiAPIClient(metrics=registry)
+        async_client = AsyncMultiAPIClient(metrics=registry)
+        client.chat_completion([{"role": "user", "content": "hello"}])
+        asyncio.run(async_client.chat_completion([{"role": "user", "content": "hello"}]))
+
+        assert client.get_usage_stats()["total_requests"] == 2
+        assert registry.get("aicb_chat_responses_total").value(source="local") == 2
+        client.close()
+        asyncio.run(async_client.aclose())
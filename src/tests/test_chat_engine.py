@@ -4,6 +4,9 @@ Test suite for AI Chat Engine
 import pytest
 from src.core.chat_engine import AIChatEngine
 from src.core.memory_manager import ConversationMemory
+from src.core import context_packer
+from src.core.context_packer import ContextPacker, estimate_tokens
+from src.core.summarizer import ConversationSummarizer
 
 class TestChatEngine:
     def test_memory_management(self):
@@ -23,4 +26,198 @@ class TestChatEngine:
         
         assert len(messages) == 2  # system prompt + user message
         assert messages[0]["role"] == "system"
-        assert messages[1]["content"] == "Test message"
\ No newline at end of file
+        assert messages[1]["content"] == "Test message"
+    
+    def test_chat_stream_records_full_reply(self):
+        """The streamed reply is stored in memory once the stream finishes"""
+        chat_engine = AIChatEngine("test-key")
+        tokens = list(chat_engine.chat_stream("Hello", "stream_user"))
+
+        history = chat_engine.memory.get_conversation("stream_user")
+        assert len(history) == 2
+        assert history[1]["content"] == "".join(tokens)
+
+    def test_context_packer_keeps_newest_history_within_budget(self):
+        """History is filled newest first until the token budget is reached"""
+        memory = ConversationMemory()
+        for i in range(20):
+            memory.add_message("packer_user", "user", f"message number {i} " + "word " * 20)
+        history = memory.get_conversation("packer_user")
+        packer = ContextPacker(token_budget=120)
+        system = [{"role": "system", "content": "Be brief."}]
+
+        messages = packer.pack(history, "latest question", system)
+        kept = messages[1:-1]
+
+        assert messages[0] == system[0]
+        assert messages[-1] == {"role": "user", "content": "latest question"}
+        assert 0 < len(kept) < len(history)
+        assert kept[-1]["content"] == history[-1]["content"]
+        assert sum(context_packer.message_tokens(m) for m in messages) <= 120
+
+    def test_token_counts_are_cached_on_stored_messages(self, monkeypatch):
+        """Packing reuses the count stored by add_message instead of re-tokenizing"""
+        memory = ConversationMemory()
+        memory.add_message("count_user", "user", "Hello there, how are you?")
+        history = memory.get_conversation("count_user")
+        assert history[0]["tokens"] == estimate_tokens("Hello there, how are you?")
+
+        calls = []
+        original = context_packer.estimate_tokens
+        monkeypatch.setattr(context_packer, "estimate_tokens", lambda text: calls.append(text) or original(text))
+        ContextPacker(1024).pack(history, "next", [{"role": "system", "content": "sys"}])
+        assert "Hello there, how are you?" not in calls
+
+    def test_trimmed_history_is_folded_into_summary(self):
+        """Messages dropped by trimming end up in a bounded summary system message"""
+        summarizer = ConversationSummarizer(max_tokens=40)
+        memory = ConversationMemory(max_history=2, summarizer=summarizer)
+        for i in range(10):
+            memory.add_message("summary_user", "user", f"Topic {i} is interesting. More detail here.")
+        summarizer.flush(timeout=5)
+
+        summary = memory.get_summary("summary_user")
+        assert "Topic 5 is interesting." in summary
+        assert "More detail" not in summary
+        assert "Topic 0" not in summary  # oldest notes dropped to stay within budget
+        assert estimate_tokens(summary) <= 40
+
+        chat_engine = AIChatEngine("test-key")
+        messages = chat_engine._build_messages(memory.get_conversation("summary_user"), "Next", "sys", summary)
+        assert messages[1]["role"] == "system" and "Topic 5" in messages[1]["content"]
+
+        memory.clear_conversation("summary_user")
+        summarizer.flush(timeout=5)
+        assert memory.get_summary("summary_user") is None
+
+    def test_ring_buffer_keeps_ids_monotonic(self):
+        """Trimming drops the oldest messages without reusing message ids"""
+        memory = ConversationMemory(max_history=2)
+        for i in range(7):
+            memory.add_message("ring_user", "user", f"message {i}")
+
+        history = memory.get_conversation("ring_user")
+        assert len(history) == 4
+        assert [m["message_id"] for m in history] == [4, 5, 6, 7]
+        assert isinstance(history[-1]["timestamp"], float)
+        assert [m.content for m in memory.get_last_n_messages("ring_user", 2)] == ["message 5", "message 6"]
+        assert '"message_id": 7' in memory.export_conversation("ring_user")
+
+    def test_same_user_messages_are_serialized_other_users_run_in_parallel(self):
+        """Concurrent achat calls keep each conversation ordered without blocking other users"""
+        import asyncio
+        import time
+        chat_engine = AIChatEngine("test-key", config={"history_summary": False})
+        prompts = []
+
+        async def slow_completion(messages, **kwargs):
+            prompts.append([m["content"] for m in messages])
+            await asyncio.sleep(0.05)
+            return {"success": True, "content": f"re: {messages[-1]['content']}"}
+
+        chat_engine.async_api_client.chat_completion = slow_completion
+
+        async def run():
+            start = time.perf_counter()
+            await asyncio.gather(*(chat_engine.achat(f"m{i}", "same_user") for i in range(3)),
+                                 *(chat_engine.achat("hi", f"user{i}") for i in range(6)))
+            return time.perf_counter() - start
+
+        elapsed = asyncio.run(run())
+        history = [m.content for m in chat_engine.memory.get_conversation("same_user")]
+        assert history == ["m0", "re: m0", "m1", "re: m1", "m2", "re: m2"]
+        assert [p for p in prompts if p[-1] == "m2"][0][-5:] == ["m0", "re: m0", "m1", "re: m1", "m2"]
+        assert elapsed < 0.25  # 3 serialized calls; the other users overlap with them
+        assert len(chat_engine._user_locks) == 0
+
+    def test_sync_and_async_holders_share_the_user_lock(self):
+        """A thread and a task holding the same user's lock run one after the other, in order"""
+        import asyncio
+        import threading
+        import time
+        from src.core.keyed_lock import KeyedLock
+        locks = KeyedLock()
+        order = []
+        held = threading.Event()
+
+        def sync_holder():
+            with locks.hold("u"):
+                held.set()
+                order.append("sync start")
+                time.sleep(0.05)
+                order.append("sync end")
+
+        async def run():
+            thread = threading.Thread(target=sync_holder)
+            thread.start()
+            await asyncio.get_running_loop().run_in_executor(None, held.wait)
+
+            async def async_holder(name):
+                async with locks.ahold("u"):
+                    order.append(name)
+
+            first = asyncio.ensure_future(async_holder("a1"))
+            gone = asyncio.ensure_future(async_holder("cancelled"))
+            last = asyncio.ensure_future(async_holder("a2"))
+            await asyncio.sleep(0.01)
+            assert order == ["sync start"]  # every task waits for the thread
+            gone.cancel()
+            await asyncio.gather(first, last)
+            thread.join()
+
+        asyncio.run(run())
+        assert order == ["sync start", "sync end", "a1", "a2"]
+        assert len(locks) == 0
+
+    def test_aborted_messages_are_not_answered_or_stored(self):
+        """A cancelled message gives up waiting for the user's turn and is counted"""
+        import asyncio
+        from src.core.request_context import RequestAborted, RequestContext
+        chat_engine = AIChatEngine("test-key", config={"history_summary": False})
+        calls = []
+
+        async def slow_completion(messages, **kwargs):
+            calls.append(messages[-1]["content"])
+            await asyncio.sleep(0.1)
+            return {"success": True, "content": "ok"}
+
+        chat_engine.async_api_client.chat_completion = slow_completion
+
+        async def run():
+            context = RequestContext()
+            first = asyncio.ensure_future(chat_engine.achat("first", "u"))
+            second = asyncio.ensure_future(chat_engine.achat("second", "u", context=context))
+            await asyncio.sleep(0.02)
+            context.cancel()
+            with pytest.raises(RequestAborted):
+                await second
+            await first
+
+        asyncio.run(run())
+        assert calls == ["first"]
+        assert [m.content for m in chat_engine.memory.get_conversation("u")] == ["first", "ok"]
+        aborted = chat_engine.metrics.get("aicb_chat_aborted_total")
+        assert aborted.value(reason="disconnected", stage="waiting") == 1
+
+    def test_chat_many_keeps_input_order_and_isolates_failures(self):
+        """chat_many answers every item in order; one failing item does not fail the batch"""
+        import asyncio
+        chat_engine = AIChatEngine("test-key", config={"history_summary": False})
+
+        async def flaky_completion(messages, **kwargs):
+            if messages[-1]["content"] == "boom":
+                raise RuntimeError("provider exploded")
+            await asyncio.sleep(0.01 if messages[-1]["content"] == "slow" else 0)
+            return {"success": True, "content": f"re: {messages[-1]['content']}"}
+
+        chat_engine.async_api_client.chat_completion = flaky_completion
+        items = [("a", "slow"), ("b", "boom"), ("a", "second", "technical"), ("c", "fast")]
+        results = asyncio.run(chat_engine.achat_many(items, concurrency=2))
+
+        assert [r["index"] for r in results] == [0, 1, 2, 3]
+        assert [r["success"] for r in results] == [True, False, True, True]
+        assert results[1]["error"] == "provider exploded"
+        assert [m.content for m in chat_engine.memory.get_conversation("a")] == ["slow", "re: slow", "second", "re: second"]
+
+        sync_results = chat_engine.chat_many([("d", "Hello"), ("e", "Hi there")])
+        assert [r["user_id"] for r in sync_results] == ["d", "e"] and all(r["response"] for r in sync_results)
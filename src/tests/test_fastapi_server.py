@@ -0,0 +1,262 @@
+"""
+Test suite for the FastAPI server
+"""
+import pytest
+from fastapi.testclient import TestClient
+from src.web.fastapi_server import app
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+class TestFastAPIServer:
+    def test_chat_endpoint(self, client):
+        """POST /chat answers and records the exchange"""
+        response = client.post("/chat", json={"message": "Hello", "user_id": "api_user"})
+        assert response.status_code == 200
+        body = response.json()
+        assert body["success"]
+        assert body["conversation_length"] >= 2
+
+    def test_chat_endpoint_reports_failures(self, client, monkeypatch):
+        """A failed exchange comes back with success false and its error"""
+        from src.web import fastapi_server
+
+        def broken(*args):
+            raise RuntimeError("history unavailable")
+
+        monkeypatch.setattr(fastapi_server.chat_engine, "_prepare_messages", broken)
+        body = client.post("/chat", json={"message": "Hello", "user_id": "failing_user"}).json()
+        assert not body["success"]
+        assert body["error"] == "history unavailable"
+
+    def test_chat_stream_endpoint(self, client):
+        """POST /chat/stream sends tokens as Server-Sent Events"""
+        with client.stream("POST", "/chat/stream", json={"message": "Hello", "user_id": "sse_user"}) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = "".join(response.iter_text())
+
+        assert body.count('data: {"token"') > 1
+        assert "event: done" in body
+
+    def test_metrics_endpoint(self, client):
+        """GET /metrics exposes the engine's registry in Prometheus text format"""
+        client.post("/chat", json={"message": "Hello", "user_id": "metrics_user"})
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "# TYPE aicb_chat_requests_total counter" in response.text
+        assert 'aicb_chat_responses_total{source="local"}' in response.text
+
+    def test_conversation_export_endpoint(self, client):
+        """GET /conversation/{user_id}/export streams JSON, NDJSON or gzip"""
+        import gzip
+        import json
+        client.post("/chat", json={"message": "Hello", "user_id": "export_user"})
+
+        response = client.get("/conversation/export_user/export")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["total_messages"] == 2
+        assert body["messages"][0]["content"] == "Hello"
+
+        response = client.get("/conversation/export_user/export", params={"format": "ndjson", "gzip": "true"})
+        lines = gzip.decompress(response.content).decode().splitlines()
+        assert [json.loads(line)["role"] for line in lines] == ["user", "assistant"]
+
+        assert client.get("/conversation/nobody/export").status_code == 404
+        assert client.get("/conversation/export_user/export", params={"format": "xml"}).status_code == 422
+
+    def test_chat_is_forwarded_to_the_owner_node(self, client, monkeypatch):
+        """With CLUSTER_NODES set, /chat goes to the user's owner or falls back locally"""
+        import httpx
+        from src.core.affinity import ConsistentHashRing
+        from src.web import fastapi_server
+
+        seen = []
+
+        def owner(request):
+            seen.append(request.headers.get("X-AICB-Forwarded"))
+            return httpx.Response(200, json={"success": True, "response": "from owner"})
+
+        monkeypatch.setattr(fastapi_server, "affinity_ring", ConsistentHashRing(["http://owner"]))
+        monkeypatch.setattr(fastapi_server, "cluster_self", "http://self")
+        monkeypatch.setattr(fastapi_server, "peer_client", httpx.AsyncClient(transport=httpx.MockTransport(owner)))
+        response = client.post("/chat", json={"message": "Hello", "user_id": "routed_user"})
+        assert response.json()["response"] == "from owner"
+        assert seen == ["http://self"]
+
+        # Loop guard: forwarded requests are always handled here
+        response = client.post("/chat", json={"message": "Hello", "user_id": "routed_user"},
+                               headers={"X-AICB-Forwarded": "http://owner"})
+        assert response.json()["response"] != "from owner"
+
+        def down(request):
+            raise httpx.ConnectError("owner down")
+
+        monkeypatch.setattr(fastapi_server, "peer_client", httpx.AsyncClient(transport=httpx.MockTransport(down)))
+        response = client.post("/chat", json={"message": "Hello", "user_id": "routed_user"})
+        assert response.status_code == 200 and response.json()["conversation_length"] == 4
+
+    def test_search_endpoint(self, client):
+        """GET /search returns ranked, paginated hits from indexed messages"""
+        client.post("/chat", json={"message": "Tell me about zeppelins", "user_id": "search_user"})
+        response = client.get("/search", params={"q": "zeppelins", "user_id": "search_user"})
+        assert response.status_code == 200
+        body = response.json()
+        assert body["total"] >= 1 and body["page"] == 1
+        assert body["hits"][0]["content"] == "Tell me about zeppelins"
+        assert "T" in body["hits"][0]["timestamp"]
+
+        assert client.get("/search", params={"q": "zeppelins", "since": "2999-01-01T00:00:00"}).json()["total"] == 0
+        assert client.get("/search", params={"q": "zeppelins", "page": 0}).status_code == 422
+
+    def test_chat_batch_endpoint(self, client):
+        """POST /chat/batch streams one NDJSON result per item in input order"""
+        import json
+        items = [{"message": "Hello", "user_id": f"batch_{i % 2}"} for i in range(5)]
+        with client.stream("POST", "/chat/batch", json={"items": items}) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            results = [json.loads(line) for line in response.iter_lines() if line]
+
+        assert [r["index"] for r in results] == list(range(5))
+        assert all(r["success"] for r in results)
+        assert client.get("/conversation/batch_0/stats").json()["total_messages"] == 6
+
+        assert client.post("/chat/batch", json={"items": items, "concurrency": 0}).status_code == 422
+        with client.stream("POST", "/chat/batch", json={"items": items[:1], "concurrency": 100000}) as response:
+            assert json.loads(next(response.iter_lines()))["success"]
+
+    def test_websocket_session_streams_many_messages(self, client):
+        """/ws/chat keeps one user-bound session and streams each reply"""
+        with client.websocket_connect("/ws/chat?user_id=ws_user") as ws:
+            session = ws.receive_json()
+            assert session["type"] == "session" and session["conversation_length"] == 0
+
+            ws.send_json({"type": "ping"})
+            ws.send_text("not json")
+            ws.send_json({"type": "message", "message": "Hello", "id": "a"})
+            ws.send_json({"type": "message", "message": "How are you?", "id": "b"})
+            frames = []
+            while sum(f["type"] == "done" for f in frames) < 2:
+                frames.append(ws.receive_json())
+
+        assert {"type": "pong"} in frames
+        assert any(f["type"] == "error" and "JSON" in f["error"] for f in frames)
+        replies = {}
+        for frame in frames:
+            if frame["type"] == "token":
+                replies[frame["id"]] = replies.get(frame["id"], "") + frame["token"]
+        assert replies["a"] and replies["b"]
+        assert [f["conversation_length"] for f in frames if f["type"] == "done"] == [2, 4]
+        assert [f["id"] for f in frames if f["type"] == "start"] == ["a", "b"]
+
+    def test_websocket_idle_clients_are_closed(self, client, monkeypatch):
+        """Clients that stop answering heartbeats are disconnected"""
+        from starlette.websockets import WebSocketDisconnect
+        from src.web import fastapi_server
+        monkeypatch.setitem(fastapi_server.chat_engine.config, "ws_heartbeat_interval", 0.05)
+        monkeypatch.setitem(fastapi_server.chat_engine.config, "ws_idle_timeout", 0.12)
+
+        with client.websocket_connect("/ws/chat?user_id=idle_user") as ws:
+            assert ws.receive_json()["type"] == "session"
+            assert ws.receive_json() == {"type": "ping"}
+            with pytest.raises(WebSocketDisconnect) as closed:
+                while True:
+                    ws.receive_json()
+        assert closed.value.code == 1001
+
+    def test_rate_limited_requests_get_429(self, client, monkeypatch):
+        """Users over their token bucket are turned away with Retry-After"""
+        from src.web import fastapi_server
+        from src.web.admission import AdmissionController
+        monkeypatch.setattr(fastapi_server, "admission", AdmissionController({"rate_limit_rps": 0.5, "rate_limit_burst": 2}))
+
+        statuses = [client.post("/chat", json={"message": "Hello", "user_id": "greedy"}).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+        response = client.post("/chat", json={"message": "Hello", "user_id": "greedy"})
+        assert response.headers["Retry-After"] == "2"
+        assert client.post("/chat", json={"message": "Hello", "user_id": "polite"}).status_code == 200
+        assert client.post("/chat", json={"message": "Hi"}, headers={"X-Request-Timeout": "0"}).status_code == 503
+
+    def test_batch_items_are_admitted_one_by_one(self, client, monkeypatch):
+        """Each batch item takes its own admission slot, so a full server sheds items, not the batch"""
+        import json
+        from src.web import fastapi_server
+        from src.web.admission import AdmissionController
+        controller = AdmissionController({"admission_max_concurrent": 1, "admission_queue_timeout": 0.05})
+        monkeypatch.setattr(fastapi_server, "admission", controller)
+
+        items = [{"message": "Hello", "user_id": f"admitted_{i}"} for i in range(3)]
+        with client.stream("POST", "/chat/batch", json={"items": items}) as response:
+            assert all(json.loads(line)["success"] for line in response.iter_lines() if line)
+
+        held = client.portal.call(controller.admit, "holder")
+        with client.stream("POST", "/chat/batch", json={"items": items}) as response:
+            results = [json.loads(line) for line in response.iter_lines() if line]
+        held.release()
+        assert [r["error"] for r in results] == ["Request shed: deadline"] * 3
+        assert controller.in_flight == 0
+
+
+class TestAdmissionController:
+    def test_interactive_requests_go_ahead_of_batch(self):
+        """Freed slots go to interactive waiters first, then batch in arrival order"""
+        import asyncio
+        from src.web.admission import AdmissionController
+
+        async def scenario():
+            controller = AdmissionController({"admission_max_concurrent": 1})
+            order = []
+
+            async def request(name, lane):
+                async with await controller.admit(name, lane):
+                    order.append(name)
+                    await asyncio.sleep(0.01)
+
+            first = await controller.admit("first")
+            tasks = [asyncio.ensure_future(request(name, lane))
+                     for name, lane in [("batch_1", "batch"), ("batch_2", "batch"), ("chat", "interactive")]]
+            await asyncio.sleep(0.01)
+            assert controller.queue_depth == 3
+            first.release()
+            await asyncio.gather(*tasks)
+            return order, controller.in_flight
+
+        assert asyncio.run(scenario()) == (["chat", "batch_1", "batch_2"], 0)
+
+    def test_full_queue_and_deadlines_shed(self):
+        """A full queue sheds batch work for interactive requests, and waits are bounded"""
+        import asyncio
+        from src.utils.metrics import MetricsRegistry
+        from src.web.admission import AdmissionController, Shed
+
+        async def scenario():
+            metrics = MetricsRegistry()
+            controller = AdmissionController({"admission_max_concurrent": 1, "admission_max_queue": 1,
+                                              "admission_queue_timeout": 0.05}, metrics)
+            held = await controller.admit("a")
+            batch = asyncio.ensure_future(controller.admit(None, "batch"))
+            await asyncio.sleep(0)
+            chat = asyncio.ensure_future(controller.admit("b"))
+            with pytest.raises(Shed) as displaced:
+                await batch
+            assert displaced.value.reason == "displaced" and displaced.value.status_code == 503
+            with pytest.raises(Shed) as full:
+                await controller.admit("c", "batch")
+            assert full.value.reason == "queue_full"
+            with pytest.raises(Shed) as timed_out:
+                await chat
+            assert timed_out.value.reason == "deadline"
+            held.release()
+            assert controller.in_flight == 0 and controller.queue_depth == 0
+            return metrics.get("aicb_admission_shed_total")
+
+        shed = asyncio.run(scenario())
+        assert shed.value(lane="batch", reason="displaced") == 1
+        assert shed.value(lane="interactive", reason="deadline") == 1
@@ -0,0 +1,485 @@
+"""
+Tests for conversation persistence backends
+"""
+import os
+import time
+from src.core.affinity import ConsistentHashRing
+from src.core.bulk_loader import bulk_load, start_bulk_load
+from src.core.cold_tier import ColdTier
+from src.core.conversation_store import SQLiteConversationStore
+from src.core.exporter import export_all
+from src.core.journal_store import JournalConversationStore
+from src.core.memory_manager import ConversationMemory
+from src.core.message import Message
+from src.core.redis_store import InMemoryRedis, RedisConversationStore
+from src.core.search_index import SearchIndex
+from src.core.summarizer import ConversationSummarizer
+from src.utils.metrics import MetricsRegistry
+
+
+class TestSQLiteStore:
+    def test_history_survives_restart_and_loads_lazily(self, tmp_path):
+        """Messages written behind the request path are reloaded on first access"""
+        path = os.path.join(tmp_path, "conversations.db")
+        memory = ConversationMemory(max_history=2, data_dir=str(tmp_path), store=SQLiteConversationStore(path))
+        for i in range(6):
+            memory.add_message("sqlite_user", "user", f"message {i}")
+        memory.add_message("other_user", "user", "hello")
+        memory.close()
+
+        store = SQLiteConversationStore(path)
+        memory = ConversationMemory(max_history=2, data_dir=str(tmp_path), store=store)
+        assert memory.conversations == {}
+        history = memory.get_conversation("sqlite_user")
+        assert [m.content for m in history] == ["message 2", "message 3", "message 4", "message 5"]
+        assert set(memory.get_user_ids()) == {"sqlite_user", "other_user"}
+
+        memory.add_message("sqlite_user", "assistant", "reply")
+        assert history[-1].message_id == 7
+        memory.close()
+
+    def test_writes_are_group_committed_and_clear_keeps_order(self, tmp_path):
+        """Queued appends share transactions; a clear removes only earlier messages"""
+        store = SQLiteConversationStore(os.path.join(tmp_path, "c.db"), batch_size=64, flush_interval=0.05)
+        memory = ConversationMemory(max_history=50, data_dir=str(tmp_path), store=store)
+        for i in range(100):
+            memory.add_message("batch_user", "user", f"m{i}")
+        memory.clear_conversation("batch_user")
+        memory.add_message("batch_user", "user", "after clear")
+        store.flush(timeout=5)
+
+        stats = store.stats()
+        assert stats["messages_written"] == 101
+        assert stats["batches"] < 101
+        assert [m.content for m in store.load("batch_user", 10)] == ["after clear"]
+        store.close()
+
+    def test_backends_must_implement_the_interface(self):
+        """ConversationStore is abstract; flush/sync/close/stats keep their defaults"""
+        import pytest
+        from src.core.conversation_store import ConversationStore
+
+        class Incomplete(ConversationStore):
+            def append(self, user_id, message):
+                pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+
+class TestJournalStore:
+    def test_recovers_from_snapshot_and_journal_tail(self, tmp_path):
+        """State is rebuilt from the snapshot plus later records; a torn line is skipped"""
+        directory = str(tmp_path / "journal")
+        store = JournalConversationStore(directory, shards=2, retain=4, fsync_interval=60)
+        for i in range(6):
+            store.append("journal_user", Message("user", f"m{i}", float(i), i + 1, 1))
+        for shard in store._shards:
+            store.compact(shard)
+        store.append("journal_user", Message("assistant", "after snapshot", 6.0, 7, 2))
+        store.clear("gone_user")
+        store.close()
+
+        # Simulate a crash in the middle of writing a record
+        shard = store._shard("journal_user")
+        with open(shard.journal_path, 'ab') as f:
+            f.write(b'{"u": "journal_user", "r": "us')
+
+        recovered = JournalConversationStore(directory, shards=2, retain=4, fsync_interval=60)
+        messages = recovered.load("journal_user", 10)
+        assert [m.content for m in messages] == ["m3", "m4", "m5", "after snapshot"]
+        assert recovered.recovered_records == 2
+        recovered.append("journal_user", Message("user", "next", 7.0, 8, 1))
+        recovered.close()
+
+        again = JournalConversationStore(directory, shards=2, retain=4, fsync_interval=60)
+        assert again.load("journal_user", 1)[0].content == "next"
+        again.close()
+
+    def test_messages_are_read_back_from_disk(self, tmp_path):
+        """Only offsets stay in memory; loads span the snapshot and the journal"""
+        store = JournalConversationStore(str(tmp_path), shards=1, retain=3, fsync_interval=60)
+        for i in range(5):
+            store.append("u", Message("user", f"m{i}", float(i), i + 1, 1))
+        store.append("v", Message("user", "v0", 0.0, 1, 1))
+        shard = store._shards[0]
+        assert len(shard.users["u"].records) == 3
+
+        store.compact(shard)
+        assert len(shard.users["u"].records) == 0
+        store.append("u", Message("user", "m5", 5.0, 6, 1))
+        store.clear("v")
+        assert [m.content for m in store.load("u", 10)] == ["m3", "m4", "m5"]
+        assert [m.content for m in store.load("u", 1)] == ["m5"]
+        assert store.load("v", 10) == []
+        store.flush()
+        store.close()
+
+
+class TestColdTier:
+    def test_idle_users_are_evicted_and_reloaded_transparently(self, tmp_path):
+        """Over the user cap the least recently active user moves to disk and comes back on access"""
+        registry = MetricsRegistry()
+        memory = ConversationMemory(max_history=5, data_dir=str(tmp_path), max_users=2,
+                                    cold_tier=ColdTier(str(tmp_path / "cold")), metrics=registry)
+        for user_id in ("a", "b", "c"):
+            memory.add_message(user_id, "user", f"hello from {user_id}")
+            memory.add_message(user_id, "assistant", "hi")
+
+        assert list(memory.conversations) == ["b", "c"]
+        assert memory.get_tier_stats()["cold_users"] == 1
+        assert os.listdir(tmp_path / "cold")[0].endswith(".json.z")
+
+        history = memory.get_conversation("a")
+        assert [m.content for m in history] == ["hello from a", "hi"]
+        memory.add_message("a", "user", "again")
+        assert history[-1].message_id == 3
+        assert list(memory.conversations) == ["c", "a"]
+        assert sorted(memory.get_user_ids()) == ["a", "b", "c"]
+        assert registry.get("aicb_memory_evictions_total").value() == 2
+        assert registry.get("aicb_memory_reload_seconds").snapshot()["count"] == 1
+
+    def test_byte_cap_tracks_resident_size(self, tmp_path):
+        """Resident bytes follow appends, ring-buffer trimming and clears"""
+        memory = ConversationMemory(max_history=1, data_dir=str(tmp_path), max_bytes=2000,
+                                    cold_tier=ColdTier(str(tmp_path / "cold"), compress=False))
+        for i in range(5):
+            memory.add_message("u", "user", "x" * 100)
+        assert memory.resident_bytes == 2 * 300
+        for user_id in ("v", "w", "y"):
+            memory.add_message(user_id, "user", "y" * 300)
+        assert memory.resident_bytes <= 2000
+        assert "u" not in memory.conversations
+        memory.clear_conversation("w")
+        assert memory.resident_bytes == sum(h.nbytes for h in memory.conversations.values())
+
+    def test_reload_races_do_not_lose_history(self, tmp_path):
+        """A message added while another thread reloads the user waits for the reload"""
+        import threading
+        cold_tier = ColdTier(str(tmp_path / "cold"))
+        memory = ConversationMemory(max_history=5, data_dir=str(tmp_path), max_users=1, cold_tier=cold_tier)
+        for i in range(3):
+            memory.add_message("alice", "user", f"msg{i}")
+        memory.add_message("bob", "user", "hi")
+        assert "alice" in cold_tier
+
+        take = cold_tier.take
+
+        def slow_take(user_id, maxlen):
+            taken = take(user_id, maxlen)
+            time.sleep(0.05)  # file gone, history not yet resident
+            return taken
+
+        cold_tier.take = slow_take
+        reader = threading.Thread(target=memory.get_conversation, args=("alice",))
+        reader.start()
+        time.sleep(0.01)
+        memory.add_message("alice", "user", "new")
+        reader.join()
+        assert [m.content for m in memory.get_conversation("alice")] == ["msg0", "msg1", "msg2", "new"]
+
+    def test_cold_writes_happen_outside_the_memory_lock(self, tmp_path):
+        """Other users are served while an evicted history is written to disk"""
+        import threading
+        cold_tier = ColdTier(str(tmp_path / "cold"))
+        memory = ConversationMemory(max_history=5, data_dir=str(tmp_path), max_users=1, cold_tier=cold_tier)
+        memory.add_message("alice", "user", "hello")
+        put = cold_tier.put
+        lock_free = []
+
+        def checked_put(user_id, history, summary=None):
+            # Served from memory while the write is under way
+            lock_free.append(memory.peek_history(user_id)[0].content)
+            probe = threading.Thread(target=lambda: lock_free.append(memory._lock.acquire(timeout=1) and
+                                                                   memory._lock.release() is None))
+            probe.start()
+            probe.join()
+            put(user_id, history, summary)
+
+        cold_tier.put = checked_put
+        memory.add_message("bob", "user", "hi")
+        assert lock_free == ["hello", True]
+        assert "alice" in cold_tier and not memory._evicting
+        assert [m.content for m in memory.get_conversation("alice")] == ["hello"]
+
+    def test_summary_moves_to_the_cold_tier_with_its_history(self, tmp_path):
+        """An evicted user's summary leaves memory with the history and comes back with it"""
+        summarizer = ConversationSummarizer(max_users=10)
+        memory = ConversationMemory(max_history=1, data_dir=str(tmp_path), max_users=1,
+                                    summarizer=summarizer, cold_tier=ColdTier(str(tmp_path / "cold")))
+        for i in range(4):
+            memory.add_message("a", "user", f"Note {i}. Detail.")
+        summarizer.flush(timeout=5)
+        assert memory.get_summary("a") == "User: Note 0.\nUser: Note 1."
+
+        memory.add_message("b", "user", "hello")
+        assert "a" not in memory.conversations and memory.get_summary("a") is None
+        assert len(memory.get_conversation("a")) == 2
+        assert memory.get_summary("a") == "User: Note 0.\nUser: Note 1."
+
+        # Without a store the cap never drops a summary whose history is still here
+        for i in range(20):
+            summarizer.submit(f"user{i}", [{"role": "user", "content": "hi"}])
+        summarizer.flush(timeout=5)
+        assert len(summarizer._summaries) == 21
+
+        store = RedisConversationStore(InMemoryRedis())
+        cached = ConversationSummarizer(max_users=10, store=store)
+        for i in range(20):
+            cached.submit(f"user{i}", [{"role": "user", "content": "hi"}])
+        cached.flush(timeout=5)
+        assert len(cached._summaries) == 10 and cached.get("user0") == "User: hi"
+        store.close()
+
+
+class TestBulkExport:
+    def test_export_all_covers_resident_and_cold_users(self, tmp_path):
+        """The bulk job streams every user, including evicted ones, without reloading them"""
+        import gzip
+        import json
+        import tarfile
+        memory = ConversationMemory(max_history=5, data_dir=str(tmp_path), max_users=2,
+                                    cold_tier=ColdTier(str(tmp_path / "cold")))
+        for user_id in ("a", "b", "c"):
+            memory.add_message(user_id, "user", f"hi {user_id}")
+
+        path = str(tmp_path / "all.ndjson.gz")
+        assert export_all(memory, path) == 3
+        with gzip.open(path, 'rt') as f:
+            assert sorted(json.loads(line)["user_id"] for line in f) == ["a", "b", "c"]
+        assert list(memory.conversations) == ["b", "c"]
+
+        path = str(tmp_path / "all.tar.gz")
+        assert export_all(memory, path, format="tar") == 3
+        with tarfile.open(path) as archive:
+            assert json.load(archive.extractfile("a.json"))["messages"][0]["content"] == "hi a"
+
+
+class TestBulkImport:
+    def test_parallel_warm_start_merges_newest_saves(self, tmp_path):
+        """Saved files are parsed in parallel; newest save wins and live users are kept"""
+        saved = ConversationMemory(data_dir=str(tmp_path))
+        saved.add_message("alice", "user", "old question")
+        saved.save_conversation("alice", "conversation_alice_1.json")
+        saved.add_message("alice", "assistant", "old answer")
+        saved.save_conversation("alice", "conversation_alice_2.json")
+        for i in range(20):
+            saved.add_message(f"user{i}", "user", f"question {i}")
+            saved.save_conversation(f"user{i}")
+        saved.add_message("live", "user", "from disk")
+        saved.save_conversation("live")
+        (tmp_path / "broken.json").write_text("{not json")
+
+        memory = ConversationMemory(data_dir=str(tmp_path))
+        memory.add_message("live", "user", "already here")
+        stats = bulk_load(memory, workers=4)
+
+        assert stats["files"] == 24 and stats["errors"] == 1
+        assert stats["users_imported"] == 21 and stats["users_skipped"] == 1
+        assert stats["files_per_s"] > 0 and stats["mb_per_s"] > 0
+        assert [m.content for m in memory.get_conversation("alice")] == ["old question", "old answer"]
+        assert [m.content for m in memory.get_conversation("live")] == ["already here"]
+        memory.add_message("alice", "user", "new")
+        assert memory.get_conversation("alice")[-1].message_id == 3
+
+        background = ConversationMemory(data_dir=str(tmp_path))
+        assert start_bulk_load(background).result(timeout=10)["users_imported"] == 22
+
+
+class TestSharedState:
+    def test_workers_sharing_redis_see_each_others_writes(self, tmp_path):
+        """Two read-through memories on one redis behave like one conversation"""
+        server = InMemoryRedis()
+        stores = [RedisConversationStore(server, retain=6, flush_interval=0.01) for _ in range(2)]
+        worker_a, worker_b = (ConversationMemory(3, data_dir=str(tmp_path), store=s, read_through=True) for s in stores)
+
+        worker_a.add_message("alice", "user", "hello from a")
+        worker_b.add_message("alice", "assistant", "reply from b")
+        assert [m.content for m in worker_a.get_conversation("alice")] == ["hello from a", "reply from b"]
+        assert worker_a.get_conversation("alice")[-1].message_id == 2
+
+        for i in range(10):
+            worker_a.add_message("alice", "user", f"more {i}")
+        assert len(worker_b.get_conversation("alice")) == 6
+        worker_b.clear_conversation("alice")
+        assert len(worker_a.get_conversation("alice")) == 0
+
+        # Appends from many users go out in a few pipelines, not one round trip each
+        before = server.round_trips
+        for i in range(200):
+            stores[0].append(f"user{i}", Message("user", "hi", 0.0, 1, 1))
+        stores[0].flush()
+        assert server.round_trips - before < 20
+        loaded = stores[1].load_many(["user1", "user199", "nobody"], 10)
+        assert [m.content for m in loaded["user199"]] == ["hi"] and loaded["nobody"] == []
+        assert sorted(stores[1].user_ids()) == sorted(f"user{i}" for i in range(200))
+        for store in stores:
+            store.close()
+
+    def test_workers_share_one_summary_through_redis(self, tmp_path):
+        """Messages trimmed on either worker fold into the one summary kept in redis"""
+        server = InMemoryRedis()
+        stores = [RedisConversationStore(server, retain=2, flush_interval=0.01) for _ in range(2)]
+        summarizers = [ConversationSummarizer(store=s, shared=True) for s in stores]
+        worker_a, worker_b = (ConversationMemory(1, data_dir=str(tmp_path), store=s, read_through=True, summarizer=z)
+                              for s, z in zip(stores, summarizers))
+
+        for i in range(6):
+            (worker_a if i % 2 else worker_b).add_message("alice", "user", f"Point {i}.")
+            for summarizer in summarizers:
+                summarizer.flush(timeout=5)
+        expected = "\n".join(f"User: Point {i}." for i in range(4))
+        assert worker_a.get_summary("alice") == worker_b.get_summary("alice") == expected
+        assert ConversationSummarizer(store=stores[0]).get("alice") == expected  # survives a restart
+
+        worker_a.clear_conversation("alice")
+        summarizers[0].flush(timeout=5)
+        assert worker_b.get_summary("alice") is None
+        for store in stores:
+            store.close()
+
+    def test_affinity_ring_moves_few_users_when_a_node_joins(self):
+        """Consistent hashing spreads users evenly and only remaps ~1/n on growth"""
+        ring = ConsistentHashRing(["http://a", "http://b", "http://c"])
+        users = [f"user{i}" for i in range(3000)]
+        before = {u: ring.node_for(u) for u in users}
+        counts = {node: list(before.values()).count(node) for node in ring.nodes}
+        assert min(counts.values()) > 600
+
+        ring.add_node("http://d")
+        moved = [u for u in users if ring.node_for(u) != before[u]]
+        assert all(ring.node_for(u) == "http://d" for u in moved)
+        assert 450 < len(moved) < 1100
+
+        ring.remove_node("http://d")
+        assert all(ring.node_for(u) == before[u] for u in users)
+
+
+class TestSearchIndex:
+    def test_incremental_ranked_search_with_filters_and_pages(self, tmp_path):
+        """Messages are searchable as soon as they are added; rare and repeated terms rank first"""
+        memory = ConversationMemory(data_dir=str(tmp_path), search_index=SearchIndex())
+        memory.add_message("alice", "user", "How do Python decorators work?")
+        memory.add_message("alice", "assistant", "Decorators wrap a function. Python decorators are common.")
+        memory.add_message("bob", "user", "Python lists versus tuples")
+        for i in range(30):
+            memory.add_message("carol", "user", f"python question number {i}")
+
+        result = memory.search_index.search("python decorators")
+        assert result["total"] == 2
+        assert [h["message_id"] for h in result["hits"]] == [2, 1]
+        assert result["hits"][0]["content"].startswith("Decorators wrap")
+
+        assert memory.search_index.search("PYTHON", user_id="bob")["hits"][0]["user_id"] == "bob"
+        assert memory.search_index.search("the of")["total"] == 0
+        first, second = (memory.search_index.search("python", offset=o, limit=20)["hits"] for o in (0, 20))
+        assert len(first) == 20 and len(second) == 13
+        assert {(h["user_id"], h["message_id"]) for h in first}.isdisjoint((h["user_id"], h["message_id"]) for h in second)
+        assert memory.search_index.search("python", since=time.time() + 60)["total"] == 0
+
+        memory.clear_conversation("alice")
+        assert memory.search_index.search("decorators")["total"] == 0
+        assert memory.search_index.search("python")["total"] == 31
+
+    def test_index_is_bounded_and_compacts(self):
+        """Past max_messages the oldest messages drop out; compaction reclaims them"""
+        index = SearchIndex(max_messages=10)
+        for i in range(25):
+            index.add(f"user_{i % 2}", i, "user", f"message about gliders {i}", 1000.0 + i)
+        result = index.search("gliders", limit=50)
+        assert len(index) == 10 and result["total"] == 10
+        assert min(h["message_id"] for h in result["hits"]) == 15
+        assert index.dead_docs == 15
+
+        index.compact()
+        assert index.dead_docs == 0 and index.search("gliders")["total"] == 10
+        assert index.stats() == {"messages": 10, "users": 2, "terms": 13}
+        index.close()
+
+    def test_time_ranges_are_searched_without_scanning_every_match(self):
+        """since/until skip messages outside the range, imported older messages included"""
+        index = SearchIndex(max_candidates=50)
+        for i in range(1000):
+            index.add("live", i, "user", f"redis latency {i}", 1000.0 + i)
+        for i in range(20):
+            index.add("imported", i, "user", f"redis latency import {i}", 100.0 + i)
+        index.add("live", 1000, "user", "redis latency late", 2000.0)
+
+        result = index.search("redis", since=1500.0, until=1509.0)
+        assert result["total"] == 10 and result["total_exact"]
+        assert sorted(h["timestamp"] for h in result["hits"]) == [1000.0 + i for i in range(500, 510)]
+        assert len(list(index._walk(index._postings["redis"].docs, 1500.0, 1509.0))) == 10 + 20
+        result = index.search("redis", since=105.0, until=109.5)
+        assert result["total"] == 5 and {h["user_id"] for h in result["hits"]} == {"imported"}
+        assert index.search("redis", since=1999.0)["total"] == 2
+
+        # The late messages are checked one by one and count toward the cap
+        index.max_candidates = 10
+        assert not index.search("redis", until=150.0)["total_exact"]
+
+    def test_index_persists_through_snapshot_and_log(self, tmp_path):
+        """Startup loads the snapshot and replays changes logged after it"""
+        index = SearchIndex(str(tmp_path))
+        index.add("alice", 1, "user", "kubernetes ingress setup", 1000.0)
+        index.add("bob", 1, "user", "kubernetes pod crash", 2000.0)
+        index.remove_user("alice")
+        index.snapshot()
+        index.add("carol", 1, "user", "kubernetes helm chart", 3000.0)
+        index._log.flush()
+
+        reopened = SearchIndex(str(tmp_path))
+        result = reopened.search("kubernetes")
+        assert sorted(h["user_id"] for h in result["hits"]) == ["bob", "carol"]
+        assert reopened.search("kubernetes", until=2500.0)["hits"][0]["user_id"] == "bob"
+        reopened.close()
+        assert SearchIndex(str(tmp_path)).stats() == {"messages": 2, "users": 2, "terms": 5}
+
+    def test_shared_index_sees_every_workers_changes(self, tmp_path):
+        """Workers sharing a directory search each other's messages, across rotations"""
+        worker_a, worker_b = (SearchIndex(str(tmp_path), shared=True) for _ in range(2))
+        worker_a.add("alice", 1, "user", "nginx reverse proxy", 1000.0)
+        worker_b.add("bob", 1, "user", "nginx load balancing", 2000.0)
+        assert worker_a.search("nginx")["total"] == worker_b.search("nginx")["total"] == 2
+
+        worker_a.snapshot()
+        worker_b.add("carol", 1, "user", "nginx caching", 3000.0)
+        worker_b.remove_user("alice")
+        assert sorted(h["user_id"] for h in worker_a.search("nginx")["hits"]) == ["bob", "carol"]
+
+        # A worker that missed a whole log (already snapshotted away) reloads
+        worker_b.snapshot()
+        worker_b.add("dave", 1, "user", "nginx tuning", 4000.0)
+        worker_b.snapshot()
+        assert worker_a.stats()["messages"] == 3 and worker_a.search("tuning")["total"] == 1
+        worker_a.close()
+        worker_b.close()
+        assert SearchIndex(str(tmp_path)).search("nginx")["total"] == 3
+
+    def test_imported_conversations_are_indexed_once(self, tmp_path):
+        """import_history and load_conversation index the messages they install"""
+        memory = ConversationMemory(data_dir=str(tmp_path), search_index=SearchIndex())
+        rows = [("user", "grafana dashboards", 1000.0, 1, 3), ("assistant", "grafana panels", 1001.0, 2, 3)]
+        assert memory.import_history("alice", rows)
+        memory.search_index.add("alice", 2, "assistant", "grafana panels", 1001.0)
+        assert memory.search_index.search("grafana")["total"] == 2
+
+        path = memory.save_conversation("alice")
+        memory.load_conversation("bob", path)
+        memory.load_conversation("bob", path)
+        assert memory.search_index.search("grafana", user_id="bob")["total"] == 2
+
+    def test_log_rotated_before_a_crash_is_replayed(self, tmp_path):
+        """A log renamed for a snapshot that never got written is still replayed on startup"""
+        index = SearchIndex(str(tmp_path))
+        index.add("alice", 1, "user", "terraform modules", 1000.0)
+        with index._lock:
+            index._rotate()  # the snapshot would be written next
+        index.add("bob", 1, "user", "terraform state", 2000.0)
+        index._log.flush()
+
+        assert sorted(os.listdir(tmp_path)) == ["index.1.jsonl", "index.jsonl"]
+        reopened = SearchIndex(str(tmp_path))
+        assert reopened.search("terraform")["total"] == 2
+        reopened.close()
+        assert sorted(os.listdir(tmp_path)) == ["index.jsonl", "snapshot.jsonl"]
+        assert SearchIndex(str(tmp_path)).search("terraform")["total"] == 2
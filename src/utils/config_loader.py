@@ -5,6 +5,37 @@ import os
 from typing import Dict, Any
 from dotenv import load_dotenv
 
+# Remote provider defaults; each key can be overridden with <PROVIDER>_<KEY>,
+# e.g. HUGGINGFACE_TIMEOUT=5 or OPENROUTER_MAX_CONNECTIONS=50
+PROVIDER_DEFAULTS = {
+    'huggingface': {
+        'url': 'https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium',
+        'model': 'microsoft/DialoGPT-medium',
+        'api_key': '',
+        'timeout': 10.0,
+        'max_connections': 100,
+        'max_keepalive': 20,
+        'keepalive_expiry': 30.0
+    },
+    'openrouter': {
+        'url': 'https://openrouter.ai/api/v1/chat/completions',
+        'model': 'openai/gpt-3.5-turbo',
+        'api_key': 'free',
+        'timeout': 15.0,
+        'max_connections': 100,
+        'max_keepalive': 20,
+        'keepalive_expiry': 30.0
+    }
+}
+
+def _load_provider_config(name: str) -> Dict[str, Any]:
+    """Read one provider's settings from the environment"""
+    prefix = name.upper()
+    return {
+        key: type(default)(os.getenv(f"{prefix}_{key.upper()}", default))
+        for key, default in PROVIDER_DEFAULTS[name].items()
+    }
+
 def load_config() -> Dict[str, Any]:
     """Load configuration - now works without API key"""
     
@@ -17,7 +48,115 @@ def load_config() -> Dict[str, Any]:
         'model': os.getenv('MODEL', 'huggingface'),
         'max_history': int(os.getenv('MAX_HISTORY', '20')),
         'temperature': float(os.getenv('TEMPERATURE', '0.7')),
-        'max_tokens': int(os.getenv('MAX_TOKENS', '200'))
+        'max_tokens': int(os.getenv('MAX_TOKENS', '200')),
+        
+        # Prompt size: system prompt + newest history + new message, in (estimated) tokens
+        'context_token_budget': int(os.getenv('CONTEXT_TOKEN_BUDGET', '1024')),
+        
+        # Messages trimmed past MAX_HISTORY are folded into a rolling summary
+        'history_summary': os.getenv('HISTORY_SUMMARY', 'true').lower() == 'true',
+        'summary_max_tokens': int(os.getenv('SUMMARY_MAX_TOKENS', '200')),
+        'summary_max_users': int(os.getenv('SUMMARY_MAX_USERS', '10000')),
+        
+        # Conversation persistence: memory (none), sqlite, journal or redis; writes happen in the background
+        'storage_backend': os.getenv('STORAGE_BACKEND', 'memory'),
+        'storage_path': os.getenv('STORAGE_PATH', 'data/conversations.db'),
+        'storage_batch_size': int(os.getenv('STORAGE_BATCH_SIZE', '256')),
+        'storage_flush_interval': float(os.getenv('STORAGE_FLUSH_INTERVAL', '0.05')),
+        'storage_synchronous': os.getenv('STORAGE_SYNCHRONOUS', 'NORMAL'),
+        'journal_dir': os.getenv('JOURNAL_DIR', 'data/journal'),
+        'journal_shards': int(os.getenv('JOURNAL_SHARDS', '8')),
+        'journal_compact_every': int(os.getenv('JOURNAL_COMPACT_EVERY', '10000')),
+        'journal_fsync_interval': float(os.getenv('JOURNAL_FSYNC_INTERVAL', '1.0')),
+        'redis_url': os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+        'redis_prefix': os.getenv('REDIS_PREFIX', 'aicb'),
+        'redis_flush_interval': float(os.getenv('REDIS_FLUSH_INTERVAL', '0.005')),
+        
+        # Several workers sharing one store: re-read it on every request, or route
+        # each user to the node that owns it
+        'memory_read_through': os.getenv('MEMORY_READ_THROUGH', 'false').lower() == 'true',
+        'cluster_nodes': [n.strip().rstrip('/') for n in os.getenv('CLUSTER_NODES', '').split(',') if n.strip()],
+        'cluster_self': os.getenv('CLUSTER_SELF', '').rstrip('/'),
+        'affinity_vnodes': int(os.getenv('AFFINITY_VNODES', '100')),
+        'affinity_timeout': float(os.getenv('AFFINITY_TIMEOUT', '30')),
+        
+        # Cap on resident conversations (0 = unlimited); idle users move to the cold tier
+        'memory_max_users': int(os.getenv('MEMORY_MAX_USERS', '0')),
+        'memory_max_bytes': int(os.getenv('MEMORY_MAX_BYTES', '0')),
+        'cold_tier_dir': os.getenv('COLD_TIER_DIR', 'data/cold'),
+        'cold_tier_compress': os.getenv('COLD_TIER_COMPRESS', 'true').lower() == 'true',
+        
+        # Threads for history reads/writes off the event loop
+        'chat_workers': int(os.getenv('CHAT_WORKERS', '8')),
+        
+        # chat_many / POST /chat/batch
+        'batch_concurrency': int(os.getenv('BATCH_CONCURRENCY', '16')),
+        'batch_max_items': int(os.getenv('BATCH_MAX_ITEMS', '1000')),
+        
+        # /ws/chat sessions
+        'ws_heartbeat_interval': float(os.getenv('WS_HEARTBEAT_INTERVAL', '20')),
+        'ws_idle_timeout': float(os.getenv('WS_IDLE_TIMEOUT', '60')),
+        'ws_max_pending': int(os.getenv('WS_MAX_PENDING', '8')),
+        'ws_send_queue': int(os.getenv('WS_SEND_QUEUE', '256')),
+        'ws_send_timeout': float(os.getenv('WS_SEND_TIMEOUT', '10')),
+        
+        # Admission control: per-user token buckets (off at 0 rps) and a global concurrency cap
+        'rate_limit_rps': float(os.getenv('RATE_LIMIT_RPS', '0')),
+        'rate_limit_burst': float(os.getenv('RATE_LIMIT_BURST', '20')),
+        'admission_max_concurrent': int(os.getenv('ADMISSION_MAX_CONCURRENT', '256')),
+        'admission_max_queue': int(os.getenv('ADMISSION_MAX_QUEUE', '1024')),
+        'admission_queue_timeout': float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '10')),
+        
+        # Full-text search over conversations (persisted when STORAGE_BACKEND is not memory)
+        'search_index': os.getenv('SEARCH_INDEX', 'true').lower() == 'true',
+        'search_dir': os.getenv('SEARCH_DIR', 'data/search'),
+        'search_snapshot_every': int(os.getenv('SEARCH_SNAPSHOT_EVERY', '100000')),
+        'search_max_messages': int(os.getenv('SEARCH_MAX_MESSAGES', '500000')),
+        
+        # Load saved conversations from data/conversations at startup
+        'warm_start': os.getenv('WARM_START', 'false').lower() == 'true',
+        'warm_start_background': os.getenv('WARM_START_BACKGROUND', 'true').lower() == 'true',
+        'import_workers': int(os.getenv('IMPORT_WORKERS', '0')),
+        'import_processes': os.getenv('IMPORT_PROCESSES', 'false').lower() == 'true',
+        
+        # Local intent engine
+        'intents_file': os.getenv('INTENTS_FILE') or None,
+        'local_default_responses': os.getenv('LOCAL_DEFAULT_RESPONSES', 'true').lower() == 'true',
+        
+        # Remote providers (connection pools, keep-alive and timeouts)
+        'providers': {name: _load_provider_config(name) for name in PROVIDER_DEFAULTS},
+        
+        # Provider routing: sequential, hedged or parallel, under one request deadline
+        'remote_providers': [p.strip() for p in os.getenv('REMOTE_PROVIDERS', 'huggingface').split(',') if p.strip()],
+        'routing_mode': os.getenv('ROUTING_MODE', 'sequential'),
+        'hedge_delay': float(os.getenv('HEDGE_DELAY', '0.5')),
+        'request_deadline': float(os.getenv('REQUEST_DEADLINE', '20')),
+        'race_workers': int(os.getenv('RACE_WORKERS', '32')),
+        
+        # Circuit breakers and health-scored provider ordering
+        'breaker_failure_threshold': int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5')),
+        'breaker_error_rate': float(os.getenv('BREAKER_ERROR_RATE', '0.5')),
+        'breaker_min_samples': int(os.getenv('BREAKER_MIN_SAMPLES', '10')),
+        'breaker_cooldown': float(os.getenv('BREAKER_COOLDOWN', '30')),
+        'health_window': int(os.getenv('HEALTH_WINDOW', '20')),
+        'health_latency_alpha': float(os.getenv('HEALTH_LATENCY_ALPHA', '0.3')),
+        'health_probe_interval': float(os.getenv('HEALTH_PROBE_INTERVAL', '0')),
+        'health_probe_timeout': float(os.getenv('HEALTH_PROBE_TIMEOUT', '5')),
+        
+        # Response cache for remote answers
+        'response_cache': os.getenv('RESPONSE_CACHE', 'memory'),
+        'cache_max_bytes': int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+        'cache_ttl': float(os.getenv('CACHE_TTL', '300')),
+        'cache_nondeterministic': os.getenv('CACHE_NONDETERMINISTIC', 'false').lower() == 'true',
+        
+        # Share one upstream call between identical in-flight requests
+        'coalesce_requests': os.getenv('COALESCE_REQUESTS', 'true').lower() == 'true',
+        
+        # Micro-batching of Hugging Face calls: flush at BATCH_MAX_SIZE items or after BATCH_MAX_WAIT seconds
+        'batching_enabled': os.getenv('BATCHING_ENABLED', 'false').lower() == 'true',
+        'batch_max_size': int(os.getenv('BATCH_MAX_SIZE', '8')),
+        'batch_max_wait': float(os.getenv('BATCH_MAX_WAIT', '0.01')),
+        'batch_workers': int(os.getenv('BATCH_WORKERS', '4'))
     }
     
     # No longer require API key since we use free services
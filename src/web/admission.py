@@ -0,0 +1,232 @@
+"""
+Admission Control - Per-user rate limits, a global concurrency cap and load shedding
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Lower value = served first when requests wait for a slot
+LANES = {"interactive": 0, "batch": 1}
+
+
+class Shed(Exception):
+    """A request turned away before any work was done for it"""
+
+    def __init__(self, reason: str, retry_after: float, status_code: int = 503):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key: `rate` requests per second with bursts of up
+    to `burst`. Only the max_keys most recently seen keys are kept; a key
+    that falls out simply starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def check(self, key: str) -> float:
+        """Take a token for key; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = [tokens, now]
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class Permit:
+    """One admitted request's slot; release() is idempotent"""
+
+    def __init__(self, controller: Optional["AdmissionController"], lane: str):
+        self._controller = controller
+        self.lane = lane
+        self.started = time.monotonic()
+
+    def release(self):
+        controller, self._controller = self._controller, None
+        if controller is not None:
+            controller._release(time.monotonic() - self.started)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Decides, before any work starts, whether a request runs now, waits or
+    is shed.
+
+    Each user first takes a token from its bucket (429 when empty, off when
+    rate_limit_rps is 0). Then at most admission_max_concurrent requests run
+    at once and up to admission_max_queue wait for a slot, interactive
+    before batch and oldest first within a lane. A full queue makes room for
+    an interactive request by shedding the newest batch waiter. A request
+    is shed with 503 when its deadline has passed, when the expected wait
+    (queue ahead of it times the average service time) would overrun the
+    deadline, or when it is still queued at the deadline. The deadline is
+    admission_queue_timeout, shortened by the client's X-Request-Timeout.
+    """
+
+    def __init__(self, config: Optional[Dict] = None, metrics=None):
+        config = config or {}
+        self.max_concurrent = config.get('admission_max_concurrent', 256)
+        self.max_queue = config.get('admission_max_queue', 1024)
+        self.queue_timeout = config.get('admission_queue_timeout', 10.0)
+        self.alpha = config.get('admission_service_alpha', 0.2)
+        rate = config.get('rate_limit_rps', 0.0)
+        self.limiter = (
+            TokenBucketLimiter(rate, config.get('rate_limit_burst', 20), config.get('rate_limit_max_users', 100000))
+            if rate > 0 else None
+        )
+        self.in_flight = 0
+        self.service_time: Optional[float] = None
+        self._waiters = []  # heap of [priority, seq, lane, future]
+        self._queued = {lane: 0 for lane in LANES}
+        self._seq = itertools.count()
+        self._m_in_flight = self._m_depth = self._m_shed = self._m_wait = None
+        if metrics is not None:
+            self._m_in_flight = metrics.gauge("aicb_admission_in_flight", "Requests holding an admission slot")
+            self._m_depth = metrics.gauge("aicb_admission_queue_depth", "Requests waiting for a slot", ["lane"])
+            self._m_shed = metrics.counter("aicb_admission_shed_total", "Requests shed before doing work",
+                                           ["lane", "reason"])
+            self._m_wait = metrics.histogram("aicb_admission_wait_seconds", "Time spent waiting for a slot",
+                                             ["lane"])
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._queued.values())
+
+    async def admit(self, user_id: Optional[str], lane: str = "interactive",
+                    timeout: Optional[float] = None) -> Permit:
+        """Wait for a slot; raises Shed if the request should not run. user_id None skips the rate limit"""
+        if self.limiter is not None and user_id is not None:
+            wait = self.limiter.check(user_id)
+            if wait > 0:
+                raise self._shed(lane, "rate_limited", wait, 429)
+
+        budget = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        if budget <= 0:
+            raise self._shed(lane, "deadline", self._drain_time())
+        if self.max_concurrent <= 0 or (self.in_flight < self.max_concurrent and not self.queue_depth):
+            return self._grant(lane)
+
+        priority = LANES[lane]
+        if self.queue_depth >= self.max_queue and not self._displace(priority):
+            raise self._shed(lane, "queue_full", self._drain_time())
+        if self.service_time is not None:
+            ahead = sum(count for other, count in self._queued.items() if LANES[other] <= priority)
+            expected = (ahead + 1) * self.service_time / self.max_concurrent
+            if expected > budget:
+                raise self._shed(lane, "deadline", expected)
+        return await self._wait(lane, priority, budget)
+
+    async def _wait(self, lane: str, priority: int, budget: float) -> Permit:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), lane, future])
+        self._set_depth(lane, 1)
+        start = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=budget)
+        except asyncio.CancelledError:
+            # Caller went away (e.g. client disconnect); give back a slot granted meanwhile
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release(None)
+            future.cancel()
+            raise
+        finally:
+            self._set_depth(lane, -1)
+            if self._m_wait is not None:
+                self._m_wait.observe(time.monotonic() - start, lane=lane)
+
+        if not future.done():
+            future.cancel()
+            raise self._shed(lane, "deadline", self._drain_time())
+        if future.exception() is not None:
+            raise future.exception()
+        return Permit(self, lane)
+
+    def _grant(self, lane: str) -> Permit:
+        self.in_flight += 1
+        if self._m_in_flight is not None:
+            self._m_in_flight.set(self.in_flight)
+        return Permit(self, lane)
+
+    def _release(self, elapsed: Optional[float]):
+        if elapsed is not None:
+            self.service_time = (
+                elapsed if self.service_time is None else self.alpha * elapsed + (1 - self.alpha) * self.service_time
+            )
+        self.in_flight -= 1
+        # Hand free slots straight to the best waiters
+        while self._waiters and self.in_flight < self.max_concurrent:
+            _, _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(True)
+        if self._m_in_flight is not None:
+            self._m_in_flight.set(self.in_flight)
+
+    def _displace(self, priority: int) -> bool:
+        """Shed the newest waiter of a lower-priority lane to make room; False if there is none"""
+        victim = None
+        for entry in self._waiters:
+            if entry[0] > priority and not entry[3].done() and (victim is None or entry[:2] > victim[:2]):
+                victim = entry
+        if victim is None:
+            return False
+        victim[3].set_exception(self._shed(victim[2], "displaced", self._drain_time()))
+        return True
+
+    def _drain_time(self) -> float:
+        """Rough seconds until the current queue clears"""
+        if self.service_time is None or self.max_concurrent <= 0:
+            return 1.0
+        return (self.queue_depth + 1) * self.service_time / self.max_concurrent
+
+    def _shed(self, lane: str, reason: str, retry_after: float, status_code: int = 503) -> Shed:
+        if self._m_shed is not None:
+            self._m_shed.inc(lane=lane, reason=reason)
+        return Shed(reason, retry_after, status_code)
+
+    def _set_depth(self, lane: str, delta: int):
+        self._queued[lane] += delta
+        if self._m_depth is not None:
+            self._m_depth.set(self._queued[lane], lane=lane)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queued": dict(self._queued),
+            "max_queue": self.max_queue,
+            "service_time": self.service_time,
+            "rate_limited_users": len(self.limiter) if self.limiter is not None else 0
+        }
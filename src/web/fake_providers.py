@@ -0,0 +1,166 @@
+"""
+Fake Provider Server - Offline stand-in for the Hugging Face and OpenRouter APIs
+
+Speaks the request/response shapes MultiAPIClient uses, with configurable
+latency, error rate and streaming, so the chat stack can be load tested
+without internet access:
+
+    python -m src.web.fake_providers --port 9000 --latency lognormal:0.3:0.5 --error-rate 0.02
+
+Then point the chat server at it:
+
+    HUGGINGFACE_URL=http://127.0.0.1:9000/models/fake-model
+    OPENROUTER_URL=http://127.0.0.1:9000/api/v1/chat/completions
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+class LatencyModel:
+    """
+    Latency distribution parsed from a spec string (seconds):
+
+        fixed:0.1                 always 0.1
+        uniform:0.05:0.3          uniform between the two bounds
+        exponential:0.2           exponential with the given mean
+        lognormal:0.3:0.5         log-normal with the given median and sigma
+    """
+
+    def __init__(self, spec: str = "fixed:0", seed: Optional[int] = None):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params] or [0.0]
+        self._rng = random.Random(seed)
+        if kind not in ("fixed", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self._rng.uniform(self.params[0], self.params[1])
+        if self.kind == "exponential":
+            return self._rng.expovariate(1.0 / self.params[0]) if self.params[0] > 0 else 0.0
+        median, sigma = self.params[0], self.params[1] if len(self.params) > 1 else 0.5
+        return self._rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+def _reply_for(prompt: str) -> str:
+    """Deterministic reply so cached and live answers can be compared"""
+    last_line = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+    return f"Fake reply to: {last_line[-80:]}"
+
+
+def _tokens(text: str) -> List[str]:
+    words = text.split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+
+def create_fake_provider_app(latency: str = "fixed:0", error_rate: float = 0.0,
+                             token_delay: float = 0.0, seed: Optional[int] = None) -> FastAPI:
+    """Build the fake provider app; settings can be changed later through POST /_config"""
+    app = FastAPI(title="Fake AI Providers")
+    state: Dict[str, Any] = {
+        "latency": LatencyModel(latency, seed),
+        "error_rate": error_rate,
+        "token_delay": token_delay,
+        "rng": random.Random(seed),
+        "requests": {"huggingface": 0, "openrouter": 0, "errors": 0}
+    }
+
+    async def simulate(provider: str) -> Optional[JSONResponse]:
+        """Apply latency and maybe fail; returns the error response if failing"""
+        state["requests"][provider] += 1
+        await asyncio.sleep(state["latency"].sample())
+        if state["rng"].random() < state["error_rate"]:
+            state["requests"]["errors"] += 1
+            return JSONResponse({"error": "Service temporarily unavailable"}, status_code=503)
+        return None
+
+    def sse(events):
+        async def stream():
+            for event in events:
+                if state["token_delay"]:
+                    await asyncio.sleep(state["token_delay"])
+                yield f"data: {event}\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/models/{model:path}")
+    async def huggingface(model: str, request: Request):
+        """Hugging Face Inference API: single or batched inputs, optional TGI-style stream"""
+        body = await request.json()
+        error = await simulate("huggingface")
+        if error is not None:
+            return error
+
+        inputs = body.get("inputs", "")
+        if body.get("stream"):
+            reply = _reply_for(inputs if isinstance(inputs, str) else inputs[0])
+            events = [json.dumps({"token": {"text": token, "special": False}}) for token in _tokens(reply)]
+            events.append(json.dumps({"token": {"text": "", "special": True}, "generated_text": reply}))
+            return sse(events)
+        if isinstance(inputs, list):
+            return [[{"generated_text": _reply_for(prompt)}] for prompt in inputs]
+        return [{"generated_text": _reply_for(inputs)}]
+
+    @app.post("/api/v1/chat/completions")
+    async def openrouter(request: Request):
+        """OpenRouter / OpenAI chat completions, optional SSE stream"""
+        body = await request.json()
+        error = await simulate("openrouter")
+        if error is not None:
+            return error
+
+        messages = body.get("messages") or [{"content": ""}]
+        reply = _reply_for(messages[-1].get("content", ""))
+        if body.get("stream"):
+            events = [json.dumps({"choices": [{"delta": {"content": token}}]}) for token in _tokens(reply)]
+            events.append("[DONE]")
+            return sse(events)
+        return {
+            "model": body.get("model", "fake-model"),
+            "choices": [{"message": {"role": "assistant", "content": reply}}]
+        }
+
+    @app.get("/_stats")
+    async def stats():
+        return state["requests"]
+
+    @app.post("/_config")
+    async def configure(settings: Dict[str, Any]):
+        """Change latency/error settings between load test phases"""
+        if "latency" in settings:
+            state["latency"] = LatencyModel(settings["latency"], seed)
+        for key in ("error_rate", "token_delay"):
+            if key in settings:
+                state[key] = float(settings[key])
+        return {"latency": state["latency"].spec, "error_rate": state["error_rate"], "token_delay": state["token_delay"]}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Hugging Face / OpenRouter server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="fixed:0.05", help="fixed:S | uniform:A:B | exponential:MEAN | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_fake_provider_app(args.latency, args.error_rate, args.token_delay, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
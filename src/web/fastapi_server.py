@@ -1,15 +1,28 @@
 """
 FastAPI Backend Server - REST API for AI Chat Bot
 """
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
 from typing import List, Optional
+from datetime import datetime
+import asyncio
+import httpx
+import logging
+import time
 import uvicorn
+import json
 import os
 
+from src.core.affinity import ConsistentHashRing
 from src.core.chat_engine import AIChatEngine
+from src.core.exporter import EXPORT_FORMATS, gzip_chunks
+from src.core.request_context import DEADLINE, DISCONNECTED, RequestAborted, RequestContext
 from src.utils.config_loader import load_config
+from src.web.admission import AdmissionController, Permit, Shed
+from src.web.ws_session import ChatSession
 
 # Pydantic models for request/response
 class ChatMessage(BaseModel):
@@ -19,6 +32,17 @@ class ChatMessage(BaseModel):
     temperature: float = 0.7
     max_tokens: int = 500
 
+class BatchItem(BaseModel):
+    message: str
+    user_id: str = "default"
+    conversation_mode: str = "default"
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    temperature: float = 0.7
+    max_tokens: int = 500
+    concurrency: Optional[int] = Field(None, ge=1)
+
 class ChatResponse(BaseModel):
     success: bool
     response: str
@@ -49,24 +73,118 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+logger = logging.getLogger(__name__)
+
 # Global chat engine instance
 chat_engine = None
 
+# User affinity across nodes (CLUSTER_NODES / CLUSTER_SELF)
+FORWARDED_HEADER = "X-AICB-Forwarded"
+affinity_ring = None
+cluster_self = None
+peer_client = None
+
+# Rate limits, concurrency cap and load shedding; clients may send their own deadline
+TIMEOUT_HEADER = "X-Request-Timeout"
+admission = None
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize chat engine on startup"""
-    global chat_engine
+    global chat_engine, affinity_ring, cluster_self, peer_client, admission
     try:
         config = load_config()
         chat_engine = AIChatEngine(
             api_key=config['openai_api_key'],
-            model=config.get('model', 'gpt-3.5-turbo')
+            model=config.get('model', 'gpt-3.5-turbo'),
+            config=config
         )
+        admission = AdmissionController(config, chat_engine.metrics)
+        if config.get('cluster_nodes') and config.get('cluster_self'):
+            affinity_ring = ConsistentHashRing(config['cluster_nodes'], config.get('affinity_vnodes', 100))
+            cluster_self = config['cluster_self']
+            peer_client = httpx.AsyncClient(timeout=config.get('affinity_timeout', 30.0))
         print("✅ AI Chat Engine initialized successfully")
     except Exception as e:
         print(f"❌ Failed to initialize AI Chat Engine: {e}")
         raise e
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled provider connections"""
+    if chat_engine is not None:
+        await chat_engine.aclose()
+    if peer_client is not None:
+        await peer_client.aclose()
+
+def owner_node(user_id: str, request: Request) -> Optional[str]:
+    """Node a request should be forwarded to, or None to handle it here"""
+    if affinity_ring is None or request.headers.get(FORWARDED_HEADER):
+        return None
+    node = affinity_ring.node_for(user_id)
+    return node if node != cluster_self else None
+
+async def forward_to_owner(node: str, path: str, chat_message: ChatMessage, context: RequestContext,
+                           stream: bool = False):
+    """Send a chat request to the user's owner node; None if it is unreachable"""
+    headers = {FORWARDED_HEADER: cluster_self}
+    if context.deadline is not None:
+        headers[TIMEOUT_HEADER] = f"{context.remaining():.3f}"
+    request = peer_client.build_request("POST", node + path, json=chat_message.model_dump(), headers=headers)
+    try:
+        # A client that leaves also hangs up on the owner node, which then stops too
+        async with context.scope():
+            return await peer_client.send(request, stream=stream)
+    except httpx.HTTPError as e:
+        # The shared store keeps the conversation, so serving it here is still correct
+        logger.warning(f"Owner node {node} unreachable for user {chat_message.user_id}, handling locally: {e}")
+        return None
+
+def relayed_headers(forwarded: httpx.Response) -> dict:
+    """Headers from the owner node's response worth passing back to the client"""
+    return {name: forwarded.headers[name] for name in ("Retry-After",) if name in forwarded.headers}
+
+def request_context(request: Request) -> RequestContext:
+    """Deadline and cancellation token for a request; the client may set the deadline with X-Request-Timeout"""
+    timeout = request.headers.get(TIMEOUT_HEADER)
+    try:
+        return RequestContext(float(timeout) if timeout is not None else None)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{TIMEOUT_HEADER} must be a number of seconds")
+
+async def watch_disconnect(request: Request, context: RequestContext):
+    """Cancel the request's context as soon as the client disconnects"""
+    # The body has been read, so the next message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+    context.cancel(DISCONNECTED)
+
+def watch(request: Request, context: RequestContext) -> asyncio.Task:
+    """Start watch_disconnect in the background; cancel the task once the response is done"""
+    return asyncio.ensure_future(watch_disconnect(request, context))
+
+def aborted_error(e: RequestAborted) -> HTTPException:
+    if e.reason == DEADLINE:
+        return HTTPException(status_code=504, detail="Request deadline exceeded")
+    return HTTPException(status_code=499, detail="Client closed request")
+
+async def admit(user_id: Optional[str], lane: str, context: RequestContext) -> Permit:
+    """Rate-limit and queue a request; raises 429/503 with Retry-After when it is shed"""
+    if admission is None:
+        return Permit(None, lane)
+    
+    try:
+        if context.expired:
+            return await admission.admit(user_id, lane, 0.0)  # shed at once, with Retry-After
+        async with context.scope():
+            return await admission.admit(user_id, lane, context.remaining())
+    except Shed as e:
+        raise HTTPException(status_code=e.status_code, detail=f"Request shed: {e.reason}",
+                            headers={"Retry-After": e.retry_after_header})
+    except RequestAborted as e:
+        chat_engine.metrics.counter("aicb_chat_aborted_total").inc(reason=e.reason, stage="admission")
+        raise aborted_error(e)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -77,27 +195,182 @@ async def root():
     }
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(chat_message: ChatMessage):
+async def chat_endpoint(chat_message: ChatMessage, request: Request):
     """Main chat endpoint"""
     if chat_engine is None:
         raise HTTPException(status_code=503, detail="Chat engine not initialized")
     
+    context = request_context(request)
+    watcher = watch(request, context)
     try:
-        result = chat_engine.chat(
-            message=chat_message.message,
-            user_id=chat_message.user_id,
-            conversation_mode=chat_message.conversation_mode,
-            temperature=chat_message.temperature,
-            max_tokens=chat_message.max_tokens
-        )
+        node = owner_node(chat_message.user_id, request)
+        if node is not None:
+            try:
+                forwarded = await forward_to_owner(node, "/chat", chat_message, context)
+            except RequestAborted as e:
+                raise aborted_error(e)
+            if forwarded is not None:
+                return Response(forwarded.content, status_code=forwarded.status_code,
+                                media_type=forwarded.headers.get("content-type"), headers=relayed_headers(forwarded))
         
-        if result["success"]:
-            return ChatResponse(**result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
+        permit = await admit(chat_message.user_id, "interactive", context)
+        try:
+            # Native async path: slow providers do not block other requests, and are
+            # abandoned if the client disconnects or its deadline passes
+            result = await chat_engine.achat_result(
+                message=chat_message.message,
+                user_id=chat_message.user_id,
+                conversation_mode=chat_message.conversation_mode,
+                temperature=chat_message.temperature,
+                max_tokens=chat_message.max_tokens,
+                context=context
+            )
             
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            return ChatResponse(
+                success=result["success"],
+                response=result["response"],
+                model=chat_engine.model,
+                conversation_length=await chat_engine.aconversation_length(chat_message.user_id),
+                error=result["error"]
+            )
+        
+        except RequestAborted as e:
+            raise aborted_error(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            permit.release()
+    finally:
+        watcher.cancel()
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(chat_message: ChatMessage, request: Request):
+    """Streaming chat endpoint (Server-Sent Events)"""
+    if chat_engine is None:
+        raise HTTPException(status_code=503, detail="Chat engine not initialized")
+    
+    context = request_context(request)
+    watcher = watch(request, context)
+    try:
+        node = owner_node(chat_message.user_id, request)
+        if node is not None:
+            try:
+                forwarded = await forward_to_owner(node, "/chat/stream", chat_message, context, stream=True)
+            except RequestAborted as e:
+                raise aborted_error(e)
+            if forwarded is not None:
+                watcher.cancel()  # from here on the response stream notices the disconnect
+                return StreamingResponse(
+                    forwarded.aiter_raw(),
+                    status_code=forwarded.status_code,
+                    media_type=forwarded.headers.get("content-type"),
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **relayed_headers(forwarded)},
+                    background=BackgroundTask(forwarded.aclose)
+                )
+        
+        # The slot is held until the last token is sent
+        permit = await admit(chat_message.user_id, "interactive", context)
+    except BaseException:
+        watcher.cancel()
+        raise
+    
+    def finish():
+        watcher.cancel()
+        permit.release()
+    
+    async def event_stream():
+        try:
+            async for token in chat_engine.achat_stream(
+                message=chat_message.message,
+                user_id=chat_message.user_id,
+                conversation_mode=chat_message.conversation_mode,
+                temperature=chat_message.temperature,
+                max_tokens=chat_message.max_tokens,
+                context=context
+            ):
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+            
+            done = {"conversation_length": await chat_engine.aconversation_length(chat_message.user_id)}
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+        except RequestAborted as e:
+            if e.reason == DEADLINE:
+                yield f"event: error\ndata: {json.dumps({'error': 'Request deadline exceeded'})}\n\n"
+        finally:
+            finish()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(finish)
+    )
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(batch: BatchRequest, request: Request):
+    """Answer many messages in one request; results stream back as NDJSON in input order"""
+    if chat_engine is None:
+        raise HTTPException(status_code=503, detail="Chat engine not initialized")
+    
+    max_items = chat_engine.config.get('batch_max_items', 1000)
+    if len(batch.items) > max_items:
+        raise HTTPException(status_code=413, detail=f"At most {max_items} items per batch")
+    
+    # Clients may ask for less parallelism than BATCH_CONCURRENCY, never more
+    limit = chat_engine.config.get('batch_concurrency', 16)
+    concurrency = min(batch.concurrency or limit, limit)
+    
+    # Each item takes its own slot in the batch lane as it starts, so batches
+    # count against ADMISSION_MAX_CONCURRENT and wait behind interactive requests.
+    # Items span many users, so there is no per-user rate limit
+    context = request_context(request)
+    watcher = watch(request, context)
+    
+    async def admit_item() -> Permit:
+        if admission is None:
+            return Permit(None, "batch")
+        try:
+            async with context.scope():
+                return await admission.admit(None, "batch", context.remaining())
+        except RequestAborted as e:
+            chat_engine.metrics.counter("aicb_chat_aborted_total").inc(reason=e.reason, stage="admission")
+            raise
+    
+    async def lines():
+        try:
+            async for result in chat_engine.achat_many_iter(
+                [(item.user_id, item.message, item.conversation_mode) for item in batch.items],
+                concurrency=concurrency,
+                temperature=batch.temperature,
+                max_tokens=batch.max_tokens,
+                context=context,
+                admit=admit_item
+            ):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except RequestAborted as e:
+            if e.reason == DEADLINE:
+                yield json.dumps({"error": "Request deadline exceeded"}) + "\n"
+        finally:
+            watcher.cancel()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(watcher.cancel))
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, user_id: str = "default", conversation_mode: str = "default"):
+    """Persistent chat session for one user with streamed replies"""
+    if chat_engine is None:
+        await websocket.close(code=1013, reason="Chat engine not initialized")
+        return
+    
+    config = chat_engine.config
+    await ChatSession(
+        websocket, chat_engine, user_id, conversation_mode,
+        heartbeat_interval=config.get('ws_heartbeat_interval', 20.0),
+        idle_timeout=config.get('ws_idle_timeout', 60.0),
+        max_pending=config.get('ws_max_pending', 8),
+        send_queue_size=config.get('ws_send_queue', 256),
+        send_timeout=config.get('ws_send_timeout', 10.0),
+        admission=admission
+    ).run()
 
 @app.get("/conversation/{user_id}/stats")
 async def get_conversation_stats(user_id: str):
@@ -106,7 +379,7 @@ async def get_conversation_stats(user_id: str):
         raise HTTPException(status_code=503, detail="Chat engine not initialized")
     
     try:
-        stats = chat_engine.get_conversation_stats(user_id)
+        stats = await chat_engine.aget_conversation_stats(user_id)
         return ConversationStats(**stats)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -118,17 +391,80 @@ async def clear_conversation(user_id: str):
         raise HTTPException(status_code=503, detail="Chat engine not initialized")
     
     try:
-        chat_engine.memory.clear_conversation(user_id)
+        await chat_engine.aclear_conversation(user_id)
         return {"message": f"Conversation cleared for user {user_id}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/conversation/{user_id}/export")
+async def export_conversation(user_id: str, format: str = Query("json", pattern="^(json|ndjson|text)$"),
+                              gzip: bool = False):
+    """Stream a conversation export, optionally gzip-compressed"""
+    if chat_engine is None:
+        raise HTTPException(status_code=503, detail="Chat engine not initialized")
+    
+    chunks = await chat_engine.aiter_export(user_id, format)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail=f"No conversation for user {user_id}")
+    
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"conversation_{user_id}.{extension}"
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/search")
+async def search_conversations(q: str = Query(..., min_length=1), user_id: Optional[str] = None,
+                               since: Optional[datetime] = None, until: Optional[datetime] = None,
+                               page: int = Query(1, ge=1), page_size: int = Query(20, ge=1, le=100)):
+    """Ranked full-text search over conversation messages"""
+    if chat_engine is None:
+        raise HTTPException(status_code=503, detail="Chat engine not initialized")
+    
+    index = chat_engine.memory.search_index
+    if index is None:
+        raise HTTPException(status_code=404, detail="Search index is disabled (SEARCH_INDEX=false)")
+    
+    start = time.perf_counter()
+    result = await chat_engine.asearch(
+        q, user_id=user_id,
+        since=since.timestamp() if since else None,
+        until=until.timestamp() if until else None,
+        offset=(page - 1) * page_size, limit=page_size
+    )
+    for hit in result["hits"]:
+        hit["timestamp"] = datetime.fromtimestamp(hit["timestamp"]).isoformat()
+    return {
+        "query": q,
+        "total": result["total"],
+        "page": page,
+        "page_size": page_size,
+        "took_ms": round((time.perf_counter() - start) * 1000, 3),
+        "hits": result["hits"]
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics"""
+    if chat_engine is None:
+        raise HTTPException(status_code=503, detail="Chat engine not initialized")
+    
+    return PlainTextResponse(chat_engine.metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "chat_engine_ready": chat_engine is not None
+        "chat_engine_ready": chat_engine is not None,
+        "admission": admission.stats() if admission is not None else {},
+        "providers": chat_engine.api_client.get_provider_health() if chat_engine is not None else {}
     }
 
 if __name__ == "__main__":
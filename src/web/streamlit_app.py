@@ -168,9 +168,24 @@ if prompt := st.chat_input("Type your message here..."):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
     
-    # Get AI response
-    with st.spinner("🤖 Thinking..."):
-        response = st.session_state.chat_engine.chat(prompt, "user")
+    st.markdown(f"""
+    <div class="chat-message user">
+        <div class="message-header">👤 You</div>
+        <div>{prompt}</div>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Stream the AI response as tokens arrive
+    placeholder = st.empty()
+    response = ""
+    for token in st.session_state.chat_engine.chat_stream(prompt, "user"):
+        response += token
+        placeholder.markdown(f"""
+        <div class="chat-message assistant">
+            <div class="message-header">🤖 Assistant</div>
+            <div>{response}▌</div>
+        </div>
+        """, unsafe_allow_html=True)
     
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": response})
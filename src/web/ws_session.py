@@ -0,0 +1,240 @@
+"""
+WebSocket Chat Session - One persistent, user-bound chat connection
+
+Protocol (JSON text frames):
+
+    client -> server
+        {"type": "message", "message": "...", "id": "optional client id",
+         "conversation_mode": "...", "temperature": 0.7, "max_tokens": 500,
+         "timeout": optional seconds to wait for the reply}
+        {"type": "ping"} / {"type": "pong"}
+
+    server -> client
+        {"type": "session", "user_id": ..., "conversation_length": ..., "heartbeat_interval": ...}
+        {"type": "start", "id": ...}
+        {"type": "token", "id": ..., "token": "..."}
+        {"type": "done", "id": ..., "conversation_length": ...}
+        {"type": "error", "id": ..., "error": "...", "retry_after": seconds (only when shed)}
+        {"type": "ping"} / {"type": "pong"}
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from src.core.request_context import DEADLINE, DISCONNECTED, RequestAborted, RequestContext
+from src.web.admission import Permit, Shed
+
+logger = logging.getLogger(__name__)
+
+
+class SlowConsumer(Exception):
+    pass
+
+
+class ChatSession:
+    """
+    Runs one WebSocket connection as a receive loop (which also sends a
+    heartbeat ping after heartbeat_interval of silence) plus two tasks
+    started on first use: a worker that answers the session's messages one
+    at a time, and a sender.
+
+    Backpressure: at most max_pending messages may wait for the worker
+    (more are rejected with an error frame), and outgoing frames go through
+    a bounded queue, so a slow reader pauses token production instead of
+    buffering without limit. Tokens still queued when the sender catches
+    up are merged into one frame. A client that does not take a frame
+    within send_timeout, or sends nothing for idle_timeout, is disconnected.
+    Each message also goes through the server's admission control, if any,
+    like an interactive HTTP request, and its provider call is abandoned
+    when the connection closes or the message's timeout passes.
+    """
+
+    def __init__(self, websocket: WebSocket, engine, user_id: str, conversation_mode: str = "default",
+                 heartbeat_interval: float = 20.0, idle_timeout: float = 60.0, max_pending: int = 8,
+                 send_queue_size: int = 256, send_timeout: float = 10.0, admission=None):
+        self.websocket = websocket
+        self.engine = engine
+        self.user_id = user_id
+        self.conversation_mode = conversation_mode
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.admission = admission
+        self.inbox: "asyncio.Queue" = asyncio.Queue(max_pending)
+        self.outbox: "asyncio.Queue" = asyncio.Queue(send_queue_size)
+        self.last_seen = time.monotonic()
+        self.close_reason = "client"
+        self._tasks = []
+        self._context: Optional[RequestContext] = None
+        self._sender_started = False
+        self._worker_started = False
+        self._next_id = 0
+        metrics = engine.metrics
+        self._m_sessions = metrics.gauge("aicb_ws_sessions", "Open WebSocket chat sessions")
+        self._m_messages = metrics.counter("aicb_ws_messages_total", "Chat messages received over WebSocket")
+        self._m_closed = metrics.counter("aicb_ws_closed_total", "WebSocket sessions closed, by reason", ["reason"])
+
+    async def run(self):
+        await self.websocket.accept()
+        with self._m_sessions.track_inprogress():
+            await self.websocket.send_text(json.dumps({
+                "type": "session",
+                "user_id": self.user_id,
+                "conversation_length": await self.engine.aconversation_length(self.user_id),
+                "heartbeat_interval": self.heartbeat_interval
+            }))
+            # The receive loop runs in this task and the helpers start on first use,
+            # so an idle session costs one suspended task
+            try:
+                await self._receive()
+            except WebSocketDisconnect:
+                pass
+            finally:
+                if self._context is not None:
+                    self._context.cancel(DISCONNECTED)
+                for task in self._tasks:
+                    task.cancel()
+                self._m_closed.inc(reason=self.close_reason)
+
+    def _start(self, coro):
+        self._tasks.append(asyncio.ensure_future(self._guard(coro)))
+
+    def _ensure_sender(self):
+        if not self._sender_started:
+            self._sender_started = True
+            self._start(self._send())
+
+    async def _guard(self, coro):
+        try:
+            await coro
+        except SlowConsumer:
+            await self._close(1008, "client too slow", "slow_consumer")
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # the client is already gone
+        except Exception as e:
+            logger.error(f"WebSocket session for {self.user_id} failed: {e}")
+            await self._close(1011, "internal error", "error")
+
+    async def _close(self, code: int, reason: str, close_reason: str):
+        self.close_reason = close_reason
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass  # already gone
+
+    def _push(self, frame: Dict):
+        """Queue a control frame without waiting; dropped if the outbox is full"""
+        self._ensure_sender()
+        try:
+            self.outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            pass
+
+    async def _receive(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self.websocket.receive(), self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                if time.monotonic() - self.last_seen > self.idle_timeout:
+                    await self._close(1001, "idle timeout", "idle")
+                    return
+                self._push({"type": "ping"})
+                continue
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            raw = message.get("text") or (message.get("bytes") or b"").decode("utf-8", "replace")
+            self.last_seen = time.monotonic()
+            try:
+                frame = json.loads(raw)
+                kind = frame.get("type", "message")
+            except (ValueError, AttributeError):
+                self._push({"type": "error", "id": None, "error": "Frames must be JSON objects"})
+                continue
+            if kind == "ping":
+                self._push({"type": "pong"})
+            elif kind == "message":
+                if not isinstance(frame.get("message"), str) or not frame["message"]:
+                    self._push({"type": "error", "id": frame.get("id"), "error": "message is required"})
+                    continue
+                if frame.get("timeout") is not None and not isinstance(frame["timeout"], (int, float)):
+                    self._push({"type": "error", "id": frame.get("id"), "error": "timeout must be a number of seconds"})
+                    continue
+                if frame.get("id") is None:
+                    self._next_id += 1
+                    frame["id"] = self._next_id
+                if not self._worker_started:
+                    self._worker_started = True
+                    self._ensure_sender()
+                    self._start(self._work())
+                try:
+                    self.inbox.put_nowait(frame)
+                    self._m_messages.inc()
+                except asyncio.QueueFull:
+                    self._push({"type": "error", "id": frame["id"],
+                                "error": "Too many pending messages; wait for a reply"})
+            elif kind != "pong":
+                self._push({"type": "error", "id": frame.get("id"), "error": f"Unknown frame type: {kind}"})
+
+    async def _work(self):
+        while True:
+            frame = await self.inbox.get()
+            message_id = frame["id"]
+            context = self._context = RequestContext(frame.get("timeout"))
+            try:
+                permit = (await self.admission.admit(self.user_id, "interactive", context.remaining())
+                          if self.admission is not None else Permit(None, "interactive"))
+            except Shed as e:
+                await self.outbox.put({"type": "error", "id": message_id, "error": f"Request shed: {e.reason}",
+                                       "retry_after": round(e.retry_after, 3)})
+                continue
+            async with permit:
+                await self.outbox.put({"type": "start", "id": message_id})
+                try:
+                    async for token in self.engine.achat_stream(
+                        message=frame["message"],
+                        user_id=self.user_id,
+                        conversation_mode=frame.get("conversation_mode", self.conversation_mode),
+                        temperature=frame.get("temperature"),
+                        max_tokens=frame.get("max_tokens"),
+                        context=context
+                    ):
+                        # Blocks while the outbox is full: the provider stream is read no
+                        # faster than the client reads ours
+                        await self.outbox.put({"type": "token", "id": message_id, "token": token})
+                except RequestAborted as e:
+                    if e.reason == DEADLINE:
+                        await self.outbox.put({"type": "error", "id": message_id, "error": "Request deadline exceeded"})
+                    continue
+                await self.outbox.put({
+                    "type": "done",
+                    "id": message_id,
+                    "conversation_length": await self.engine.aconversation_length(self.user_id)
+                })
+
+    async def _send(self):
+        while True:
+            frames = [await self.outbox.get()]
+            while not self.outbox.empty() and len(frames) < 64:
+                frames.append(self.outbox.get_nowait())
+            for frame in self._merge_tokens(frames):
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(json.dumps(frame, ensure_ascii=False)),
+                                           self.send_timeout)
+                except asyncio.TimeoutError:
+                    raise SlowConsumer()
+
+    @staticmethod
+    def _merge_tokens(frames):
+        merged = []
+        for frame in frames:
+            previous = merged[-1] if merged else None
+            if (frame["type"] == "token" and previous is not None and previous["type"] == "token"
+                    and previous["id"] == frame["id"]):
+                merged[-1] = {**previous, "token": previous["token"] + frame["token"]}
+            else:
+                merged.append(frame)
+        return merged